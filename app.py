@@ -6,196 +6,158 @@
 
 ########################################################
 
-import pandas as pd
+import hashlib
+import json
+import os
+import re
+import signal
+import time
+
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import dash
+import flask
+from dash import dash_table
 from dash import dcc
 from dash import html
+from app_data import AppData, DataReloader, cached
 from dictionaries import *
+from exports import EXPORT_MIMETYPES
+from metrics import LATENCY_BUCKETS, SIZE_BUCKETS, Histogram, render_counter, render_info
+from scenarios import BASELINE, QUANTILES, SCENARIO_METRICS, sample_scenarios
 
-## Read in cleaned, (State, Year) - level data
-data = pd.read_excel('data/family_farmer_estimates_state_year_level.xlsx')
-data = data[data['State'] != "United States"] # only analyze every state
-data['Year'] = data['Year'].astype(str)
-# Join state codes
-state_codes = pd.read_csv('https://raw.githubusercontent.com/plotly/datasets/master/2011_us_ag_exports.csv').loc[:, ['code', 'state']]
-state_codes = state_codes.rename(columns = {'state': 'State'})
-data = data.merge(state_codes, on='State')
-
-###### COMPUTE NORMALIZATION METRICS #####
-## farmers per person, no feed
-data['farmers_no_feed_per_person'] = data['Farmers_in_animal_ag_no_feed'] / data['Total_Population']
-## farmers per person, feed
-data['farmers_feed_per_person'] = data['Farmers_in_animal_ag_feed'] / data['Total_Population']
-## farmers per registered voter, no feed
-data['farmers_no_feed_per_voter'] = data['Farmers_in_animal_ag_no_feed'] / data['Total_Registered']
-## farmers per registered voter, feed
-data['farmers_feed_per_voter'] = data['Farmers_in_animal_ag_feed'] / data['Total_Registered']
-###### END NORMALIZATION METRICS ######
+## SHARED_DATA=0 builds a private copy of the data in each worker, instead of memory-mapping the shared index
+SHARED_DATA = os.environ.get('SHARED_DATA', '1') == '1'
+## Seconds between two checks of the data files for a new version (0 only reloads on SIGHUP, see app_data.py)
+RELOAD_INTERVAL = float(os.environ.get('RELOAD_INTERVAL', 10))
 
-###### CREATE DASH APPLICATION ######
-app = dash.Dash(__name__)
-server = app.server
+## Figure cache settings: by default figures are built on first request and kept (LRU),
+## PREBUILD_FIGURES=1 builds every (metric, year) figure at startup instead
+## (FIGURE_CACHE_SIZE unset keeps every figure of the data version)
+FIGURE_CACHE_SIZE = int(os.environ['FIGURE_CACHE_SIZE']) if 'FIGURE_CACHE_SIZE' in os.environ else None
+PREBUILD_FIGURES = os.environ.get('PREBUILD_FIGURES', '0') == '1'
+## CLIENTSIDE_CALLBACKS=1 sends the data to the browser once and switches metrics without server requests
+CLIENTSIDE_CALLBACKS = os.environ.get('CLIENTSIDE_CALLBACKS', '0') == '1'
+## Browser / proxy cache lifetime of the figures served at /figures/ (revalidated with their ETag afterwards)
+FIGURE_MAX_AGE = int(os.environ.get('FIGURE_MAX_AGE', 3600))
+## Time between the years of the year slider animation
+PLAY_INTERVAL_MS = int(os.environ.get('PLAY_INTERVAL_MS', 1000))
+## Rows per page of the data tables (pages are sorted and filtered on the server, only the visible page is sent)
+TABLE_PAGE_SIZE = int(os.environ.get('TABLE_PAGE_SIZE', 15))
+## Decimals of the values shown in the tables, also used to compare them with the table filters
+TABLE_DECIMALS = 4
 
-app.layout = html.Div( 
-    children=[
-        # Header
-        html.H1(
-            children='Animal Farmers Dashboard',
-            style={
-                'textAlign': 'center',
-                'color': 'white',
-                'backgroundColor': 'darkcyan',
-                "padding-top": "10px",
-                "padding-bottom": "10px",
-            }
-        ),
-        # Description
-        html.Div(
-            children='Project Overview',
-            style={
-                'textAlign': 'left',
-                'color': 'Black',
-                'fontSize': '21px',
-                "font-weight": "bold",
-                'backgroundColor': 'white',
-                'margin-top': '3px',
-                'margin-bottom': '0px'
-            }
-        ),
-        html.Div(
-            children=[
-                html.Label(
-                    children = [
-                        'This dashboard provides estimates of the number of individuals and family-owned farmers involved in animal agriculture by U.S. state in 2012 and 2017. ',
-                        'The data used com from multiple sources: the Economic Research Service of the U.S. Department of Agriculture (', 
-                        dcc.Link('ERS data', href='https://data.ers.usda.gov/reports.aspx?ID=17832'),
-                        ')  the Natural Agricultural Statistics Service of the U.S.D.A. (',
-                        dcc.Link('NASS data', href='https://www.nass.usda.gov/Quick_Stats/CDQT/chapter/1/table/1'),
-                        ') and the U.S. Census Bureau Current Population Surveys (',
-                        dcc.Link('2018 CPS', href='https://www.census.gov/data/tables/time-series/demo/voting-and-registration/p20-583.html'),
-                        ', ',
-                        dcc.Link('2012 CPS', href='https://www.census.gov/data/tables/2012/demo/voting-and-registration/p20-568.html'),
-                        '). The dashboard computes two estimates of this measure: including and excluding feed commodities.'
-                    ],
-                ),
-                html.Div(
-                    children=[
-                        ' ',
-                        html.Br(),
-                        'We made the following proportionality assumptions due to the lack of specific data:',
-                        dcc.Markdown('''
-                                    1. Ratio of animal agriculture revenue in total agriculture revenue in the state is proportional to that ratio among individual and family farmers.
-                                    2. Proportion of individual and family farmers that vote is the same as average in the state.
-                                    3. We count each individual and family farm as ONE person - if you believe that the right number is N>1, multiply all reported numbers for family farmers by N.
-                                '''),
-                        html.Label(
-                            children = ['To access any of the links in this dashboard, right click on the hyperlink to open it in a new tab. ',
-                                'For additional details on data sources and metric calculations, refer to the ', 
-                                dcc.Link('project repository', href='https://github.com/Kendall-Kikkawa/Animal_Farmer_Numbers_Project/blob/main/README.md'),
-                                "."
-                            ]
-                        )
-                    ]
-                )
-            ],
-            style={
-                'color': 'black',
-                'display': 'inline-block',
-                'fontSize': '18px',
-                'backgroundColor': 'white',
-                "padding-top": "10px",
-                "padding-bottom": "10px",
-            }
-        ),
-        html.Hr(),        
-        # Map Dropdown
-        html.Div(
-            children='Select a metric to visualize in the maps and tables below', 
-            style={
-                'textAlign': 'left',
-                'color': 'black',
-                'fontSize': '21px',
-                "font-weight": "bold",
-                'backgroundColor': 'white',
-                'margin-bottom': '15px'
-            }
-        ),
-        dcc.Dropdown(
-            id='map_dropdown',
-            options=[{'label': v, 'value': k} for (k, v) in titles_Dict.items()],
-            value="Animal_ag_share_no_feed",
-            style={
-                'textAlign': 'left',
-                'color': 'black',
-                'backgroundColor': 'white',
-                'margin-bottom': '15px'
-            }
-        ),
-        ### Data Source
-        html.Div(
-            children=[
-                html.Label(
-                    'Data Source(s):  ', 
-                    style={
-                        'fontSize': '20px',
-                        "font-weight": "bold",
-                    }
-                ),
-                html.Label(
-                    '_', 
-                    style={
-                        "color": "white",
-                    }
-                ),
-                html.Label(
-                    id='metric_data_source',
-                    style={
-                        'fontSize': '18px',
-                    }
-                )
-            ],
-            style={
-                'textAlign': 'left',
-                'color': 'black',
-                'backgroundColor': 'white',
-                'margin-bottom': '10px'
-            }
-        ),
-        ### Calculation
-        html.Div(
-            children=[
-                html.Label(
-                    children='Calculation: ', 
-                    style={
-                        'fontSize': '20px',
-                        "font-weight": "bold",
-                    }
-                ),
-                html.Label(
-                    children='_', 
-                    style={
-                        "color": "white",
-                    }
-                ),
-                html.Label(
-                    id='metric_calculation',
-                    style={
-                        'fontSize': '18px',
-                    }
-                )
-            ],
-            style={
-                'textAlign': 'left',
-                'color': 'black',
-                'backgroundColor': 'white',
-                'margin-bottom': '15px'
-            }
-        ),
+
+def load_data():
+    """
+    Loads a new version of the data and builds its derived caches, before it is swapped in (see app_data.py)
+
+    Returns:
+        (AppData): data version
+    """
+    data = AppData.load(shared=SHARED_DATA)
+    warm_caches(data)
+    return data
+
+## Data read by the callbacks, one version at a time: per-year arrays and sort orders of every metric,
+## memory-mapped from the index written by snapshot.py (shared by every worker), or built from the snapshot
+## when the index is missing, the county index and geometry (only available when county estimates were
+## computed, see README), the exports and the scenario engine. Every callback reads reloader.current once,
+## new pipeline outputs, snapshots or indexes are loaded in the background and swapped in without restarts
+reloader = DataReloader(AppData.load(shared=SHARED_DATA), load_data, RELOAD_INTERVAL)
+
+
+@cached()
+def client_payload(data):
+    """
+    Builds the data sent once to the browser in clientside mode: per-year state codes and metric
+    values, per-year county values of the county metrics (see county_values), plus the labels of
+    dictionaries.py
+
+    Args:
+        data (AppData): data version
+
+    Returns:
+        (dict): JSON-ready payload of the app_data store
+    """
+    index = data.index
+    rows = {}
+    for year in data.years:
+        rows[year] = {'State': index.states[year].tolist(), 'code': index.codes[year].tolist()}
+        for metric in titles_Dict:
+            values = index.values[metric, year]
+            rows[year][metric] = np.where(np.isnan(values), None, values).tolist()
+    return {
+        'years': data.years,
+        'rows': rows,
+        'county': {metric: county_values(data, metric)['z'] for metric in data.county_metrics},
+        'decimals': TABLE_DECIMALS,
+        'titles': titles_Dict,
+        'legends': legends_Dict,
+        'sources': dataSources_Dict,
+        'calculations': calculations_Dict,
+        'colorscale': px.colors.sequential.speed,
+    }
+
+
+def data_table(table_id, name_label, code_label):
+    """
+    Builds a data table whose pages are sorted, filtered and served by the server (see update_table),
+    or by the browser in clientside mode
+
+    Args:
+        table_id (string): id of the table
+        name_label (string): header of the name column (e.g. 'State')
+        code_label (string): header of the code column (e.g. 'State Code')
+
+    Returns:
+        (list): empty table, sorted on the metric in descending order, and the message of its filter
+            (<table_id>_message, shown when the filter expression is not supported)
+    """
+    return [dash_table.DataTable(
+        id=table_id,
+        columns=[{'name': name_label, 'id': 'name'}, {'name': code_label, 'id': 'code'},
+                 {'name': '', 'id': 'value', 'type': 'numeric'}],
+        page_current=0,
+        page_size=TABLE_PAGE_SIZE,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='single',
+        sort_by=[{'column_id': 'value', 'direction': 'desc'}],
+        filter_action='custom',
+        filter_query='',
+        style_cell={'textAlign': 'left', 'backgroundColor': 'ghostwhite'},
+        style_header={'fontWeight': 'bold'},
+    ), html.Div(id=f'{table_id}_message', style={'color': 'darkred', 'textAlign': 'left'})]
+
+
+def county_layout(data):
+    """
+    Builds the county map section: the simplified geometry and the county codes are sent once,
+    in the county_geometry store, metric switches then only send per-year value arrays, and the
+    map of the year selected on the year slider is drawn in the browser
+
+    Args:
+        data (AppData): data version
+
+    Returns:
+        (list): components of the county section (empty without county data)
+    """
+    county_index = data.county_index
+    if county_index is None:
+        return []
+    geometry = {
+        'geojson': data.county_geojson,
+        'years': county_index.years,
+        'locations': {year: county_index.codes[year].tolist() for year in county_index.years},
+        'names': {year: county_index.states[year].tolist() for year in county_index.years},
+        'colorscale': px.colors.sequential.speed,
+    }
+    return [
         html.Hr(),
         html.Label(
-            ['Distribution of ', html.Label(id='selected_metric'), ' by State'],
+            'Distribution of the selected metric by County',
             style={
                 'textAlign': 'left',
                 'color': 'black',
@@ -206,67 +168,331 @@ app.layout = html.Div(
                 'margin-bottom': '4px'
             }
         ),
-        # 2017 Map and Table
-        html.Div([ 
-            html.Div(children=dcc.Graph(id='map_figure_2017',
-                                        figure={"layout": {"height": 300}}), 
+        dcc.Store(id='county_geometry', data=geometry),
+        dcc.Store(id='county_values'),
+        html.Div([
+            html.Div(children=dcc.Graph(id='county_map', figure={"layout": {"height": 300}}),
                 style={
                     'width': '48%',
                     'height': '100%',
                     'display': 'inline-block'
                     }
             ),
-            html.Div(children=dcc.Graph(id='table_figure_2017',
-                                        figure={"layout": {"height": 300}}),
+            html.Div(children=data_table('county_table', 'County', 'FIPS'),
                 style={
                     'width': '48%',
                     'height': '100%',
-                    'display': 'inline-block'
+                    'display': 'inline-block',
+                    'verticalAlign': 'top'
                     }
-                ),
+            )
         ],
         style={
             'textAlign': 'center',
             "padding-left": "5px",
             "padding-right": "5px",
             "padding-top": '2px',
-            "padding-bottom": '2px'
-        }),
-        # 2012 Map and Table
-        html.Div([ 
-            html.Div(children=dcc.Graph(id='map_figure_2012',
-                                        figure={"layout": {"height": 300}}), 
+            "padding-bottom": '0px'
+        })
+    ]
+
+def scenario_layout():
+    """
+    Builds the scenario section: one range slider per assumption of the estimates (see SCENARIO_SLIDERS),
+    and the band plot of the selected metric and year under the selected ranges (see scenario_figure)
+
+    Returns:
+        (list): components of the scenario section
+    """
+    sliders = []
+    for parameter, (label, low, high, step) in SCENARIO_SLIDERS.items():
+        sliders.append(html.Div([
+            html.Label(label, style={'fontSize': '16px'}),
+            dcc.RangeSlider(id=f'scenario_{parameter}', min=low, max=high, step=step,
+                            value=[BASELINE[parameter], BASELINE[parameter]],
+                            marks={low: f'{low:g}', BASELINE[parameter]: f'{BASELINE[parameter]:g}', high: f'{high:g}'},
+                            tooltip={'placement': 'bottom'}),
+        ],
+        style={
+            'width': '48%',
+            'display': 'inline-block',
+            'verticalAlign': 'top',
+            "padding-right": "10px"
+        }))
+    return [
+        html.Hr(),
+        html.Label(
+            'Sensitivity of the selected metric to the assumptions',
+            style={
+                'textAlign': 'left',
+                'color': 'black',
+                'fontSize': '21px',
+                "font-weight": "bold",
+                'backgroundColor': 'white',
+                'margin-top': '3px',
+                'margin-bottom': '4px'
+            }
+        ),
+        html.Div(
+            'Select a range for each assumption: the estimates of the selected metric and year are recomputed for '
+            'assumptions drawn in these ranges, and their spread is shown by state next to the published estimate.',
+            style={'textAlign': 'left', 'fontSize': '18px', 'margin-bottom': '10px'}
+        ),
+        html.Div(sliders, style={'textAlign': 'left'}),
+        dcc.Graph(id='scenario_figure', figure={"layout": {"height": 400}}),
+    ]
+
+###### CREATE DASH APPLICATION ######
+## Callback, layout and component responses are compressed (brotli or gzip, as accepted by the browser)
+## The county callbacks are registered without county data too, so that a reloaded data version can add the
+## county section to new page loads: their components are then missing from the layout, which is expected
+app = dash.Dash(__name__, compress=True, suppress_callback_exceptions=True)
+server = app.server
+
+
+@cached()
+def layout(data):
+    """
+    Builds the layout of the dashboard for a data version (years of the slider, county section, clientside data)
+
+    Args:
+        data (AppData): data version
+
+    Returns:
+        (html.Div): layout, built once per version
+    """
+    years = data.years
+    ## Years covered, for the project overview
+    years_text = ' and '.join(years) if len(years) <= 2 else f'from {years[0]} to {years[-1]}'
+    return html.Div(
+        children=[
+            # Header
+            html.H1(
+                children='Animal Farmers Dashboard',
                 style={
-                    'width': '48%',
-                    'height': '100%',
-                    'display': 'inline-block'}
-                ),
-            html.Div(children=dcc.Graph(id='table_figure_2012',
-                                        figure={"layout": {"height": 300}}), 
+                    'textAlign': 'center',
+                    'color': 'white',
+                    'backgroundColor': 'darkcyan',
+                    "padding-top": "10px",
+                    "padding-bottom": "10px",
+                }
+            ),
+            # Description
+            html.Div(
+                children='Project Overview',
                 style={
-                    'width': '48%',
-                    'height': '100%',
-                    'display': 'inline-block'
+                    'textAlign': 'left',
+                    'color': 'Black',
+                    'fontSize': '21px',
+                    "font-weight": "bold",
+                    'backgroundColor': 'white',
+                    'margin-top': '3px',
+                    'margin-bottom': '0px'
+                }
+            ),
+            html.Div(
+                children=[
+                    html.Label(
+                        children = [
+                            'This dashboard provides estimates of the number of individuals and family-owned farmers involved in animal agriculture by U.S. state in ' + years_text + '. ',
+                            'The data used com from multiple sources: the Economic Research Service of the U.S. Department of Agriculture (', 
+                            dcc.Link('ERS data', href='https://data.ers.usda.gov/reports.aspx?ID=17832'),
+                            ')  the Natural Agricultural Statistics Service of the U.S.D.A. (',
+                            dcc.Link('NASS data', href='https://www.nass.usda.gov/Quick_Stats/CDQT/chapter/1/table/1'),
+                            ') and the U.S. Census Bureau Current Population Surveys (',
+                            dcc.Link('2018 CPS', href='https://www.census.gov/data/tables/time-series/demo/voting-and-registration/p20-583.html'),
+                            ', ',
+                            dcc.Link('2012 CPS', href='https://www.census.gov/data/tables/2012/demo/voting-and-registration/p20-568.html'),
+                            '). The dashboard computes two estimates of this measure: including and excluding feed commodities.'
+                        ],
+                    ),
+                    html.Div(
+                        children=[
+                            ' ',
+                            html.Br(),
+                            'We made the following proportionality assumptions due to the lack of specific data:',
+                            dcc.Markdown('''
+                                        1. Ratio of animal agriculture revenue in total agriculture revenue in the state is proportional to that ratio among individual and family farmers.
+                                        2. Proportion of individual and family farmers that vote is the same as average in the state.
+                                        3. We count each individual and family farm as ONE person - if you believe that the right number is N>1, multiply all reported numbers for family farmers by N.
+                                    '''),
+                            html.Label(
+                                children = ['To access any of the links in this dashboard, right click on the hyperlink to open it in a new tab. ',
+                                    'For additional details on data sources and metric calculations, refer to the ', 
+                                    dcc.Link('project repository', href='https://github.com/Kendall-Kikkawa/Animal_Farmer_Numbers_Project/blob/main/README.md'),
+                                    "."
+                                ]
+                            )
+                        ]
+                    )
+                ],
+                style={
+                    'color': 'black',
+                    'display': 'inline-block',
+                    'fontSize': '18px',
+                    'backgroundColor': 'white',
+                    "padding-top": "10px",
+                    "padding-bottom": "10px",
+                }
+            ),
+            html.Hr(),        
+            # Map Dropdown
+            html.Div(
+                children='Select a metric to visualize in the maps and tables below', 
+                style={
+                    'textAlign': 'left',
+                    'color': 'black',
+                    'fontSize': '21px',
+                    "font-weight": "bold",
+                    'backgroundColor': 'white',
+                    'margin-bottom': '15px'
+                }
+            ),
+            dcc.Dropdown(
+                id='map_dropdown',
+                options=[{'label': v, 'value': k} for (k, v) in titles_Dict.items()],
+                value="Animal_ag_share_no_feed",
+                style={
+                    'textAlign': 'left',
+                    'color': 'black',
+                    'backgroundColor': 'white',
+                    'margin-bottom': '15px'
+                }
+            ),
+            ### Data Source
+            html.Div(
+                children=[
+                    html.Label(
+                        'Data Source(s):  ', 
+                        style={
+                            'fontSize': '20px',
+                            "font-weight": "bold",
+                        }
+                    ),
+                    html.Label(
+                        '_', 
+                        style={
+                            "color": "white",
+                        }
+                    ),
+                    html.Label(
+                        id='metric_data_source',
+                        style={
+                            'fontSize': '18px',
+                        }
+                    )
+                ],
+                style={
+                    'textAlign': 'left',
+                    'color': 'black',
+                    'backgroundColor': 'white',
+                    'margin-bottom': '10px'
+                }
+            ),
+            ### Calculation
+            html.Div(
+                children=[
+                    html.Label(
+                        children='Calculation: ', 
+                        style={
+                            'fontSize': '20px',
+                            "font-weight": "bold",
+                        }
+                    ),
+                    html.Label(
+                        children='_', 
+                        style={
+                            "color": "white",
+                        }
+                    ),
+                    html.Label(
+                        id='metric_calculation',
+                        style={
+                            'fontSize': '18px',
+                        }
+                    )
+                ],
+                style={
+                    'textAlign': 'left',
+                    'color': 'black',
+                    'backgroundColor': 'white',
+                    'margin-bottom': '15px'
+                }
+            ),
+            html.Hr(),
+            html.Label(
+                ['Distribution of ', html.Label(id='selected_metric'), ' by State'],
+                style={
+                    'textAlign': 'left',
+                    'color': 'black',
+                    'fontSize': '21px',
+                    "font-weight": "bold",
+                    'backgroundColor': 'white',
+                    'margin-top': '3px',
+                    'margin-bottom': '4px'
+                }
+            ),
+            # Year slider: the frames of every year are sent with the metric, so moving the slider (or playing
+            # the animation) swaps figures in the browser, without rebuilding them or requesting the server
+            html.Div([
+                html.Button('Play', id='play_button', n_clicks=0,
+                    style={
+                        'width': '6%',
+                        'verticalAlign': 'top',
+                        'margin-top': '4px'
                     }
                 ),
-        ],
-        style={
-            'textAlign': 'center',
-            "padding-left": "5px",
-            "padding-right": "5px",
-            "padding-top": '2px',
-            "padding-bottom": '0px'
-        })
-    ]
-)
+                html.Div(children=dcc.Slider(id='year_slider', min=int(years[0]), max=int(years[-1]), step=None,
+                                             value=int(years[-1]), marks={int(year): year for year in years}),
+                    style={
+                        'width': '90%',
+                        'display': 'inline-block'
+                    }
+                ),
+            ],
+            style={
+                'textAlign': 'left',
+                "padding-left": "5px",
+                "padding-right": "5px",
+                "padding-top": '2px',
+                "padding-bottom": '2px'
+            }),
+            dcc.Interval(id='play_interval', interval=PLAY_INTERVAL_MS, disabled=True),
+            dcc.Store(id='year_frames'),
+            # Map and Table of the selected year
+            html.Div([ 
+                html.Div(children=dcc.Graph(id='map_figure',
+                                            figure={"layout": {"height": 300}}), 
+                    style={
+                        'width': '48%',
+                        'height': '100%',
+                        'display': 'inline-block'
+                        }
+                ),
+                html.Div(children=data_table('state_table', 'State', 'State Code'),
+                    style={
+                        'width': '48%',
+                        'height': '100%',
+                        'display': 'inline-block',
+                        'verticalAlign': 'top'
+                        }
+                    ),
+            ],
+            style={
+                'textAlign': 'center',
+                "padding-left": "5px",
+                "padding-right": "5px",
+                "padding-top": '2px',
+                "padding-bottom": '0px'
+            })
+        ] + scenario_layout() + county_layout(data) + ([dcc.Store(id='app_data', data=client_payload(data))] if CLIENTSIDE_CALLBACKS else [])
+    )
+
+
+## The layout is served per page load, from the data version current at that time
+app.layout = lambda: layout(reloader.current)
 
 
-@app.callback(
-    dash.dependencies.Output('metric_data_source', 'children'),
-    dash.dependencies.Output('metric_calculation', 'children'),
-    dash.dependencies.Output('selected_metric', 'children'),
-    [dash.dependencies.Input('map_dropdown', 'value')]
-)
 def get_metric(value):
     """Gets selected metric to update titles for maps and tables
 
@@ -281,41 +507,39 @@ def get_metric(value):
     return dataSources_Dict[value], calculations_Dict[value], titles_Dict[value]
 
 
-@app.callback(
-    dash.dependencies.Output('map_figure_2012', 'figure'),
-    dash.dependencies.Output('map_figure_2017', 'figure'),
-    [dash.dependencies.Input('map_dropdown', 'value')])
-def update_map(value):
+@cached()
+def metric_range(data, value):
     """
-    Updates the Map based upon the desired quantity to plot - the figure plots the value in each state of
-    the U.S. in the years 2017 and 2012
+    Range of a metric over every year, shared by the maps of all years
 
     Args:
+        data (AppData): data version
         value (string): String describing the metric to be plotted
 
     Returns:
-        map_figure_2012 (px.Figure): 2012 map to be displayed on the Dash app
-        map_figure_2017 (px.Figure): 2017 map to be displayed on the Dash app
+        (tuple): smallest and largest values (None if the metric has no values)
     """
-    # 2012 Map
-    data_2012 = data[data['Year'] == '2012']
-    fig_2012 = px.choropleth(data_2012,
-        locations = 'code', # State Code for spatial coordinates
-        color = value, # Data to be color-coded
-        locationmode = 'USA-states', # set of locations match entries in `locations`
-        scope='usa',
-        labels={
-            value: legends_Dict[value]
-        },
-        title='2012',
-        color_continuous_scale="speed",
-    )
-    fig_2012.update_layout(margin=dict(r=10, l=10, t=50, b=10),
-                            paper_bgcolor="ghostwhite")
+    values = np.concatenate([data.index.values[value, year] for year in data.years])
+    values = values[~np.isnan(values)]
+    return (float(values.min()), float(values.max())) if len(values) else None
+
 
-    # 2017 Map
-    data_2017 = data[data['Year'] == '2012']
-    fig_2017 = px.choropleth(data_2017,
+###### FIGURE CACHE ######
+## Every (metric, year) figure is built once per data version, then served from the cache as a plain (JSON-ready) dict
+@cached(FIGURE_CACHE_SIZE)
+def map_figure(data, value, year):
+    """
+    Builds the map of a metric in a given year
+
+    Args:
+        data (AppData): data version
+        value (string): String describing the metric to be plotted
+        year (string): Year to be plotted
+
+    Returns:
+        (dict): map figure, serialized to plain python objects
+    """
+    fig = px.choropleth({'code': data.index.codes[year], value: data.index.values[value, year]},
         locations = 'code', # State Code for spatial coordinates
         color = value, # Data to be color-coded
         locationmode = 'USA-states', # set of locations match entries in `locations`
@@ -323,89 +547,673 @@ def update_map(value):
         labels={
             value: legends_Dict[value]
         },
-        title='2017',
+        title=year,
         color_continuous_scale="speed",
+        range_color=metric_range(data, value), # same colors in every year of the year slider
     )
-    fig_2017.update_layout(margin=dict(r=10, l=10, t=50, b=10),
-                            paper_bgcolor="ghostwhite")
+    fig.update_layout(margin=dict(r=10, l=10, t=50, b=10),
+                        paper_bgcolor="ghostwhite")
+
+    return json.loads(fig.to_json())
+
+
+@cached(FIGURE_CACHE_SIZE)
+def table_figure(data, value, year):
+    """
+    Builds the table of a metric in a given year: State, code and the metric, sorted on the metric
+
+    Args:
+        data (AppData): data version
+        value (string): String describing the metric to be plotted
+        year (string): Year to be plotted
+
+    Returns:
+        (dict): table figure, serialized to plain python objects
+    """
+    ### Rows of the year, sorted on the metric
+    states, codes, values = data.index.sorted_rows(value, year)
+
+    ### Create Table
+    fig = go.Figure()
+    fig.add_table(cells=dict(
+                        values=[states.tolist(), codes.tolist(), np.round(values, TABLE_DECIMALS).tolist()]
+                    ), 
+                    header=dict(
+                        values=['State', 'State Code', titles_Dict[value] + ' in ' + year]
+                    ),
+                    columnwidth=[0.23, 0.12, 0.65]
+             )
+    fig.update_layout(margin=dict(r=10, l=10, t=10, b=10),
+                        paper_bgcolor="ghostwhite")
+
+    return json.loads(fig.to_json())
+
+
+def prebuild_figures(data):
+    """
+    Builds every map and table figure of a data version, so that no callback has to construct a figure
+    """
+    for value in titles_Dict:
+        for year in data.years:
+            map_figure(data, value, year)
+            table_figure(data, value, year)
+
+
+def warm_caches(data):
+    """
+    Builds what the first requests of a new data version would otherwise build, while the previous
+    version is still served: the computed metrics and their sort orders, the color ranges, the layout
+    and, with PREBUILD_FIGURES, every figure
+
+    Args:
+        data (AppData): data version, not served yet
+    """
+    for table_index in (data.index, data.county_index):
+        for value in (table_index.metrics if table_index is not None else []):
+            for year in table_index.years:
+                table_index.order[value, year]
+                table_index.valid[value, year]
+    for value in titles_Dict:
+        metric_range(data, value)
+    layout(data)
+    if PREBUILD_FIGURES:
+        prebuild_figures(data)
+
+if PREBUILD_FIGURES:
+    prebuild_figures(reloader.current)
+###### END FIGURE CACHE ######
+
+
+###### FIGURE ROUTES ######
+## GET /figures/<map|table>/<metric>/<year>.json serves the cached figures with validators: the ETag only
+## depends on the data version, metric and year, so repeat requests get a 304 without building the figure
+FIGURE_BUILDERS = {'map': map_figure, 'table': table_figure}
+
+
+@cached(FIGURE_CACHE_SIZE and 2 * FIGURE_CACHE_SIZE)
+def figure_json(data, kind, value, year):
+    """
+    Serializes a cached figure once, for the figure routes
+
+    Args:
+        data (AppData): data version
+        kind (string): 'map' or 'table'
+        value (string): String describing the metric to be plotted
+        year (string): Year to be plotted
+
+    Returns:
+        (bytes): figure as JSON
+    """
+    return json.dumps(FIGURE_BUILDERS[kind](data, value, year), separators=(',', ':')).encode()
+
+
+def figure_etag(data, kind, value, year):
+    # Figures only change with the data: the digest of the estimates the index was built from
+    return hashlib.sha256(f'{data.version}/{kind}/{value}/{year}'.encode()).hexdigest()[:32]
+
+
+@server.route('/figures/<kind>/<value>/<year>.json')
+def serve_figure(kind, value, year):
+    """
+    Serves a map or table figure, or a 304 when the client already has this version of it
+
+    Args:
+        kind (string): 'map' or 'table'
+        value (string): String describing the metric to be plotted
+        year (string): Year to be plotted
+
+    Returns:
+        (flask.Response): figure JSON with ETag and Cache-Control headers, or an empty 304 response
+    """
+    data = reloader.current
+    if kind not in FIGURE_BUILDERS or value not in titles_Dict or year not in data.years:
+        flask.abort(404)
+    etag = figure_etag(data, kind, value, year)
+    # Weak validator: the compressed and uncompressed bodies are the same figure
+    if flask.request.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(figure_json(data, kind, value, year), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = FIGURE_MAX_AGE
+    return response
+###### END FIGURE ROUTES ######
+
+
+###### DOWNLOAD ROUTES ######
+## GET /download/<state_year|state>.<csv|xlsx|parquet> serves the estimates, optionally filtered with the
+## repeatable (or comma separated) metric, year and state query parameters, e.g.
+## /download/state_year.csv?metric=Number_of_Family_Farmers&year=2012,2017&state=Iowa
+## Unfiltered downloads stream the files precomputed for the data version (see exports.py), filtered CSV
+## downloads are streamed in chunks of rows, filtered xlsx / Parquet files are written once per filter
+
+def query_values(name):
+    values = [value.strip() for arg in flask.request.args.getlist(name) for value in arg.split(',')]
+    return sorted({value for value in values if value}) or None
+
+
+def export_response(exports, table, fmt, filters, key):
+    if not any(filters.values()):
+        return flask.send_file(exports.path(table, fmt), mimetype=EXPORT_MIMETYPES[fmt], conditional=False)
+    try:
+        df = exports.select(table, filters['metric'], filters['year'], filters['state'])
+    except ValueError as error:
+        flask.abort(400, description=str(error))
+    if fmt == 'csv':
+        return flask.Response(exports.iter_csv(df), mimetype=EXPORT_MIMETYPES[fmt])
+    path = exports.filtered_path(table, fmt, df, key)
+    return flask.send_file(path, mimetype=EXPORT_MIMETYPES[fmt], conditional=False)
+
+
+@server.route('/download/<table>.<fmt>')
+def download(table, fmt):
+    """
+    Serves the (State, Year) or State level estimates as a file download
+
+    Args:
+        table (string): 'state_year' or 'state'
+        fmt (string): 'csv', 'xlsx' or 'parquet'
+
+    Returns:
+        (flask.Response): streamed file with ETag and Cache-Control headers, or an empty 304 response
+    """
+    exports = reloader.current.exports
+    if exports is None or table not in exports.tables or fmt not in EXPORT_MIMETYPES:
+        flask.abort(404)
+    if fmt not in exports.formats():
+        flask.abort(406, description=f"{fmt} exports need a parquet engine (pyarrow) on the server")
+    filters = {name: query_values(name) for name in ('metric', 'year', 'state')}
+    key = json.dumps(filters, sort_keys=True)
+    etag = hashlib.sha256(f'{exports.version}/{table}.{fmt}/{key}'.encode()).hexdigest()[:32]
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        try:
+            response = export_response(exports, table, fmt, filters, key)
+        except FileNotFoundError:
+            # The exports of this data version were pruned (see exports.KEEP_EXPORT_VERSIONS): load the current one
+            reloader.request_reload()
+            flask.abort(503, description="The data is being reloaded, retry in a few seconds")
+    response.set_etag(etag)
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.{fmt}'
+    response.cache_control.public = True
+    response.cache_control.max_age = FIGURE_MAX_AGE
+    return response
+###### END DOWNLOAD ROUTES ######
+
+
+###### SCENARIO ROUTES ######
+## GET /scenarios/<metric>/<year>.json re-evaluates a farmer estimate under sampled assumptions and returns
+## its quantile bands by state, e.g. /scenarios/Farmers_in_animal_ag_feed/2017.json?persons_per_farm=1,3&feed_weight=0,1
+## Every parameter of scenarios.BASELINE takes a "low,high" range or a single value, n sets the number of
+## scenarios (at most MAX_SCENARIOS) and seed the random draws, so the same query always gets the same bands
+MAX_SCENARIOS = int(os.environ.get('MAX_SCENARIOS', 10000))
+## Assumption sliders of the scenario section of the dashboard: parameter -> (label, min, max, step), each starting
+## at its BASELINE value, and the number of scenarios drawn for its band plot
+SCENARIO_SLIDERS = {
+    'persons_per_farm': ('Persons per family farm', 1, 5, 0.5),
+    'feed_weight': ('Share of the feed crops revenue counted as animal agriculture', 0, 1, 0.1),
+    'registered_factor': ('Multiplier of the registered voters', 0.5, 1.5, 0.05),
+    'population_factor': ('Multiplier of the population', 0.5, 1.5, 0.05),
+}
+SCENARIO_PLOT_SAMPLES = int(os.environ.get('SCENARIO_PLOT_SAMPLES', 2000))
+
+
+@cached(256)
+def scenario_json(data, value, year, ranges, n, seed):
+    """
+    Computes the quantile bands of a metric once per query and data version
+
+    Args:
+        data (AppData): data version
+        value (string): metric of scenarios.SCENARIO_METRICS
+        year (string): Year to be evaluated
+        ranges (tuple): sorted (parameter, (low, high)) pairs
+        n (int): number of scenarios
+        seed (int): seed of the random draws
+
+    Returns:
+        (bytes): states, baseline values and quantile bands as JSON
+    """
+    table = data.scenario_engine.bands_table(sample_scenarios(n, dict(ranges), seed), value, year)
+    # NaN (states without data) is not valid JSON
+    table = table.astype(object).where(table.notna(), None)
+    return json.dumps({'metric': value, 'year': year, 'scenarios': n, 'parameters': dict(ranges),
+                       'quantiles': list(QUANTILES), **table.to_dict(orient='list')},
+                      separators=(',', ':')).encode()
+
+
+@cached(256)
+def scenario_figure(data, value, year, ranges):
+    """
+    Builds the band plot of the scenario section: by state, the published value of a metric and the
+    spread of its values under the assumption ranges of the sliders
+
+    Args:
+        data (AppData): data version
+        value (string): String describing the metric to be plotted
+        year (string): Year to be plotted
+        ranges (tuple): (parameter, (low, high)) pairs, in the order of SCENARIO_SLIDERS
+
+    Returns:
+        (dict): figure, serialized to plain python objects
+    """
+    fig = go.Figure()
+    fig.update_layout(margin=dict(r=10, l=10, t=50, b=10), paper_bgcolor="ghostwhite", height=400)
+    if value not in SCENARIO_METRICS or year not in data.years:
+        fig.update_layout(title=f"{titles_Dict[value]} does not depend on the assumptions below",
+                          xaxis={'visible': False}, yaxis={'visible': False})
+        return json.loads(fig.to_json())
+
+    ### Quantile bands of every state, sorted on the published value
+    table = data.scenario_engine.bands_table(sample_scenarios(SCENARIO_PLOT_SAMPLES, dict(ranges)), value, year)
+    table = table.sort_values('baseline', ascending=False)
+    states = table['State'].tolist()
+    for low, high, name, color in [('q05', 'q95', '5% to 95% of the scenarios', 'rgba(0, 139, 139, 0.2)'),
+                                   ('q25', 'q75', '25% to 75% of the scenarios', 'rgba(0, 139, 139, 0.4)')]:
+        fig.add_scatter(x=states, y=table[high], mode='lines', line={'width': 0}, showlegend=False, hoverinfo='skip')
+        fig.add_scatter(x=states, y=table[low], mode='lines', line={'width': 0}, fill='tonexty', fillcolor=color,
+                        name=name, hoverinfo='skip')
+    fig.add_scatter(x=states, y=table['q50'], mode='lines', line={'color': 'darkcyan'}, name='Median of the scenarios')
+    fig.add_scatter(x=states, y=table['baseline'], mode='markers', marker={'color': 'black', 'size': 5},
+                    name='Published estimate')
+    fig.update_layout(title=f"{titles_Dict[value]} in {year}, over {SCENARIO_PLOT_SAMPLES} scenarios",
+                      yaxis={'title': legends_Dict[value]}, legend={'orientation': 'h'})
+
+    return json.loads(fig.to_json())
+
+
+def update_scenarios(value, year, *bounds):
+    """
+    Gets the band plot of the selected metric and year under the assumption ranges of the sliders
 
-    return fig_2012, fig_2017
+    Args:
+        value (string): String describing the metric to be plotted
+        year (int): Year selected on the year slider
+        bounds (list): [low, high] range of each parameter of SCENARIO_SLIDERS
+
+    Returns:
+        (dict): figure, from the scenario figure cache
+    """
+    ranges = tuple((parameter, tuple(bounds)) for parameter, bounds in zip(SCENARIO_SLIDERS, bounds))
+    return scenario_figure(reloader.current, value, str(year), ranges)
+
+
+@server.route('/scenarios/<value>/<year>.json')
+def serve_scenarios(value, year):
+    """
+    Serves the quantile bands of a metric under the assumption ranges of the query
+
+    Args:
+        value (string): metric of scenarios.SCENARIO_METRICS
+        year (string): Year to be evaluated
+
+    Returns:
+        (flask.Response): bands as JSON, with ETag and Cache-Control headers
+    """
+    data = reloader.current
+    if value not in SCENARIO_METRICS or year not in data.years:
+        flask.abort(404)
+    args = flask.request.args
+    try:
+        ranges = tuple(sorted((parameter, tuple(float(bound) for bound in args[parameter].split(',')))
+                              for parameter in BASELINE if parameter in args))
+        n = int(args.get('n', 1000))
+        seed = int(args.get('seed', 0))
+    except ValueError:
+        flask.abort(400, description="Scenario parameters must be numbers, or low,high ranges of numbers")
+    if not 0 < n <= MAX_SCENARIOS or any(len(bounds) > 2 for _, bounds in ranges):
+        flask.abort(400, description=f"n must be between 1 and {MAX_SCENARIOS}, and ranges have two bounds")
+    etag = hashlib.sha256(f'{data.version}/{value}/{year}/{ranges}/{n}/{seed}'.encode()).hexdigest()[:32]
+    if flask.request.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(scenario_json(data, value, year, ranges, n, seed), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = FIGURE_MAX_AGE
+    return response
+###### END SCENARIO ROUTES ######
 
 
-@app.callback(
-    [dash.dependencies.Output('table_figure_2012', 'figure'), 
-    dash.dependencies.Output('table_figure_2017', 'figure')],
-    dash.dependencies.Input('map_dropdown', 'value'))
-def update_table(value):
+def update_frames(value):
     """
-    Updates the Table based upon the desired quantity to sort on, drops all other columns
-    - rearranges table so that sorted table goes 3rd (after State, code)
+    Gets the map of every year for the selected metric, the frames of the year slider
 
     Args:
         value (string): String describing the metric to be plotted
 
     Returns:
-        table_figure_2012 (px.Figure): 2012 table to be displayed on the Dash app
-        table_figure_2017 (px.Figure): 2017 table to be displayed on the Dash app
-    """
-    ### Create Data Frame for 2012
-    data_2012 = data[data['Year'] == '2012']
-    data_2012 = data_2012.reset_index()
-    data_2012 = data_2012.drop(columns=['Year'])
-    # Shift code and value columns
-    code_col = data_2012.pop('code')
-    data_2012.insert(1, 'code', code_col)
-    value_col = data_2012.pop(value)
-    data_2012.insert(2, value, value_col)
-    # Drop all other columns
-    data_2012 = data_2012.loc[:, ['State', 'code', value]]
-    data_2012 = data_2012.sort_values(by=[value], ascending=False)
-    data_2012[value] = data_2012[value].round(4)
-
-    ### Create 2012 Table
-    fig_2012 = go.Figure()
-    fig_2012.add_table(cells=dict(
-                            values=[data_2012[col].tolist() for col in ['State', 'code', value]]
-                        ), 
-                        header=dict(
-                            values=['State', 'State Code', titles_Dict[value] + ' in 2012']
-                        ),
-                        columnwidth=[0.23, 0.12, 0.65]
-                 )
-    fig_2012.update_layout(margin=dict(r=10, l=10, t=10, b=10),
-                            paper_bgcolor="ghostwhite")
-
-    ### Create Data Frame for 2017
-    data_2017 = data[data['Year'] == '2017']
-    data_2017 = data_2017.reset_index()
-    data_2017 = data_2017.drop(columns=['Year'])
-    # Shift code and value columns
-    code_col = data_2017.pop('code')
-    data_2017.insert(1, 'code', code_col)
-    value_col = data_2017.pop(value)
-    data_2017.insert(2, value, value_col)
-    # Drop all other columns
-    data_2017 = data_2017.loc[:, ['State', 'code', value]]
-    data_2017 = data_2017.sort_values(by=[value], ascending=False)
-    data_2017[value] = data_2017[value].round(4)
-
-    ### Create 2017 Table
-    fig_2017 = go.Figure()
-    fig_2017.add_table(cells=dict(
-                            values=[data_2017[col].tolist() for col in ['State', 'code', value]]
-                        ), 
-                        header=dict(
-                            values=['State', 'State Code', titles_Dict[value] + ' in 2017']
-                        ),
-                        columnwidth=[0.23, 0.12, 0.65]
-                )
-    fig_2017.update_layout(margin=dict(r=10, l=10, t=10, b=10),
-                            paper_bgcolor="ghostwhite")
-
-    return fig_2012, fig_2017
+        (dict): year -> {'map': map figure}, figures from the figure cache
+    """
+    data = reloader.current
+    return {year: {'map': map_figure(data, value, year)} for year in data.years}
+
+
+## Filter expressions of the data tables, e.g. '{value} >= 1000 && {name} contains "ia"': one '{column} operator bound'
+## condition per part, operators written as symbols or names, prefixed with the case sensitivity (e.g. 'icontains')
+FILTER_PART = re.compile(r'^\s*\{(?P<column>[^}]*)\}\s+(?P<operator>\S+)(?:\s+(?P<bound>.*?))?\s*$')
+FILTER_OPERATORS = {'>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '=': 'eq', '!=': 'ne', 'ge': 'ge', 'le': 'le',
+                    'lt': 'lt', 'gt': 'gt', 'eq': 'eq', 'ne': 'ne', 'contains': 'contains'}
+## Operators of the name and code columns, matched case-insensitively ('eq' and 'ne' on the whole text)
+TEXT_OPERATORS = ('eq', 'ne', 'contains')
+
+
+def parse_filter_query(filter_query):
+    """
+    Parses the filter expression of a data table into conditions on the metric and text filters
+
+    Args:
+        filter_query (string): filter expression of the table, parts joined with ' && '
+
+    Returns:
+        conditions (list): (operator, bound) conditions on the value column
+        text_filters (list): ('name' or 'code', operator, text) filters
+
+    Raises:
+        ValueError: a part of the expression uses an operator the tables do not support (e.g. 'datestartswith'
+            or 'is blank'), or compares the metric with a bound that is not a number
+    """
+    conditions, text_filters = [], []
+    for part in filter(None, (filter_query or '').split(' && ')):
+        match = FILTER_PART.match(part)
+        operator = match and match.group('operator')
+        if operator and operator not in FILTER_OPERATORS and operator[:1] in ('s', 'i'):
+            operator = operator[1:]
+        if not match or operator not in FILTER_OPERATORS or match.group('bound') is None:
+            raise ValueError(f"Unsupported filter: {part.strip()} (use =, !=, <, <=, >, >= or contains)")
+        column, operator = match.group('column'), FILTER_OPERATORS[operator]
+        bound = match.group('bound').strip('"\'`')
+        if column == 'value' and operator != 'contains':
+            try:
+                conditions.append((operator, float(bound)))
+            except ValueError:
+                raise ValueError(f"Unsupported filter: {part.strip()} (the metric is compared with numbers)")
+        elif column in ('name', 'code'):
+            text_filters.append((column, operator, bound))
+        else:
+            raise ValueError(f"Unsupported filter: {part.strip()} (use =, !=, <, <=, >, >= on the metric)")
+    return conditions, text_filters
+
+
+def table_page(table_index, value, year, page_current, page_size, sort_by, filter_query):
+    """
+    Reads one page of a data table from the precomputed orders of an index (see DataIndex.page)
+
+    Args:
+        table_index (DataIndex): state or county index (None without county data)
+        value (string): String describing the metric to be shown
+        year (string): Year to be shown
+        page_current (int): page number, from 0
+        page_size (int): rows per page
+        sort_by (list): sort of the table, [{'column_id', 'direction'}]
+        filter_query (string): filter expression of the table
+
+    Returns:
+        data (list): rows of the page, as {'name', 'code', 'value'} records
+        page_count (int): number of pages of the filtered rows
+        message (string): why the filter was not applied (no rows are shown), or ''
+    """
+    if table_index is None or value not in table_index.metrics or year not in table_index.years:
+        return [], 1, ''
+    sort = sort_by[0] if sort_by else {'column_id': 'value', 'direction': 'desc'}
+    try:
+        conditions, text_filters = parse_filter_query(filter_query)
+    except ValueError as error:
+        return [], 1, str(error)
+    start = (page_current or 0) * page_size
+    # Bounds are compared with the values as shown, e.g. '= 0.7487' matches 0.74871234
+    rows, total = table_index.page(value, year, start, start + page_size, sort=sort['column_id'],
+                                   descending=sort['direction'] == 'desc', conditions=conditions,
+                                   text_filters=text_filters, decimals=TABLE_DECIMALS)
+    page_count = max(1, -(-total // page_size))
+    if not len(rows) and total:
+        # The filters left fewer pages than the current one: show the last page
+        start = (page_count - 1) * page_size
+        rows, _ = table_index.page(value, year, start, start + page_size, sort=sort['column_id'],
+                                   descending=sort['direction'] == 'desc', conditions=conditions,
+                                   text_filters=text_filters, decimals=TABLE_DECIMALS)
+    values = np.round(table_index.values[value, year][rows], TABLE_DECIMALS)
+    data = [{'name': name, 'code': code, 'value': None if np.isnan(number) else float(number)}
+            for name, code, number in zip(table_index.states[year][rows].tolist(),
+                                          table_index.codes[year][rows].tolist(), values.tolist())]
+    return data, page_count, ''
+
+
+def update_table(value, year, page_current, page_size, sort_by, filter_query):
+    """
+    Updates the page of the State table: the selected metric in the selected year, sorted and filtered
+    as set in the table
+
+    Args:
+        value (string): String describing the metric to be shown
+        year (int): Year selected on the year slider
+        page_current (int): page number, from 0
+        page_size (int): rows per page
+        sort_by (list): sort of the table
+        filter_query (string): filter expression of the table
+
+    Returns:
+        data (list): rows of the page
+        page_count (int): number of pages
+        columns (list): columns of the table, the metric header names the metric and year
+        message (string): why the filter was not applied, or ''
+    """
+    data, page_count, message = table_page(reloader.current.index, value, str(year), page_current, page_size,
+                                           sort_by, filter_query)
+    columns = [{'name': 'State', 'id': 'name'}, {'name': 'State Code', 'id': 'code'},
+               {'name': titles_Dict[value] + ' in ' + str(year), 'id': 'value', 'type': 'numeric'}]
+    return data, page_count, columns, message
+
+
+def update_county_table(value, year, page_current, page_size, sort_by, filter_query):
+    """
+    Updates the page of the County table (empty for metrics without county data)
+
+    Args:
+        value (string): String describing the metric to be shown
+        year (int): Year selected on the year slider
+        page_current (int): page number, from 0
+        page_size (int): rows per page
+        sort_by (list): sort of the table
+        filter_query (string): filter expression of the table
+
+    Returns:
+        data (list): rows of the page
+        page_count (int): number of pages
+        columns (list): columns of the table
+        message (string): why the filter was not applied, or ''
+    """
+    current = reloader.current
+    data, page_count, message = table_page(current.county_index, value, str(year), page_current, page_size,
+                                           sort_by, filter_query)
+    header = titles_Dict[value] + ' in ' + str(year)
+    if value not in current.county_metrics:
+        header += ' (not available by county)'
+    columns = [{'name': 'County', 'id': 'name'}, {'name': 'FIPS', 'id': 'code'},
+               {'name': header, 'id': 'value', 'type': 'numeric'}]
+    return data, page_count, columns, message
+
+
+@cached(FIGURE_CACHE_SIZE)
+def county_values(data, value):
+    """
+    Gets the per-year county values of a metric, once per data version
+
+    Args:
+        data (AppData): data version
+        value (string): String describing the metric to be plotted
+
+    Returns:
+        (dict): legend title and year -> list of county values (None if the metric has no county data)
+    """
+    if value not in data.county_metrics:
+        return {'legend': legends_Dict[value], 'z': None}
+    z = {}
+    for year in data.county_index.years:
+        values = data.county_index.values[value, year]
+        z[year] = np.where(np.isnan(values), None, values).tolist()
+    return {'legend': legends_Dict[value], 'z': z}
+
+
+def update_county_values(value):
+    """
+    Gets the per-year county values of the selected metric for the county maps (the geometry is
+    already in the browser, so only the value arrays are sent)
+
+    Args:
+        value (string): String describing the metric to be plotted
+
+    Returns:
+        (dict): legend title and year -> list of county values (None if the metric has no county data)
+    """
+    return county_values(reloader.current, value)
+
+
+###### REGISTER CALLBACKS ######
+## In clientside mode, the callbacks of assets/clientside.js recolor the maps and page, sort and filter the
+## tables in the browser from the app_data store, so switching metrics makes no request to the server
+metric_outputs = [dash.dependencies.Output('metric_data_source', 'children'),
+                  dash.dependencies.Output('metric_calculation', 'children'),
+                  dash.dependencies.Output('selected_metric', 'children')]
+frames_output = dash.dependencies.Output('year_frames', 'data')
+metric_input = dash.dependencies.Input('map_dropdown', 'value')
+year_input = dash.dependencies.Input('year_slider', 'value')
+
+if CLIENTSIDE_CALLBACKS:
+    app_data_state = dash.dependencies.State('app_data', 'data')
+    for outputs, function_name in [(metric_outputs, 'get_metric'), (frames_output, 'update_frames')]:
+        app.clientside_callback(
+            dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name=function_name),
+            outputs, metric_input, app_data_state
+        )
+else:
+    app.callback(metric_outputs, metric_input)(get_metric)
+    app.callback(frames_output, metric_input)(update_frames)
+
+## The year slider shows the precomputed frames of the selected year, and the play button moves it
+## through the years; both run in the browser
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name='show_year'),
+    dash.dependencies.Output('map_figure', 'figure'),
+    year_input, dash.dependencies.Input('year_frames', 'data')
+)
+
+## Tables are paged on the server (each request only sends the rows of the visible page), or in the browser
+## from the app_data store in clientside mode
+def table_callback(table_id):
+    return ([dash.dependencies.Output(table_id, 'data'), dash.dependencies.Output(table_id, 'page_count'),
+             dash.dependencies.Output(table_id, 'columns'), dash.dependencies.Output(f'{table_id}_message', 'children')],
+            [metric_input, year_input] + [dash.dependencies.Input(table_id, prop) for prop in
+                                          ('page_current', 'page_size', 'sort_by', 'filter_query')])
+
+if CLIENTSIDE_CALLBACKS:
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name='update_table'),
+        *table_callback('state_table'), app_data_state
+    )
+else:
+    app.callback(*table_callback('state_table'))(update_table)
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name='toggle_play'),
+    [dash.dependencies.Output('play_interval', 'disabled'), dash.dependencies.Output('play_button', 'children')],
+    dash.dependencies.Input('play_button', 'n_clicks'), dash.dependencies.State('play_interval', 'disabled')
+)
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name='next_year'),
+    dash.dependencies.Output('year_slider', 'value'),
+    dash.dependencies.Input('play_interval', 'n_intervals'),
+    dash.dependencies.State('year_slider', 'value'), dash.dependencies.State('year_slider', 'marks')
+)
+
+## The scenario bands are computed on the server in every mode, from the scenario engine of the data version
+app.callback(
+    dash.dependencies.Output('scenario_figure', 'figure'),
+    [metric_input, year_input] + [dash.dependencies.Input(f'scenario_{parameter}', 'value') for parameter in SCENARIO_SLIDERS]
+)(update_scenarios)
+
+## County maps are drawn in the browser from the county_geometry store and the county values
+## (registered without county data too, see suppress_callback_exceptions above)
+if CLIENTSIDE_CALLBACKS:
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name='county_values'),
+        dash.dependencies.Output('county_values', 'data'), metric_input, app_data_state
+    )
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name='update_county_table'),
+        *table_callback('county_table'), [app_data_state, dash.dependencies.State('county_geometry', 'data')]
+    )
+else:
+    app.callback(dash.dependencies.Output('county_values', 'data'), metric_input)(update_county_values)
+    app.callback(*table_callback('county_table'))(update_county_table)
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='animal_farmers', function_name='update_county_map'),
+    dash.dependencies.Output('county_map', 'figure'),
+    dash.dependencies.Input('county_values', 'data'), year_input,
+    dash.dependencies.State('county_geometry', 'data')
+)
+
+###### INSTRUMENTATION ######
+## Latency and payload size of every callback request, labeled by the callback outputs, and the
+## figure cache counters, served in the Prometheus text format at /metrics (per worker process)
+CALLBACK_LATENCY = Histogram('dash_callback_latency_seconds', 'Time spent serving a callback request',
+                             LATENCY_BUCKETS)
+CALLBACK_PAYLOAD = Histogram('dash_callback_payload_bytes', 'Size of the callback response body, before compression',
+                             SIZE_BUCKETS)
+
+
+@server.before_request
+def start_callback_timer():
+    flask.g.callback_start = time.perf_counter()
+
+
+@server.before_request
+def watch_data():
+    # Each worker watches the data files from its first request on (threads do not survive the fork of --preload)
+    reloader.watch()
+
+
+@server.after_request
+def observe_callback(response):
+    if flask.request.path.endswith('/_dash-update-component') and 'callback_start' in flask.g:
+        body = flask.request.get_json(silent=True) or {}
+        callback = body.get('output', 'unknown')
+        CALLBACK_LATENCY.observe(callback, time.perf_counter() - flask.g.callback_start)
+        CALLBACK_PAYLOAD.observe(callback, response.calculate_content_length() or 0)
+    return response
+
+
+@server.route('/metrics')
+def metrics():
+    """
+    Serves the callback histograms, the figure cache counters (of the current data version), the number
+    of data reloads and the current data version in the Prometheus text format
+
+    Returns:
+        (flask.Response): plain text exposition of the metrics
+    """
+    data = reloader.current
+    caches = {name: data.caches[name].cache_info() for name in ('map_figure', 'table_figure') if name in data.caches}
+    text = ''.join([
+        CALLBACK_LATENCY.render(),
+        CALLBACK_PAYLOAD.render(),
+        render_counter('dash_figure_cache_hits_total', 'Figures served from the figure cache',
+                       {name: info.hits for name, info in caches.items()}, label='cache'),
+        render_counter('dash_figure_cache_misses_total', 'Figures built on request',
+                       {name: info.misses for name, info in caches.items()}, label='cache'),
+        render_counter('dash_data_reloads_total', 'Data versions swapped in since the worker started',
+                       reloader.reloads),
+        # The version is a label of its own series only, so every reload does not add series to the others
+        render_info('dash_data_version_info', 'Data version served by the worker', 'data_version', data.version),
+    ])
+    return flask.Response(text, mimetype='text/plain; version=0.0.4')
 
 ###### END DASH APPLICATION ######
 
 
 if __name__ == '__main__':
+    # `kill -HUP <pid>` reloads the data right away (under gunicorn, HUP restarts the workers instead)
+    signal.signal(signal.SIGHUP, lambda signum, frame: reloader.request_reload())
+    reloader.watch()
     app.run_server(host='0.0.0.0')
@@ -0,0 +1,222 @@
+########################################################
+
+# VERSIONED DATA OF THE DASH APP, RELOADED WITHOUT RESTARTS
+# Everything app.py serves from the data (state and county indexes, county
+# geometry, downloadable exports, scenario engine, and the figures and
+# payloads cached from them) belongs to one AppData version. Callbacks read
+# the current version once and use it until they return, so a request never
+# mixes two versions of the data.
+# DataReloader watches the pipeline outputs, snapshots and indexes, builds
+# the new version in a background thread when they change, then swaps it in
+# with a single assignment. The previous version is freed as soon as the last
+# request reading it returns.
+
+########################################################
+
+import functools
+import os
+import threading
+import traceback
+import weakref
+
+from compute_animal_farmers import COUNTY_YEAR_PATH, OUTPUT_MANIFEST_PATH, STATE_PATH, STATE_YEAR_PATH, find_output
+from exports import load_exports
+from scenarios import ScenarioEngine
+from snapshot import (COUNTY_GEOJSON_PATH, COUNTY_SHARED_INDEX_PATH, COUNTY_SNAPSHOT_PATH, SHARED_INDEX_PATH,
+                      SNAPSHOT_PATH, load_county_snapshot, load_index)
+
+
+def data_signature() -> tuple:
+    """
+    Fingerprint of the files the app data is loaded from: the pipeline outputs (the files of the last run,
+    see find_output) and their manifest, the snapshots, the shared indexes and the county geometry
+    - only the files are stat'ed, so the signature is cheap enough to poll
+
+    Returns:
+        (tuple): (path, modification time, size) of every file, None for the missing ones
+    """
+    paths = [find_output(path) for path in (STATE_YEAR_PATH, STATE_PATH, COUNTY_YEAR_PATH)]
+    paths += [OUTPUT_MANIFEST_PATH, SNAPSHOT_PATH, os.path.join(SHARED_INDEX_PATH, 'meta.json'), COUNTY_SNAPSHOT_PATH,
+              os.path.join(COUNTY_SHARED_INDEX_PATH, 'meta.json'), COUNTY_GEOJSON_PATH]
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None))
+    return tuple(signature)
+
+
+class AppData:
+    """
+    One version of the data served by the app
+
+    Attributes:
+        version (str): digest of the estimates the state index was built from (figure and scenario ETags)
+        signature (tuple): data_signature() of the files, taken before they were read
+        index (DataIndex): state level index
+        years (list): years of the state index, as strings
+        county_index (DataIndex): county level index, or None without county data
+        county_geojson (dict): simplified county geometry, or None without county data
+        county_metrics (list): metrics of the county index
+        exports (ExportStore): downloadable exports, or None without pipeline outputs or exports
+        scenario_engine (ScenarioEngine): sensitivity engine of the state index
+        caches (dict): function name -> cache of the function for this version (see cached)
+    """
+
+    def __init__(self, signature: tuple, index, county_index, county_geojson, exports):
+        self.signature = signature
+        self.index = index
+        self.years = index.years
+        self.version = index.attrs.get('source_digest', '')[:16]
+        self.county_index = county_index
+        self.county_geojson = county_geojson
+        self.county_metrics = county_index.metrics if county_index is not None else []
+        self.exports = exports
+        self.scenario_engine = ScenarioEngine(index)
+        self.caches = {}
+
+    @classmethod
+    def load(cls, shared: bool = True) -> 'AppData':
+        """
+        Loads the current version of the data (see load_index, load_county_snapshot and load_exports)
+
+        Args:
+            shared (bool): memory-map the shared indexes (False builds private indexes)
+
+        Returns:
+            (AppData): data version
+        """
+        # Taken first: files written while loading change the signature again, and are picked up next
+        signature = data_signature()
+        index = load_index(shared=shared)
+        county_index, county_geojson = load_county_snapshot(shared=shared)
+        return cls(signature, index, county_index, county_geojson, load_exports())
+
+    def cache(self, name: str, function, maxsize: int = None):
+        """
+        Cache of function(self, *args) for this version, created on first use
+        - the cache only holds a weak reference to the version, so the version and its cached values are
+          freed together, without waiting for the garbage collector
+
+        Args:
+            name (str): name of the cache
+            function (callable): function of the data version and hashable arguments
+            maxsize (int): number of cached values (None keeps every value, least recently used are evicted first)
+
+        Returns:
+            (callable): cached function of the arguments, with cache_info and cache_clear
+        """
+        cache = self.caches.get(name)
+        if cache is None:
+            data = weakref.ref(self)
+            cache = self.caches.setdefault(name, functools.lru_cache(maxsize)(lambda *args: function(data(), *args)))
+        return cache
+
+
+def cached(maxsize: int = None):
+    """
+    Caches a function of (data, *args) per data version, like functools.lru_cache (see AppData.cache)
+
+    Args:
+        maxsize (int): number of cached values per version (None keeps every value)
+
+    Returns:
+        (callable): decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(data, *args):
+            return data.cache(function.__name__, function, maxsize)(*args)
+        return wrapper
+    return decorator
+
+
+class DataReloader:
+    """
+    Current data version of the app, replaced when the data files change
+    - watch starts a thread that polls data_signature() every `interval` seconds, and reloads once the
+      files changed and stayed unchanged for one interval (so that a snapshot being written is not read)
+    - request_reload wakes the thread to reload right away (e.g. from a signal handler), also when the
+      file watch is disabled
+    - the new version is built while the current one keeps serving, then swapped in with one assignment
+
+    Attributes:
+        current (AppData): data version served by new requests
+        reloads (int): number of versions swapped in since startup
+    """
+
+    def __init__(self, data: AppData, load, interval: float):
+        """
+        Args:
+            data (AppData): data version loaded at startup
+            load (callable): function loading a new data version (e.g. AppData.load)
+            interval (float): seconds between two polls of the data files (0 disables the file watch)
+        """
+        self.current = data
+        self.load = load
+        self.interval = interval
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._failed = None
+        self._pid = None
+        self._watch_lock = threading.Lock()
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Builds a new data version when the data files changed, and swaps it in
+
+        Args:
+            force (bool): reload even if the data files did not change
+
+        Returns:
+            (bool): whether a new version was swapped in
+        """
+        with self._lock:
+            signature = data_signature()
+            if not force and signature in (self.current.signature, self._failed):
+                return False
+            try:
+                data = self.load()
+            except Exception:
+                # Keep serving the current version, retry when the files change again
+                self._failed = signature
+                print(f"Data reload failed, still serving data version {self.current.version}")
+                traceback.print_exc()
+                return False
+            previous, self.current = self.current.version, data
+            self.reloads += 1
+            self._failed = None
+        print(f"Reloaded data version {previous} -> {data.version} in process {os.getpid()}")
+        return True
+
+    def request_reload(self):
+        self._wake.set()
+
+    def watch(self):
+        """
+        Starts the watch thread of this process, once (processes forked after startup, like gunicorn --preload
+        workers, start their own)
+        """
+        if self._pid == os.getpid():
+            return
+        with self._watch_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._watch, name='data-reloader', daemon=True).start()
+
+    def _watch(self):
+        pending = None
+        while True:
+            # Without file watch, the thread only serves request_reload
+            requested = self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            if not requested and self.interval <= 0:
+                continue
+            signature = data_signature()
+            if requested or (signature != self.current.signature and signature == pending):
+                self.reload(force=requested)
+            pending = signature
@@ -0,0 +1,269 @@
+/*
+ * Clientside callbacks of the dashboard
+ * - with CLIENTSIDE_CALLBACKS=1, the app_data store holds the per-year state codes and metric values (and the
+ *   county values) and the labels of dictionaries.py, so switching metrics builds the frames of every year,
+ *   and pages, sorts and filters the data tables, in the browser, without a server request (update_frames
+ *   mirrors the figures of map_figure in app.py, table_page the pages of table_page and DataIndex.page)
+ * - show_year, toggle_play and next_year (always clientside) show the frame of the year selected on the
+ *   year slider, and play the years as an animation, without rebuilding figures
+ * - update_county_map draws the county map (always clientside) from the county_geometry store, sent once,
+ *   and the per-year value arrays of the selected metric
+ */
+
+function colorscale_of(colors) {
+    var n = colors.length;
+    return colors.map(function(color, i) {
+        return [i / (n - 1), color];
+    });
+}
+
+// Smallest and largest values of the arrays (every year shares one color range), null without values
+function range_of(arrays) {
+    var low = Infinity, high = -Infinity;
+    arrays.forEach(function(values) {
+        values.forEach(function(value) {
+            if (value !== null) {
+                low = Math.min(low, value);
+                high = Math.max(high, value);
+            }
+        });
+    });
+    return low <= high ? [low, high] : null;
+}
+
+// Rounds like numpy.round (halves to even), so the tables show and filter the values the server shows
+function round_to(value, decimals) {
+    var scale = Math.pow(10, decimals);
+    var scaled = value * scale;
+    var rounded = Math.round(scaled);
+    if (rounded - scaled === 0.5 && rounded % 2 !== 0) {
+        rounded -= 1;
+    }
+    return rounded / scale;
+}
+
+// Filter expressions of the data tables, parsed like parse_filter_query in app.py
+var FILTER_PART = /^\s*\{([^}]*)\}\s+(\S+)(?:\s+(.*?))?\s*$/;
+var FILTER_OPERATORS = {'>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '=': 'eq', '!=': 'ne', 'ge': 'ge', 'le': 'le',
+                        'lt': 'lt', 'gt': 'gt', 'eq': 'eq', 'ne': 'ne', 'contains': 'contains'};
+var VALUE_FILTERS = {
+    ge: function(value, bound) { return value !== null && value >= bound; },
+    le: function(value, bound) { return value !== null && value <= bound; },
+    lt: function(value, bound) { return value !== null && value < bound; },
+    gt: function(value, bound) { return value !== null && value > bound; },
+    eq: function(value, bound) { return value !== null && value === bound; },
+    ne: function(value, bound) { return value !== bound; }
+};
+var TEXT_FILTERS = {
+    eq: function(text, bound) { return text === bound; },
+    ne: function(text, bound) { return text !== bound; },
+    contains: function(text, bound) { return text.indexOf(bound) >= 0; }
+};
+
+// Row filters of a filter expression, throws the message shown under the table for unsupported filters
+function parse_filter_query(filter_query) {
+    return (filter_query || '').split(' && ').filter(Boolean).map(function(part) {
+        var match = FILTER_PART.exec(part);
+        var operator = match && match[2];
+        if (operator && !(operator in FILTER_OPERATORS) && (operator[0] === 's' || operator[0] === 'i')) {
+            operator = operator.slice(1);
+        }
+        if (!match || !(operator in FILTER_OPERATORS) || match[3] === undefined) {
+            throw 'Unsupported filter: ' + part.trim() + ' (use =, !=, <, <=, >, >= or contains)';
+        }
+        var column = match[1];
+        operator = FILTER_OPERATORS[operator];
+        var bound = match[3].replace(/^["'`]+|["'`]+$/g, '');
+        if (column === 'value' && operator !== 'contains') {
+            var number = Number(bound);
+            if (bound.trim() === '' || isNaN(number)) {
+                throw 'Unsupported filter: ' + part.trim() + ' (the metric is compared with numbers)';
+            }
+            return function(row) { return VALUE_FILTERS[operator](row.value, number); };
+        }
+        if (column === 'name' || column === 'code') {
+            bound = bound.toLowerCase();
+            return function(row) { return TEXT_FILTERS[operator](String(row[column]).toLowerCase(), bound); };
+        }
+        throw 'Unsupported filter: ' + part.trim() + ' (use =, !=, <, <=, >, >= on the metric)';
+    });
+}
+
+// One page of a data table: rows sorted like DataIndex.page (missing values last in both directions), the
+// filters compare the values rounded to the decimals shown
+function table_page(names, codes, values, decimals, page_current, page_size, sort_by, filter_query) {
+    var filters;
+    try {
+        filters = parse_filter_query(filter_query);
+    } catch (message) {
+        return [[], 1, message];
+    }
+    var rows = names.map(function(name, i) {
+        var value = values[i] === null ? null : round_to(values[i], decimals);
+        return {name: name, code: codes[i], value: value, raw: values[i]};
+    }).filter(function(row) {
+        return filters.every(function(filter) { return filter(row); });
+    });
+    var sort = sort_by && sort_by.length ? sort_by[0] : {column_id: 'value', direction: 'desc'};
+    if (sort.column_id === 'value') {
+        var valid = rows.filter(function(row) { return row.raw !== null; });
+        valid.sort(function(a, b) { return b.raw - a.raw; });
+        if (sort.direction !== 'desc') {
+            valid.reverse();
+        }
+        rows = valid.concat(rows.filter(function(row) { return row.raw === null; }));
+    } else {
+        rows.sort(function(a, b) {
+            var x = String(a[sort.column_id]), y = String(b[sort.column_id]);
+            return x < y ? -1 : (x > y ? 1 : 0);
+        });
+        if (sort.direction === 'desc') {
+            rows.reverse();
+        }
+    }
+    var page_count = Math.max(1, Math.ceil(rows.length / page_size));
+    // The filters left fewer pages than the current one: show the last page
+    var start = Math.min(page_current || 0, page_count - 1) * page_size;
+    var data = rows.slice(start, start + page_size).map(function(row) {
+        return {name: row.name, code: row.code, value: row.value};
+    });
+    return [data, page_count, ''];
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    animal_farmers: {
+        get_metric: function(value, store) {
+            return [store.sources[value], store.calculations[value], store.titles[value]];
+        },
+
+        update_frames: function(value, store) {
+            var colorscale = colorscale_of(store.colorscale);
+            var legend = store.legends[value];
+            var range = range_of(store.years.map(function(year) { return store.rows[year][value]; }));
+            var frames = {};
+            store.years.forEach(function(year) {
+                var rows = store.rows[year];
+                var values = rows[value];
+                frames[year] = {
+                    map: {
+                        data: [{
+                            type: 'choropleth',
+                            locations: rows.code, // State Code for spatial coordinates
+                            z: values, // Data to be color-coded
+                            locationmode: 'USA-states',
+                            geo: 'geo',
+                            coloraxis: 'coloraxis',
+                            name: '',
+                            hovertemplate: 'code=%{location}<br>' + legend + '=%{z}<extra></extra>'
+                        }],
+                        layout: {
+                            geo: {scope: 'usa'},
+                            coloraxis: {
+                                colorscale: colorscale,
+                                colorbar: {title: {text: legend}},
+                                cmin: range ? range[0] : null,
+                                cmax: range ? range[1] : null
+                            },
+                            title: {text: year},
+                            margin: {r: 10, l: 10, t: 50, b: 10},
+                            paper_bgcolor: 'ghostwhite'
+                        }
+                    }
+                };
+            });
+            return frames;
+        },
+
+        update_table: function(value, year, page_current, page_size, sort_by, filter_query, store) {
+            year = String(year);
+            var rows = store.rows[year];
+            var page = rows ? table_page(rows.State, rows.code, rows[value], store.decimals, page_current, page_size,
+                                         sort_by, filter_query) : [[], 1, ''];
+            var columns = [{name: 'State', id: 'name'}, {name: 'State Code', id: 'code'},
+                           {name: store.titles[value] + ' in ' + year, id: 'value', type: 'numeric'}];
+            return [page[0], page[1], columns, page[2]];
+        },
+
+        county_values: function(value, store) {
+            return {legend: store.legends[value], z: store.county[value] || null};
+        },
+
+        update_county_table: function(value, year, page_current, page_size, sort_by, filter_query, store, geometry) {
+            year = String(year);
+            var values = store.county[value] && store.county[value][year];
+            var page = values ? table_page(geometry.names[year], geometry.locations[year], values, store.decimals,
+                                           page_current, page_size, sort_by, filter_query) : [[], 1, ''];
+            var header = store.titles[value] + ' in ' + year;
+            if (!store.county[value]) {
+                header += ' (not available by county)';
+            }
+            var columns = [{name: 'County', id: 'name'}, {name: 'FIPS', id: 'code'},
+                           {name: header, id: 'value', type: 'numeric'}];
+            return [page[0], page[1], columns, page[2]];
+        },
+
+        show_year: function(year, frames) {
+            var frame = frames && frames[String(year)];
+            if (!frame) {
+                return window.dash_clientside.no_update;
+            }
+            return frame.map;
+        },
+
+        toggle_play: function(n_clicks, disabled) {
+            if (!n_clicks) {
+                return [true, 'Play'];
+            }
+            return disabled ? [false, 'Pause'] : [true, 'Play'];
+        },
+
+        next_year: function(n_intervals, year, marks) {
+            if (!n_intervals) {
+                return window.dash_clientside.no_update;
+            }
+            var years = Object.keys(marks).map(Number).sort(function(a, b) { return a - b; });
+            // Back to the first year after the last one
+            var next = years.indexOf(year) + 1;
+            return years[next < years.length ? next : 0];
+        },
+
+        update_county_map: function(values, year, geometry) {
+            year = String(year);
+            var available = values && values.z && values.z[year];
+            var range = values && values.z ? range_of(Object.keys(values.z).map(function(y) { return values.z[y]; })) : null;
+            var legend = values ? values.legend : '';
+            var title = year;
+            if (geometry.years.indexOf(year) < 0) {
+                title = year + ' (no county data)';
+            } else if (!available) {
+                title = year + ' (not available by county)';
+            }
+            // The geometry object is reused by every figure, only the z array changes with the metric and year
+            return {
+                data: [{
+                    type: 'choropleth',
+                    geojson: geometry.geojson,
+                    featureidkey: 'id',
+                    locations: available ? geometry.locations[year] : [],
+                    z: available ? values.z[year] : [],
+                    text: available ? geometry.names[year] : [],
+                    coloraxis: 'coloraxis',
+                    marker: {line: {width: 0}},
+                    hovertemplate: '%{text}<br>' + legend + '=%{z}<extra></extra>'
+                }],
+                layout: {
+                    geo: {scope: 'usa'},
+                    coloraxis: {
+                        colorscale: colorscale_of(geometry.colorscale),
+                        colorbar: {title: {text: legend}},
+                        cmin: range ? range[0] : null,
+                        cmax: range ? range[1] : null
+                    },
+                    title: {text: title},
+                    margin: {r: 10, l: 10, t: 50, b: 10},
+                    paper_bgcolor: 'ghostwhite'
+                }
+            };
+        }
+    }
+});
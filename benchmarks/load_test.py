@@ -0,0 +1,425 @@
+########################################################
+
+# LOAD TEST OF THE DASHBOARD
+# Starts app:server under gunicorn on a local port, with a given number of
+# workers and threads, then replays the requests the browser sends while
+# users interact with the dashboard: page load, every metric of the metric
+# dropdown, every year of the year slider, and paging, sorting and filtering
+# the State table. Each simulated user is a thread with its own connection.
+# The request bodies are built from the callbacks the app declares
+# (/_dash-dependencies) and from its layout (/_dash-layout), so they match
+# what dash-renderer sends, including chained callbacks.
+# Reports throughput and p50/p95/p99 latency per callback, written to a JSON
+# file that can be compared between runs (e.g. to size workers and threads).
+# Run `python3 benchmarks/load_test.py --help` for the options.
+
+########################################################
+
+import argparse
+import gzip
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from run_benchmarks import REPO_DIR, RESULTS_DIR, git_commit
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app_dir: str, port: int, workers: int, threads: int, env: dict, log_path: str,
+                 timeout: float = 120) -> subprocess.Popen:
+    """
+    Starts app:server under gunicorn, and waits until it answers
+
+    Args:
+        app_dir (str): directory of app.py (its data is read relative to it)
+        port (int): local port to bind
+        workers (int): number of gunicorn worker processes
+        threads (int): number of threads per worker
+        env (dict): extra environment variables of the app (e.g. CLIENTSIDE_CALLBACKS)
+        log_path (str): file receiving the output of gunicorn
+        timeout (float): seconds to wait for the app to answer
+
+    Returns:
+        (subprocess.Popen): gunicorn process
+
+    Raises:
+        RuntimeError: gunicorn exited, or the app did not answer in time
+    """
+    command = [sys.executable, '-m', 'gunicorn', 'app:server', '--preload', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--threads', str(threads)]
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, cwd=app_dir, env=dict(os.environ, **env), stdout=log,
+                                   stderr=subprocess.STDOUT)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            with open(log_path) as log:
+                raise RuntimeError(f"gunicorn exited with status {process.returncode}:\n{log.read()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/_dash-layout')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"The app did not answer on port {port} within {timeout:.0f}s, see {log_path}")
+
+
+def parse_outputs(output: str) -> list:
+    """
+    Parses the output string of a callback ("id.property", or "..id.property...id.property.." for several
+    outputs) into (id, property) pairs
+    """
+    parts = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [tuple(part.rsplit('.', 1)) for part in parts]
+
+
+def component_props(layout) -> dict:
+    """
+    Initial properties of the components of a layout
+
+    Args:
+        layout (dict): layout as served at /_dash-layout
+
+    Returns:
+        (dict): (id, property) -> value, for every component with an id
+    """
+    props = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            component_id = node['props'].get('id')
+            for name, value in node['props'].items():
+                if component_id is not None and name != 'id':
+                    props[component_id, name] = value
+                if isinstance(value, (dict, list)):
+                    stack.append(value)
+    return props
+
+
+def component_ids(layout) -> set:
+    """
+    Ids of the components of a layout
+
+    Args:
+        layout (dict): layout as served at /_dash-layout
+
+    Returns:
+        (set): id of every component with an id
+    """
+    ids = set()
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            if node['props'].get('id') is not None:
+                ids.add(node['props']['id'])
+            stack.extend(value for value in node['props'].values() if isinstance(value, (dict, list)))
+    return ids
+
+
+class Callbacks:
+    """
+    Server-side callbacks of the app, with the request bodies dash-renderer sends for them
+    - like dash-renderer, callbacks whose inputs, outputs or states are not in the layout are never sent
+      (e.g. the county callbacks without county data)
+    """
+
+    def __init__(self, dependencies: list, layout: dict):
+        ids = component_ids(layout)
+        self.callbacks = []
+        for dependency in dependencies:
+            if dependency.get('clientside_function'):
+                continue
+            outputs = parse_outputs(dependency['output'])
+            inputs = [(item['id'], item['property']) for item in dependency['inputs']]
+            state = [(item['id'], item['property']) for item in dependency.get('state', [])]
+            if not all(component in ids for component, _ in outputs + inputs + state):
+                continue
+            self.callbacks.append({
+                'output': dependency['output'],
+                'outputs': outputs,
+                'inputs': inputs,
+                'state': state,
+                'initial': not dependency.get('prevent_initial_call', False),
+                # Label of the callback in the reports: the ids of its outputs
+                'label': '+'.join(dict.fromkeys(component for component, _ in outputs)),
+            })
+
+    def triggered_by(self, changed: list) -> list:
+        return [callback for callback in self.callbacks if set(callback['inputs']) & set(changed)]
+
+    def body(self, callback: dict, props: dict, changed: list) -> dict:
+        def items(pairs):
+            return [{'id': component, 'property': name, 'value': props.get((component, name))}
+                    for component, name in pairs]
+
+        outputs = [{'id': component, 'property': name} for component, name in callback['outputs']]
+        return {
+            'output': callback['output'],
+            'outputs': outputs if callback['output'].startswith('..') else outputs[0],
+            'inputs': items(callback['inputs']),
+            'state': items(callback['state']),
+            'changedPropIds': [f'{component}.{name}' for component, name in changed
+                               if (component, name) in callback['inputs']],
+        }
+
+
+class User(threading.Thread):
+    """
+    Simulated user: loads the page, then replays interactions until the end of the test
+
+    Each interaction changes component properties and sends the callbacks they trigger (and the callbacks
+    triggered by their outputs), like dash-renderer, recording (label, end time, seconds, status, bytes) per request.
+    """
+
+    def __init__(self, port: int, layout: dict, callbacks: Callbacks, interactions, stop_at: float,
+                 think: float, seed: int):
+        super().__init__(daemon=True)
+        self.port = port
+        self.layout = layout
+        self.callbacks = callbacks
+        self.interactions = interactions
+        self.stop_at = stop_at
+        self.think = think
+        self.random = random.Random(seed)
+        self.samples = []
+        self.connection = None
+
+    def request(self, label: str, method: str, path: str, body: dict = None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection = None
+            data, status = b'', 0
+        self.samples.append((label, time.time(), time.perf_counter() - start, status, len(data)))
+        return status, data
+
+    def fire(self, props: dict, changed: list):
+        """
+        Sends the callbacks triggered by changed properties, then the callbacks triggered by their outputs
+        """
+        while changed and time.time() < self.stop_at:
+            updated = []
+            for callback in self.callbacks.triggered_by(changed):
+                status, data = self.request(callback['label'], 'POST', '/_dash-update-component',
+                                            self.callbacks.body(callback, props, changed))
+                if status != 200:
+                    continue
+                try:
+                    response = json.loads(gzip.decompress(data) if data[:2] == b'\x1f\x8b' else data)
+                except ValueError:
+                    continue
+                for component, values in response.get('response', {}).items():
+                    for name, value in values.items():
+                        props[component, name] = value
+                        updated.append((component, name))
+            changed = updated
+
+    def run(self):
+        while time.time() < self.stop_at:
+            # Page load: index, layout and callback declarations, then the initial callbacks
+            for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+                self.request(f'GET {path}', 'GET', path)
+            props = component_props(self.layout)
+            initial = [pair for callback in self.callbacks.callbacks if callback['initial']
+                       for pair in callback['inputs']]
+            self.fire(props, list(dict.fromkeys(initial)))
+            for changes in self.interactions(props, self.random):
+                if time.time() >= self.stop_at:
+                    break
+                if self.think:
+                    time.sleep(self.random.expovariate(1 / self.think))
+                props.update(changes)
+                self.fire(props, list(changes))
+
+
+def dashboard_session(props: dict, rng: random.Random):
+    """
+    Interactions of a user exploring the dashboard: every metric of the metric dropdown (in a random order),
+    every year of the year slider, then paging, sorting and filtering the State table
+
+    Args:
+        props (dict): current component properties, (id, property) -> value
+        rng (random.Random): random generator of the user
+
+    Returns:
+        (generator): {(id, property): value} changes, one per interaction
+    """
+    metrics = [option['value'] for option in props.get(('map_dropdown', 'options'), [])]
+    rng.shuffle(metrics)
+    years = sorted(int(year) for year in props.get(('year_slider', 'marks'), {}))
+    for metric in metrics:
+        yield {('map_dropdown', 'value'): metric}
+        for year in years:
+            yield {('year_slider', 'value'): year}
+        if ('state_table', 'page_current') in props:
+            yield {('state_table', 'page_current'): 1}
+            yield {('state_table', 'sort_by'): [{'column_id': 'name', 'direction': 'asc'}],
+                   ('state_table', 'page_current'): 0}
+            yield {('state_table', 'filter_query'): '{value} > 0'}
+            yield {('state_table', 'filter_query'): '',
+                   ('state_table', 'sort_by'): [{'column_id': 'value', 'direction': 'desc'}]}
+
+
+def summarize(samples: list, start: float, stop: float) -> dict:
+    """
+    Throughput and latency percentiles of the samples recorded between start and stop, per label and in total
+
+    Returns:
+        (dict): label -> {'requests', 'errors', 'throughput', 'mean', 'p50', 'p95', 'p99', 'max', 'bytes_mean'},
+            latencies in seconds, throughput in requests per second; 'total' covers every request
+    """
+    samples = [sample for sample in samples if start <= sample[1] < stop]
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    groups = dict(sorted(groups.items()))
+    groups['total'] = samples
+    duration = stop - start
+    results = {}
+    for label, group in groups.items():
+        if not group:
+            continue
+        seconds = np.array([sample[2] for sample in group])
+        results[label] = {
+            'requests': len(group),
+            'errors': sum(1 for sample in group if sample[3] != 200),
+            'throughput': len(group) / duration,
+            'mean': float(seconds.mean()),
+            **{f'p{q}': float(value) for q, value in zip(PERCENTILES, np.percentile(seconds, PERCENTILES))},
+            'max': float(seconds.max()),
+            'bytes_mean': float(np.mean([sample[4] for sample in group])),
+        }
+    return results
+
+
+def compare(report: dict, baseline: dict):
+    """
+    Prints the throughput and p95 latency of two load test reports, and their ratio (p95 ratio > 1 means slower
+    than the baseline)
+
+    Args:
+        report (dict): current run, as written by this script
+        baseline (dict): baseline run, as written by this script
+    """
+    if report['config'] != baseline['config']:
+        changed = {key: (baseline['config'].get(key), value) for key, value in report['config'].items()
+                   if baseline['config'].get(key) != value}
+        print(f"Configuration differs from the baseline (baseline, current): {changed}")
+    print(f"\n{'callback':<56} {'req/s':>9} {'ratio':>7} {'p95 (ms)':>10} {'ratio':>7}")
+    for label, result in report['results'].items():
+        base = baseline['results'].get(label)
+        if base is None:
+            print(f"{label:<56} {result['throughput']:>9.1f} {'-':>7} {result['p95'] * 1000:>10.1f} {'-':>7}")
+            continue
+        print(f"{label:<56} {result['throughput']:>9.1f} {result['throughput'] / base['throughput']:>7.2f} "
+              f"{result['p95'] * 1000:>10.1f} {result['p95'] / base['p95']:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the dashboard under gunicorn with simulated users")
+    parser.add_argument('--workers', type=int, default=2, help="number of gunicorn workers (default: 2)")
+    parser.add_argument('--threads', type=int, default=1, help="number of threads per gunicorn worker (default: 1)")
+    parser.add_argument('--users', type=int, default=8, help="number of concurrent simulated users (default: 8)")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of measured load (default: 30)")
+    parser.add_argument('--warmup', type=float, default=5,
+                        help="seconds of load before the measurement, excluded from the report (default: 5)")
+    parser.add_argument('--think-ms', type=float, default=0,
+                        help="mean pause of a user between interactions, in ms (default: 0, as fast as possible)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the users (default: 0)")
+    parser.add_argument('--app-dir', default=REPO_DIR,
+                        help="directory of app.py and its data (default: the repository)")
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help="environment variables of the app, e.g. CLIENTSIDE_CALLBACKS=1 PREBUILD_FIGURES=1")
+    parser.add_argument('--output', default=None,
+                        help="path of the JSON report (default: benchmarks/results/load-<commit>-w<workers>-t<threads>.json)")
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    env = dict(item.split('=', 1) for item in args.env)
+    port = free_port()
+    log_path = os.path.join(tempfile.gettempdir(), f'animal_farmers_load_test_{port}.log')
+    print(f"Starting gunicorn: {args.workers} workers x {args.threads} threads on port {port} (log: {log_path})")
+    server = start_server(args.app_dir, port, args.workers, args.threads, env, log_path)
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        connection.request('GET', '/_dash-layout')
+        layout = json.loads(connection.getresponse().read())
+        connection.request('GET', '/_dash-dependencies')
+        callbacks = Callbacks(json.loads(connection.getresponse().read()), layout)
+
+        start = time.time() + args.warmup
+        stop = start + args.duration
+        print(f"{args.users} users, {args.warmup:.0f}s warmup, {args.duration:.0f}s measured")
+        users = [User(port, layout, callbacks, dashboard_session, stop, args.think_ms / 1000, args.seed + i)
+                 for i in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = summarize([sample for user in users for sample in user.samples], start, stop)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'workers': args.workers, 'threads': args.threads, 'users': args.users,
+                   'duration': args.duration, 'warmup': args.warmup, 'think_ms': args.think_ms,
+                   'seed': args.seed, 'env': env},
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{report['commit']}-w{args.workers}-t{args.threads}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'callback':<56} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}")
+    for label, result in results.items():
+        print(f"{label:<56} {result['requests']:>9} {result['errors']:>7} {result['throughput']:>9.1f} "
+              f"{result['p50'] * 1000:>10.1f} {result['p95'] * 1000:>10.1f} {result['p99'] * 1000:>10.1f}")
+    print(f"Wrote load test report {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,245 @@
+########################################################
+
+# BENCHMARK SUITE
+# Times the ERS cleaning, the full compute_animal_farmers.py pipeline,
+# the year reshapes and the dashboard callbacks on synthetic inputs
+# (see synthetic.py), and writes the timings to a JSON file named after
+# the current commit, so that runs can be compared between commits.
+# Run `python3 benchmarks/run_benchmarks.py --help` for the options.
+
+########################################################
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+import pandas as pd
+
+from synthetic import census_years, write_synthetic_inputs
+
+
+def git_commit() -> str:
+    """
+    Short hash of the current commit, with a "-dirty" suffix when the tree has uncommitted changes
+
+    Returns:
+        (str): commit of the benchmarked code, "unknown" outside of a git checkout
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR, check=True,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """
+    Times repeated calls of a function, with its printed output silenced
+
+    Args:
+        func (callable): function to be timed, called without arguments
+        repeat (int): number of timed calls
+        setup (callable): function called (untimed) before each call, e.g. to clear a cache
+
+    Returns:
+        (dict): min, median, mean and standard deviation of the call times in seconds, and every time
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'repeat': repeat,
+        'times': times,
+    }
+
+
+def benchmark_pipeline(repeat: int, workers: int, years: list) -> dict:
+    """
+    Benchmarks the ERS cleaning, the pipeline and the year reshapes, from the current directory
+    (a synthetic copy of the repository, see write_synthetic_inputs)
+    """
+    from cache import FrameCache
+    import compute_animal_farmers as caf
+    from stages import Pipeline
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        states = pd.read_excel(caf.ERS_PATH, sheet_name=0).iloc[:, 1].tolist()
+        sheets = caf.read_ers_sheets()
+    results = {}
+
+    ### ERS cleaning
+    results['clean_ers_data'] = measure(lambda: [caf.clean_ers_data(state) for state in states], repeat)
+    results['clean_ers_workbook'] = measure(lambda: caf.clean_ers_workbook(sheets), repeat)
+    results['build_ers_panel'] = measure(lambda: caf.build_ers_panel(workers=workers), repeat)
+    results['stream_ers_data'] = measure(lambda: caf.stream_ers_data(years=years, workers=workers), repeat)
+
+    ### Full pipeline: without cache, then every stage up to date
+    cache = FrameCache(os.path.join('.cache', 'benchmark'))
+
+    def run_pipeline():
+        Pipeline(caf.pipeline_stages(workers=workers, years=years), cache).run()
+
+    results['pipeline_cold'] = measure(run_pipeline, repeat, setup=cache.clear)
+    results['pipeline_warm'] = measure(run_pipeline, repeat)
+
+    ### Year reshapes, on the (State, Year) level output
+    state_year_data = pd.read_excel(caf.STATE_YEAR_PATH)
+    state_year_data['Year'] = state_year_data['Year'].astype(str)
+    results['rename_columns_by_year'] = measure(
+        lambda: [caf.rename_columns_by_year(state_year_data, year) for year in years], repeat)
+    results['widen_by_year'] = measure(lambda: caf.widen_by_year(state_year_data, years), repeat)
+
+    ### Output workbooks: pandas writer, then the streaming writer of the export stages
+    state_data = pd.read_excel(caf.STATE_PATH)
+    tmp_path = os.path.join('.cache', 'benchmark_output.xlsx')
+    results['to_excel'] = measure(lambda: [df.to_excel(tmp_path, index=False)
+                                           for df in (state_year_data, state_data)], repeat)
+    results['write_xlsx'] = measure(lambda: [caf.write_xlsx(df, tmp_path) for df in (state_year_data, state_data)],
+                                    repeat)
+
+    return results
+
+
+def benchmark_callbacks(repeat: int) -> dict:
+    """
+    Benchmarks the dashboard callbacks for every metric, building every figure (cold) and from the
+    figure cache (warm), from the current directory (after benchmark_pipeline)
+    """
+    from snapshot import build_shared_index, build_snapshot
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_shared_index(build_snapshot())
+        import app
+    metrics = list(app.titles_Dict)
+    data = app.reloader.current
+
+    def clear_figures():
+        for name in ('map_figure', 'table_figure'):
+            data.caches.pop(name, None)
+
+    results = {}
+    results['update_frames_cold'] = measure(lambda: [app.update_frames(metric) for metric in metrics], repeat,
+                                            setup=clear_figures)
+    results['update_frames_warm'] = measure(lambda: [app.update_frames(metric) for metric in metrics], repeat)
+
+    # Pages of the State table: first page, a page sorted by name and a filtered page, for every metric
+    page_requests = [(0, [{'column_id': 'value', 'direction': 'desc'}], ''),
+                     (2, [{'column_id': 'name', 'direction': 'asc'}], ''),
+                     (0, [{'column_id': 'value', 'direction': 'asc'}], '{value} > 0.001 && {name} contains "a"')]
+    results['table_page'] = measure(
+        lambda: [app.update_table(metric, data.years[-1], page, app.TABLE_PAGE_SIZE, sort_by, filter_query)
+                 for metric in metrics for page, sort_by, filter_query in page_requests], repeat)
+
+    # Quantile bands of every scenario metric for the latest year, over 10,000 assumption sets
+    from scenarios import SCENARIO_METRICS, sample_scenarios
+    scenarios = sample_scenarios(10000, {'persons_per_farm': (1, 3), 'feed_weight': (0, 1), 'registered_factor': (0.8, 1.2)})
+    results['scenario_bands'] = measure(
+        lambda: [data.scenario_engine.bands_table(scenarios, metric, data.years[-1]) for metric in SCENARIO_METRICS], repeat)
+
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    """
+    Prints the median times of two benchmark runs and their ratio (> 1 means slower than the baseline)
+
+    Args:
+        results (dict): current run, as written by this script
+        baseline (dict): baseline run, as written by this script
+    """
+    if results['scale'] != baseline['scale']:
+        print(f"Warning: the baseline ran at a different scale {baseline['scale']}")
+    print(f"{'benchmark':<24} {baseline['commit']:>14} {results['commit']:>14} {'ratio':>7}")
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            print(f"{name:<24} {'-':>14} {result['median']:>13.4f}s {'-':>7}")
+            continue
+        median = baseline['results'][name]['median']
+        print(f"{name:<24} {median:>13.4f}s {result['median']:>13.4f}s {result['median'] / median:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline and the dashboard callbacks on synthetic data")
+    parser.add_argument('--regions', type=int, default=51, help="number of regions, including United States (default: 51)")
+    parser.add_argument('--years', type=int, default=10, help="number of ERS years, starting in 2012 (default: 10)")
+    parser.add_argument('--commodities', type=int, default=21, help="number of commodities per region (default: 21)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the synthetic data (default: 0)")
+    parser.add_argument('--repeat', type=int, default=5, help="number of timed runs of each benchmark (default: 5)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes used to read the ERS sheets (default: one per "
+                             "ERS_SHEETS_PER_WORKER sheets, up to the number of CPUs)")
+    parser.add_argument('--skip-callbacks', action='store_true', help="only benchmark the pipeline")
+    parser.add_argument('--data-dir', default=None,
+                        help="directory of the synthetic copy, kept after the run (default: a temporary directory)")
+    parser.add_argument('--output', default=None,
+                        help="path of the JSON results (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    # The pipeline and the app use paths relative to the repository, so they run from a synthetic copy of it
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='animal_farmers_benchmark_')
+    scale = write_synthetic_inputs(data_dir, args.regions, args.years, args.commodities, args.seed)
+    years = census_years(args.years)[::-1]
+    print(f"Synthetic data in {data_dir}: {scale}")
+
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        results = benchmark_pipeline(args.repeat, args.workers, years)
+        if not args.skip_callbacks:
+            results.update(benchmark_callbacks(args.repeat))
+    finally:
+        os.chdir(cwd)
+        if args.data_dir is None:
+            shutil.rmtree(data_dir)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scale': dict(scale, repeat=args.repeat, workers=args.workers),
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:<24} median {result['median']:.4f}s  min {result['min']:.4f}s")
+    print(f"Wrote benchmark results {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
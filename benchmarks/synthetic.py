@@ -0,0 +1,154 @@
+########################################################
+
+# SYNTHETIC INPUT GENERATOR FOR THE BENCHMARKS
+# Writes ERS, NASS and CPS workbooks in the layout of the real files in data/,
+# at a configurable scale (regions x years x commodities), plus a matching
+# table of region codes for the app.
+# Run `python3 benchmarks/synthetic.py --help` for the options.
+
+########################################################
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+FIRST_YEAR = 2012
+# NASS census years come every 5 years, starting with FIRST_YEAR
+CENSUS_INTERVAL = 5
+# Commodities used by the computation, the remaining commodities are filler
+REQUIRED_COMMODITIES = ['All commodities', 'Animals and products', 'Feed crops']
+STATE_NAMES = pd.read_csv(os.path.join(os.path.dirname(__file__), '..', 'data', 'state_codes.csv'))['State'].tolist()
+
+
+def region_names(regions: int) -> list:
+    """
+    Names of the synthetic regions: "United States", then the real state names, then "Region N"
+
+    Args:
+        regions (int): number of regions, including "United States"
+
+    Returns:
+        (list): region names
+    """
+    names = ['United States'] + STATE_NAMES
+    names += [f'Region {i}' for i in range(len(names), regions)]
+    return names[:regions]
+
+
+def census_years(years: int) -> list:
+    """
+    Census years (NASS, CPS) within the synthetic ERS years
+
+    Args:
+        years (int): number of ERS years, starting with FIRST_YEAR
+
+    Returns:
+        (list): census years, as strings
+    """
+    return [str(year) for year in range(FIRST_YEAR, FIRST_YEAR + years, CENSUS_INTERVAL)]
+
+
+def write_ers_workbook(path: str, names: list, years: int, commodities: int, rng: np.random.Generator):
+    """
+    Writes an ERS workbook: a directory sheet, then one sheet per region with commodities as rows
+    and years as columns (the last year is a forecast, e.g. "2021F")
+    """
+    year_labels = [str(year) for year in range(FIRST_YEAR, FIRST_YEAR + years)]
+    year_labels[-1] += 'F'
+    commodity_names = REQUIRED_COMMODITIES + [f'Commodity {i}' for i in range(commodities - len(REQUIRED_COMMODITIES))]
+
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({'CR_Condensed': [None] * len(names), 'Regions': names}) \
+            .to_excel(writer, sheet_name='Document map', index=False)
+        for name in names:
+            receipts = rng.integers(1_000, 1_000_000, size=(len(commodity_names), years)).astype(object)
+            # All commodities is the total, animals and feed crops are part of it
+            receipts[0] = receipts[1:].sum(axis=0)
+            # Some regions have no receipts for some commodities
+            receipts[3:][rng.random((len(commodity_names) - 3, years)) < 0.05] = None
+            rows = [['Cash receipts by commodity, synthetic data'], [],
+                    [None, name, None] + year_labels,
+                    [None, None, None] + ['$1,000     '] * years,
+                    []]
+            rows += [[None, commodity, None] + list(values) for commodity, values in zip(commodity_names, receipts)]
+            pd.DataFrame(rows).to_excel(writer, sheet_name=name[:31], index=False, header=False)
+
+
+def write_nass_workbook(path: str, names: list, years: list, rng: np.random.Generator):
+    """
+    Writes a NASS workbook: State, Year, Number_of_Family_Farmers
+    """
+    nass = pd.DataFrame([(name, int(year)) for year in years for name in names], columns=['State', 'Year'])
+    nass['Number_of_Family_Farmers'] = rng.integers(500, 100_000, size=len(nass))
+    nass.to_excel(path, index=False)
+
+
+def write_cps_workbook(path: str, names: list, years: list, rng: np.random.Generator):
+    """
+    Writes a CPS workbook: upper case State, Year (2017 is reported as 2018, like the real file),
+    population and voter totals in thousands, percentages and margins of error
+    """
+    cps = pd.DataFrame([(name.upper(), 2018 if year == '2017' else int(year)) for year in years for name in names],
+                       columns=['State', 'Year'])
+    size = len(cps)
+    cps['Total_Population'] = rng.integers(400, 30_000, size=size)
+    cps['Total_Citizen_Population'] = (cps['Total_Population'] * 0.9).astype(int)
+    cps['Total_Registered'] = (cps['Total_Population'] * 0.6).astype(int)
+    cps['Percent_Registered_Total'] = rng.uniform(50, 80, size=size).round(1)
+    cps['Total_Registered_Margin_of_Error'] = rng.uniform(1, 3, size=size).round(1)
+    cps['Percent_Registered_Citizen'] = rng.uniform(50, 80, size=size).round(1)
+    cps['Citizen_Registered_Margin_of_Error'] = rng.uniform(1, 3, size=size).round(1)
+    cps['Total_Voted'] = (cps['Total_Population'] * 0.5).astype(int)
+    cps['Percent_Voted_Total'] = rng.uniform(40, 70, size=size).round(1)
+    cps['Total_Voted_Margin_of_Error'] = rng.uniform(1, 3, size=size).round(1)
+    cps['Percent_Voted_Citizen'] = rng.uniform(40, 70, size=size).round(1)
+    cps['Citizen_Voted_Margin_of_Error'] = rng.uniform(1, 3, size=size).round(1)
+    cps.to_excel(path, index=False)
+
+
+def write_synthetic_inputs(directory: str, regions: int = 51, years: int = 10, commodities: int = 21,
+                           seed: int = 0) -> dict:
+    """
+    Writes a synthetic copy of the input data in directory/data/
+
+    Args:
+        directory (str): root of the synthetic copy (the pipeline and the app run from there)
+        regions (int): number of regions, including "United States" (51 matches the real data)
+        years (int): number of ERS years, starting in 2012 (at least 6, to include 2017)
+        commodities (int): number of commodity rows per region (at least 3)
+        seed (int): seed of the random values
+
+    Returns:
+        (dict): scale of the synthetic data
+    """
+    if years < 1 + CENSUS_INTERVAL or commodities < len(REQUIRED_COMMODITIES):
+        raise ValueError(f"Synthetic data needs at least {1 + CENSUS_INTERVAL} years and "
+                         f"{len(REQUIRED_COMMODITIES)} commodities")
+    rng = np.random.default_rng(seed)
+    names = region_names(regions)
+    data_dir = os.path.join(directory, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+
+    write_ers_workbook(os.path.join(data_dir, 'ers_usda.xlsx'), names, years, commodities, rng)
+    write_nass_workbook(os.path.join(data_dir, 'nass_usda.xlsx'), names, census_years(years), rng)
+    write_cps_workbook(os.path.join(data_dir, 'census_population_and_voting.xlsx'), names, census_years(years), rng)
+    # Region codes for the app (synthetic regions get synthetic codes)
+    pd.DataFrame({'code': [f'R{i:03d}' for i in range(1, len(names))], 'State': names[1:]}) \
+        .to_csv(os.path.join(data_dir, 'state_codes.csv'), index=False)
+
+    return {'regions': regions, 'years': years, 'commodities': commodities, 'seed': seed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic ERS/NASS/CPS workbooks in the layout of data/")
+    parser.add_argument('directory', help="root of the synthetic copy, workbooks are written to DIRECTORY/data/")
+    parser.add_argument('--regions', type=int, default=51, help="number of regions, including United States (default: 51)")
+    parser.add_argument('--years', type=int, default=10, help="number of ERS years, starting in 2012 (default: 10)")
+    parser.add_argument('--commodities', type=int, default=21, help="number of commodities per region (default: 21)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    print(write_synthetic_inputs(args.directory, args.regions, args.years, args.commodities, args.seed))
@@ -0,0 +1,182 @@
+########################################################
+
+# CONTENT-HASHED CACHE FOR CLEANED INPUT DATA
+# Stores cleaned dataframes as uncompressed .npz files (one array per column),
+# keyed by a hash of the source file contents, so that warm runs of
+# compute_animal_farmers.py skip Excel parsing completely.
+
+########################################################
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+CACHE_DIR = '.cache'
+MAX_CACHE_BYTES = 256 * 1024 ** 2
+
+
+def file_digest(path: str) -> str:
+    """
+    Computes the sha256 hash of a file's contents
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        (str): hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_frame(df: pd.DataFrame, path):
+    """
+    Writes a dataframe to an .npz file, one array per column
+    - string (object) columns are stored as fixed width unicode arrays, so no pickling is needed
+    - categorical columns are stored as their integer codes plus their categories
+    - df.attrs (JSON serializable metadata) are stored alongside the columns
+
+    Args:
+        df (pd.DataFrame): dataframe to be written, with a default index
+        path (str): path of the .npz file (or a binary file object)
+    """
+    arrays = {}
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays[f'c{i}'] = values.cat.codes.to_numpy()
+            arrays[f'k{i}'] = values.cat.categories.to_numpy(dtype=str)
+        elif values.dtype == object:
+            arrays[f'c{i}'] = values.to_numpy(dtype=str)
+        else:
+            arrays[f'c{i}'] = values.to_numpy()
+    meta = {
+        'columns': [str(column) for column in df.columns],
+        'dtypes': [str(dtype) for dtype in df.dtypes],
+        'columns_name': df.columns.name,
+        'attrs': df.attrs,
+    }
+    arrays['meta'] = np.array(json.dumps(meta))
+    np.savez(path, **arrays)
+
+
+def read_frame(path: str) -> pd.DataFrame:
+    """
+    Reads a dataframe written by write_frame
+
+    Args:
+        path (str): path of the .npz file
+
+    Returns:
+        df (pd.DataFrame): dataframe with the original column names and dtypes
+    """
+    with np.load(path, allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays['meta']))
+        df = pd.DataFrame({
+            column: (pd.Categorical.from_codes(arrays[f'c{i}'], arrays[f'k{i}'].astype(object))
+                     if dtype == 'category' else arrays[f'c{i}'])
+            for i, (column, dtype) in enumerate(zip(meta['columns'], meta['dtypes']))
+        })
+    for column, dtype in zip(meta['columns'], meta['dtypes']):
+        if str(df[column].dtype) != dtype:
+            df[column] = df[column].astype(dtype)
+    df.columns.name = meta['columns_name']
+    df.attrs.update(meta.get('attrs', {}))
+    return df
+
+
+class FrameCache:
+    """
+    Directory of cached dataframes, keyed by the stage keys of the pipeline (see Pipeline.key in stages.py)
+    - entries are evicted least recently used first once the directory grows past max_bytes
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES, enabled: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key: str) -> pd.DataFrame:
+        """
+        Loads a cached dataframe, marking it as recently used
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            (pd.DataFrame): cached dataframe, or None on a cache miss
+        """
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            df = read_frame(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path)
+        return df
+
+    def put(self, key: str, df: pd.DataFrame):
+        """
+        Stores a dataframe in the cache, then evicts entries above the size cap
+
+        Args:
+            key (str): cache key
+            df (pd.DataFrame): dataframe to be cached
+        """
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated entry (not named .npz, so
+        # entries() never counts it)
+        tmp_path = self.path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            write_frame(df, f)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def entries(self) -> list:
+        """
+        Lists cache entries, least recently used first
+
+        Returns:
+            (list): (path, size in bytes) of every entry
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            if file_name.endswith('.npz') and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return [(path, size) for _, path, size in sorted(entries)]
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for _, size in entries)
+        for path, size in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Removes every cache entry
+        """
+        for path, _ in self.entries():
+            os.remove(path)
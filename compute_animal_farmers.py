@@ -1,21 +1,73 @@
+import argparse
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import openpyxl
 import pandas as pd
 import numpy as np
 
+import metric_registry
+from cache import CACHE_DIR, MAX_CACHE_BYTES, FrameCache
+from metric_registry import REGISTRY
+from schema import METRIC_DTYPE, YEAR_DTYPE, _key_codes, join_keys, left_join, to_category, to_count, to_year
+from stages import Pipeline, Stage
 
-def clean_ers_data(state_name: str) -> pd.DataFrame: 
+
+ERS_PATH = 'data/ers_usda.xlsx'
+NASS_PATH = 'data/nass_usda.xlsx'
+CPS_PATH = 'data/census_population_and_voting.xlsx'
+STATE_YEAR_PATH = 'data/family_farmer_estimates_state_year_level.xlsx'
+STATE_PATH = 'data/family_farmer_estimates_state_level.xlsx'
+# County level inputs (not shipped with the repository, see README) and output
+COUNTY_SALES_PATH = 'data/county_commodity_sales.xlsx'
+COUNTY_NASS_PATH = 'data/nass_usda_county.xlsx'
+COUNTY_YEAR_PATH = 'data/family_farmer_estimates_county_year_level.xlsx'
+# Census years with NASS farmer counts, most recent first (order of the state level columns)
+YEARS = ["2017", "2012"]
+# Farmer estimate columns, computed from the ERS and NASS data
+FARMER_COLUMNS = ["Animal_ag_share_no_feed", "Animal_ag_share_feed", "Number_of_Family_Farmers",
+                  "Farmers_in_animal_ag_no_feed", "Farmers_in_animal_ag_feed"]
+# Metrics of the registry computed from the ERS commodities, then from the shares and the NASS farmer counts
+SHARE_COLUMNS = ["Animal_ag_share_no_feed", "Animal_ag_share_feed"]
+ESTIMATE_COLUMNS = ["Farmers_in_animal_ag_no_feed", "Farmers_in_animal_ag_feed"]
+# Columns identifying a row, at state ([State, Year]) or county ([FIPS, State, County, Year]) granularity
+ID_COLUMNS = ["FIPS", "State", "County", "Year"]
+# Year columns of the ERS sheets, "2021F" marks a forecast
+YEAR_PATTERN = re.compile(r'\d{4}F?')
+# Commodity rows of the ERS sheets used by compute_animal_ag_share
+ERS_COMMODITIES = ["All commodities", "Animals and products", "Feed crops"]
+# Sheets read by each ERS worker process by default: a process costs about as much to start (and to open
+# the workbook in) as reading this many sheets in the current one
+ERS_SHEETS_PER_WORKER = 100
+# Stages computing the datasets returned by build_dataset
+DATASET_STAGES = {"state_year": "state_year", "state": "state", "county_year": "county_farmers"}
+# Ways of filling the NASS and CPS values between census years (see fill_between_years)
+FILL_METHODS = ["none", "interpolate", "ffill"]
+# File formats of the output datasets: xlsx for publishing, the binary formats for fast handoff
+# (parquet and feather need pyarrow)
+OUTPUT_FORMATS = ["xlsx", "csv", "parquet", "feather"]
+# Files written by the last run of each output dataset, read by snapshot.py and app.py (see find_output)
+OUTPUT_MANIFEST_PATH = 'data/outputs.json'
+# Rows converted and written at a time by the streaming xlsx writer (see write_xlsx)
+XLSX_CHUNK_ROWS = 1000
+# CPS columns holding counts (rounded after filling)
+POPULATION_COUNT_COLUMNS = ["Total_Population", "Total_Citizen_Population", "Total_Registered", "Total_Voted"]
+
+
+def clean_ers_sheet(state_data: pd.DataFrame, state_name: str) -> pd.DataFrame:
     """
-    Cleans ERS data (in 'ers_usda.xlsx') containing commodity receipts by state
+    Cleans a single, already loaded state sheet of the ERS workbook
 
     Args:
-        state_name (str): name of the state to be cleaned
+        state_data (pd.DataFrame): raw sheet, read with header=2
+        state_name (str): name of the state (and of the sheet)
 
     Returns:
         state_data (pd.DataFrame): dataframe containing cleaned commodity data
     """
-    # Read in file
-    state_data = pd.read_excel('data/ers_usda.xlsx', header=2, sheet_name=state_name)
-    # Extract State name
-    state_name = states[i]
     # Rename State Column
     state_data = state_data.rename(columns={state_name: 'Commodity_Type'})
     # Drop rows with null values
@@ -48,6 +100,343 @@ def clean_ers_data(state_name: str) -> pd.DataFrame:
     return state_data
 
 
+def clean_ers_data(state_name: str) -> pd.DataFrame: 
+    """
+    Cleans ERS data (in 'ers_usda.xlsx') containing commodity receipts by state
+
+    Args:
+        state_name (str): name of the state to be cleaned
+
+    Returns:
+        state_data (pd.DataFrame): dataframe containing cleaned commodity data
+    """
+    # Read in file
+    state_data = pd.read_excel(ERS_PATH, header=2, sheet_name=state_name)
+
+    return clean_ers_sheet(state_data, state_name)
+
+
+def ers_workers(sheets: int, workers: int = None) -> int:
+    """
+    Number of worker processes reading the ERS sheets
+
+    Args:
+        sheets (int): number of state sheets
+        workers (int): requested number of processes (None: one per ERS_SHEETS_PER_WORKER sheets, up to the
+            number of CPUs)
+
+    Returns:
+        (int): number of processes, between 1 and the number of sheets
+    """
+    if workers is None:
+        workers = min(os.cpu_count() or 1, sheets // ERS_SHEETS_PER_WORKER)
+    return max(1, min(workers, sheets))
+
+
+def _parse_ers_sheets(contents: bytes, state_names: list) -> list:
+    """
+    Worker task: opens the ERS workbook once and parses a batch of raw state sheets (read with header=2)
+    """
+    with pd.ExcelFile(io.BytesIO(contents)) as excel_file:
+        return [excel_file.parse(sheet_name=state_name, header=2) for state_name in state_names]
+
+
+def read_ers_sheets(path: str = ERS_PATH, workers: int = None) -> dict:
+    """
+    Reads every state sheet of the ERS workbook without cleaning it
+    - the file is read from disk once, and each worker opens the workbook once and parses a contiguous
+      batch of sheets, so the cost grows with sheets / workers
+
+    Args:
+        path (str): path to the ERS workbook
+        workers (int): number of worker processes (defaults to ers_workers), 1 parses every sheet in the
+            current process
+
+    Returns:
+        sheets (dict): state name -> raw sheet, in the order of the directory sheet
+    """
+    with open(path, 'rb') as f:
+        contents = f.read()
+    with pd.ExcelFile(io.BytesIO(contents)) as excel_file:
+        # First sheet is the directory: 0 for U.S., 1-50 for the 50 states
+        states = excel_file.parse(sheet_name=0).iloc[:, 1].tolist()
+        workers = ers_workers(len(states), workers)
+        if workers <= 1:
+            return {state_name: excel_file.parse(sheet_name=state_name, header=2) for state_name in states}
+
+    batches = [batch.tolist() for batch in np.array_split(states, workers)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_parse_ers_sheets, [contents] * workers, batches)
+        return dict(zip(states, [sheet for batch in results for sheet in batch]))
+
+
+def clean_ers_workbook(sheets: dict) -> pd.DataFrame:
+    """
+    Cleans every state sheet of the ERS workbook at once
+    - the sheets are stacked into one long (State, Commodity_Type, Year) column, converted to
+      numbers in a single pass, then pivoted to one column per commodity, so there is no
+      per-sheet transpose and no per-column type conversion
+
+    Args:
+        sheets (dict): state name -> raw sheet (read with header=2), see read_ers_sheets
+
+    Returns:
+        ers_data (pd.DataFrame): one row per (State, Year), one float64 column per commodity
+            (0 where a state has no receipts for a commodity); State is categorical, Year a small integer,
+            like stream_ers_data
+    """
+    frames = []
+    for state_name, sheet in sheets.items():
+        # Commodity labels are in the column named after the state, receipts in the year columns
+        years = [column for column in sheet.columns if YEAR_PATTERN.fullmatch(str(column))]
+        frames.append(sheet.set_index(state_name)[years])
+    panel = pd.concat(frames, keys=list(sheets), names=['State', 'Commodity_Type'])
+    # Clean "2021F" (forecast years)
+    panel.columns = panel.columns.str.replace('F', '', regex=False).rename('Year')
+
+    # Long format: drops blank cells, unit labels ("$1,000") become NaN and are dropped too
+    values = pd.to_numeric(panel.stack(), errors='coerce').dropna()
+    values = values[values.index.get_level_values('Commodity_Type').notna()]
+
+    # Wide format, keeping the order of the states, years and commodities in the workbook
+    rows = values.index.droplevel('Commodity_Type').unique()
+    commodities = values.index.get_level_values('Commodity_Type').unique()
+    ers_data = values.unstack('Commodity_Type', fill_value=0).reindex(index=rows, columns=commodities)
+    ers_data = ers_data.astype(METRIC_DTYPE).reset_index()
+    ers_data['State'] = pd.Categorical(ers_data['State'], categories=list(sheets))
+    ers_data['Year'] = ers_data['Year'].astype(int).astype(YEAR_DTYPE)
+
+    return ers_data
+
+
+def _to_number(value) -> float:
+    """
+    Converts an ERS cell to a number, like pd.to_numeric(errors='coerce') followed by fillna(0)
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _read_ers_directory(workbook: openpyxl.Workbook) -> list:
+    """
+    Reads the state names of the directory sheet: 0 for U.S., 1-50 for the 50 states
+    """
+    return [row[1] for row in workbook.worksheets[0].iter_rows(min_row=2, values_only=True)
+            if len(row) > 1 and row[1] is not None]
+
+
+def _stream_ers_sheets(workbook, state_names: list, commodities: list, years: list = None) -> tuple:
+    """
+    Worker task: streams a batch of state sheets of the ERS workbook in read-only mode, keeping only
+    the requested commodity rows and year columns
+    - rows are read one at a time and the sheet is left as soon as every commodity was found,
+      so the work grows with the number of commodities kept, not with the size of the sheet
+
+    Args:
+        workbook (str or bytes): path to the ERS workbook, or its contents
+        state_names (list): names of the sheets to be read
+        commodities (list): labels of the commodity rows to keep
+        years (list): years to keep, as strings (None keeps every year)
+
+    Returns:
+        state_names (list): names of the sheets that were read
+        sheets (list): (year labels, array of shape (years, commodities)) of each state, in the same order
+    """
+    workbook = openpyxl.load_workbook(io.BytesIO(workbook) if isinstance(workbook, bytes) else workbook,
+                                      read_only=True, data_only=True)
+    positions = {commodity: j for j, commodity in enumerate(commodities)}
+    sheets = []
+    try:
+        for state_name in state_names:
+            rows = workbook[state_name].iter_rows(min_row=3, values_only=True)
+            # Header row: commodity labels are in the column named after the state, receipts in the year columns
+            header = next(rows, ())
+            label_column = header.index(state_name) if state_name in header else 1
+            columns = [(i, str(label).replace('F', '')) for i, label in enumerate(header)
+                       if label is not None and YEAR_PATTERN.fullmatch(str(label))]
+            if years is not None:
+                columns = [(i, year) for i, year in columns if year in years]
+
+            values = np.zeros((len(columns), len(commodities)))
+            missing = set(commodities)
+            for row in rows:
+                label = row[label_column] if len(row) > label_column else None
+                if label in missing:
+                    missing.discard(label)
+                    values[:, positions[label]] = [_to_number(row[i]) if i < len(row) else 0.0 for i, _ in columns]
+                    if not missing:
+                        break
+            sheets.append(([year for _, year in columns], values))
+    finally:
+        workbook.close()
+    return state_names, sheets
+
+
+def stream_ers_data(path: str = ERS_PATH, commodities: list = ERS_COMMODITIES, years: list = None,
+                    workers: int = None) -> pd.DataFrame:
+    """
+    Builds the cleaned ERS table from the requested commodity rows only, streaming the workbook
+    in read-only mode instead of loading every sheet into a dataframe
+    - the file is read from disk once and its contents handed to the workers; each worker opens the
+      workbook once, in read-only mode, which only reads its directory and shared strings, then streams
+      its own contiguous batch of sheets, so no sheet is parsed twice
+
+    Args:
+        path (str): path to the ERS workbook
+        commodities (list): labels of the commodity rows to keep
+        years (list): years to keep, as strings (None keeps every year)
+        workers (int): number of worker processes (defaults to ers_workers: 1 for the 51 sheets of the
+            state workbook, more for workbooks with many more regions), 1 streams every sheet in the
+            current process
+
+    Returns:
+        ers_data (pd.DataFrame): one row per (State, Year), one float64 column per requested commodity
+            (0 where a state has no receipts for a commodity); State is categorical, Year a small integer
+    """
+    with open(path, 'rb') as f:
+        contents = f.read()
+    workbook = openpyxl.load_workbook(io.BytesIO(contents), read_only=True)
+    try:
+        states = _read_ers_directory(workbook)
+    finally:
+        workbook.close()
+    workers = ers_workers(len(states), workers)
+    if workers <= 1:
+        _, sheets = _stream_ers_sheets(contents, states, commodities, years)
+    else:
+        batches = [batch.tolist() for batch in np.array_split(states, workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_stream_ers_sheets, [contents] * workers, batches,
+                                   [commodities] * workers, [years] * workers)
+            sheets = [sheet for _, batch in results for sheet in batch]
+
+    ers_data = pd.DataFrame(np.concatenate([values for _, values in sheets]), columns=list(commodities),
+                            dtype=METRIC_DTYPE)
+    state_column = np.repeat(states, [len(sheet_years) for sheet_years, _ in sheets])
+    year_column = [year for sheet_years, _ in sheets for year in sheet_years]
+    ers_data.insert(0, 'State', pd.Categorical(state_column, categories=states))
+    ers_data.insert(1, 'Year', np.array(year_column, dtype=YEAR_DTYPE))
+    ers_data.columns.name = 'Commodity_Type'
+    print(f"Streamed {len(commodities)} ERS commodities for {len(states)} regions")
+
+    return ers_data
+
+
+def build_ers_panel(path: str = ERS_PATH, workers: int = None) -> pd.DataFrame:
+    """
+    Builds the cleaned ERS table of every commodity with the vectorized clean_ers_workbook (the bulk path:
+    the pipeline only needs ERS_COMMODITIES, and streams them with stream_ers_data, see pipeline_stages)
+
+    Args:
+        path (str): path to the ERS workbook
+        workers (int): number of worker processes parsing the sheets (see read_ers_sheets)
+
+    Returns:
+        ers_data (pd.DataFrame): cleaned commodity data for every state
+    """
+    ers_data = clean_ers_workbook(read_ers_sheets(path, workers=workers))
+    print(f"Loaded ERS Commodity data for {ers_data['State'].nunique()} regions")
+
+    return ers_data
+
+
+def load_nass_data(path: str = NASS_PATH) -> pd.DataFrame:
+    """
+    Loads the (manually created) NASS data containing the number of family farmers by state and year
+
+    Args:
+        path (str): path to the NASS workbook
+
+    Returns:
+        nass_data (pd.DataFrame): cleaned NASS data, State categorical and Year a small integer for joining
+    """
+    nass_data = pd.read_excel(path)
+    # Drop columns with all null values (not needed)
+    nass_data = nass_data.dropna(axis=1, how='all')
+    nass_data['State'] = to_category(nass_data['State'])
+    nass_data['Year'] = to_year(nass_data['Year'])
+    nass_data['Number_of_Family_Farmers'] = to_count(nass_data['Number_of_Family_Farmers'])
+
+    return nass_data
+
+
+def load_population_voter_data(path: str = CPS_PATH) -> pd.DataFrame:
+    """
+    Loads the CPS population and voter data, scaled to true values, with 2018 relabeled as 2017
+
+    Args:
+        path (str): path to the CPS workbook
+
+    Returns:
+        population_voter_data (pd.DataFrame): cleaned population and voter data
+    """
+    population_voter_data = pd.read_excel(path)
+    # Clean State column for matching
+    population_voter_data['State'] = to_category(population_voter_data['State'].str.title())
+    # Convert non State/Year columns to numeric
+    population_voter_data.iloc[:, 2:] = population_voter_data.iloc[:, 2:].apply(pd.to_numeric)
+    # Multiply population and voter data numbers to get true values
+    for column in population_voter_data.columns.values:
+        if column in POPULATION_COUNT_COLUMNS:
+            population_voter_data[column] = to_count(population_voter_data[column] * 1000)
+    # Convert 2018 to 2017, since we are using these estimates
+    population_voter_data['Year'] = to_year(population_voter_data['Year']).replace(2018, 2017)
+
+    return population_voter_data
+
+
+def load_county_commodity_data(path: str = COUNTY_SALES_PATH) -> pd.DataFrame:
+    """
+    Loads county level commodity sales, in long layout (one row per county, year and commodity),
+    and pivots them to the layout of the ERS data, in a single vectorized reshape
+    - columns of the workbook: FIPS, State, County, Year, Commodity_Type, Value
+    - Commodity_Type uses the ERS labels ("All commodities", "Animals and products", "Feed crops", ...)
+
+    Args:
+        path (str): path to the county sales workbook
+
+    Returns:
+        county_data (pd.DataFrame): one row per (FIPS, State, County, Year), one float64 column per commodity;
+            FIPS, State and County are categorical, Year a small integer
+    """
+    sales = pd.read_excel(path, dtype={'FIPS': str})
+    # 5 digit FIPS codes, as used by the county geometry
+    sales['FIPS'] = sales['FIPS'].str.zfill(5)
+    sales['Year'] = to_year(sales['Year'])
+    sales['Value'] = pd.to_numeric(sales['Value'], errors='coerce')
+
+    county_data = sales.pivot_table(index=['FIPS', 'State', 'County', 'Year'], columns='Commodity_Type',
+                                    values='Value', aggfunc='sum', fill_value=0)
+    county_data = county_data.astype(METRIC_DTYPE).reset_index()
+    # Labels become categoricals after the pivot (pivoting on categoricals would build every combination)
+    for column in ['FIPS', 'State', 'County']:
+        county_data[column] = to_category(county_data[column])
+    print(f"Loaded commodity sales for {county_data['FIPS'].nunique()} counties")
+
+    return county_data
+
+
+def load_county_nass_data(path: str = COUNTY_NASS_PATH) -> pd.DataFrame:
+    """
+    Loads the NASS number of family farmers by county
+    - columns of the workbook: FIPS, Year, Number_of_Family_Farmers
+
+    Args:
+        path (str): path to the county NASS workbook
+
+    Returns:
+        nass_data (pd.DataFrame): cleaned NASS data, FIPS categorical and Year a small integer for joining
+    """
+    nass_data = pd.read_excel(path, dtype={'FIPS': str}, usecols=['FIPS', 'Year', 'Number_of_Family_Farmers'])
+    nass_data['FIPS'] = to_category(nass_data['FIPS'].str.zfill(5))
+    nass_data['Year'] = to_year(nass_data['Year'])
+    nass_data['Number_of_Family_Farmers'] = to_count(nass_data['Number_of_Family_Farmers'])
+
+    return nass_data
+
+
 def rename_columns_by_year(df, year):
     """
     Reshapes dataframe so that each column has a year attached, drops year column
@@ -86,103 +475,522 @@ def rename_columns_by_year(df, year):
     return cleaned_df
 
 
-if __name__ == "__main__":
-    # Initialize states data and dataframe list
-    states = pd.read_excel('data/ers_usda.xlsx', sheet_name=0).iloc[:, 1]
-    state_dfs = []
-
-    # Read and clean ERS commodity data for each state
-    for i in range(len(states)): # 0 for U.S., 1-50 for the 50 states
-        # Clean File
-        state_data = clean_ers_data(states[i])
-        # Append state dataframe to list
-        state_dfs.append(state_data)
-
-    # Concatenate ERS dataframes to one large table
-    ers_data = pd.concat(state_dfs).reset_index(drop=True)
-    # Fill null values with 0: certain states dont have certain commodities
-    ers_data = ers_data.fillna(0)
-    # Convert non State/Year columns to numeric
-    ers_data.iloc[:, 2:] = ers_data.iloc[:, 2:].apply(pd.to_numeric)
+def widen_by_year(df: pd.DataFrame, years: list = None, column_groups: list = None) -> pd.DataFrame:
+    """
+    Reshapes a [State, Year] dataset to one line per state, with a column per (metric, year), in a
+    single pivot (instead of one rename_columns_by_year + merge per year)
 
-    ### COMPUTE ANIMAL AGRICULTURE SHARE WITOUT FEED: 
-    # "Animals and Products / All Commodities"
-    ers_data["Animal_ag_share_no_feed"] = ers_data["Animals and products"] / ers_data["All commodities"]
-    ### COMPUTE ANIMAL AGRICULTURE SHARE WTIH FEED:  
-    # ("Animals and Products" + "Feed Crops") / All Commodities"
-    ers_data["Animal_ag_share_feed"] = (ers_data["Animals and products"] + ers_data["Feed crops"]) / ers_data["All commodities"]
+    Example:
+    - with years ["2017", "2012"] and column_groups [[A, B], [C]], df ends with following columns
+        - State
+        - A_2017, B_2017, A_2012, B_2012
+        - C_2017, C_2012
+
+    Args:
+        df (pd.DataFrame): table with State, Year (string) and metric columns
+        years (list): years to keep, in column order (defaults to every year in df, most recent first)
+        column_groups (list): lists of metric columns, each group is repeated for every year
+            (defaults to a single group with every metric column)
+
+    Returns:
+        wide_df (pd.DataFrame): one line per state, in the order the states appear in df
+    """
+    if years is None:
+        years = sorted(df['Year'].astype(str).unique(), reverse=True)
+    if column_groups is None:
+        column_groups = [[column for column in df.columns if column not in ('State', 'Year')]]
+    metrics = [column for group in column_groups for column in group]
+
+    df = df[df['Year'].astype(str).isin(years)]
+    wide_df = df.pivot(index='State', columns='Year', values=metrics)
+    # (metric, year) pairs in output order, then flattened to "metric_year" names
+    wide_df.columns = wide_df.columns.set_levels(wide_df.columns.levels[1].astype(str), level=1)
+    wide_df = wide_df.reindex(index=pd.unique(df['State']),
+                              columns=[(column, year) for group in column_groups for year in years for column in group])
+    wide_df.columns = [f'{column}_{year}' for column, year in wide_df.columns]
+
+    return wide_df.rename_axis('State').reset_index()
+
+
+def fill_between_years(df: pd.DataFrame, columns: list, method: str = 'interpolate', by: str = 'State',
+                       count_columns: list = ()) -> pd.DataFrame:
+    """
+    Fills missing values of a panel from the years that have them (e.g. NASS counts between census years),
+    for every state (or county) at once, on a (year, state) array per column
+    - 'interpolate': linear in the year between the surrounding years with values
+    - 'ffill': value of the latest earlier year with values
+    - after the last year with values, both carry that value forward; before the first one, values stay missing
+
+    Args:
+        df (pd.DataFrame): panel with a Year column (integers) and one row per (by, Year)
+        columns (list): columns to fill
+        method (str): 'interpolate', 'ffill' or 'none' (returns df unchanged)
+        by (str): column identifying the series, e.g. 'State' or 'FIPS'
+        count_columns (list): filled columns holding counts, rounded to the nearest integer
+
+    Returns:
+        (pd.DataFrame): copy of df with filled columns
+    """
+    if method == 'none':
+        return df
+    years, rows = np.unique(df['Year'].to_numpy(), return_inverse=True)
+    groups, _ = pd.factorize(df[by])
+    shape = (len(years), groups.max(initial=-1) + 1)
+    # Position (in years) of the latest year with a value at or before each year, -1 if none
+    position = np.arange(len(years))[:, None]
+
+    df = df.copy()
+    for column in columns:
+        grid = np.full(shape, np.nan)
+        grid[rows, groups] = df[column].to_numpy(dtype='float64')
+        known = ~np.isnan(grid)
+        previous = np.maximum.accumulate(np.where(known, position, -1), axis=0)
+        filled = np.where(previous >= 0, np.take_along_axis(grid, np.maximum(previous, 0), axis=0), np.nan)
+        if method == 'interpolate':
+            # Position of the earliest year with a value at or after each year, len(years) if none
+            following = np.minimum.accumulate(np.where(known, position, len(years))[::-1], axis=0)[::-1]
+            between = (previous >= 0) & (following < len(years)) & ~known
+            previous_years = years[np.maximum(previous, 0)]
+            following_years = years[np.minimum(following, len(years) - 1)]
+            following_values = np.take_along_axis(grid, np.minimum(following, len(years) - 1), axis=0)
+            weight = (years[:, None] - previous_years) / np.where(between, following_years - previous_years, 1)
+            filled = np.where(between, filled + weight * (following_values - filled), filled)
+        values = pd.Series(filled[rows, groups], index=df.index)
+        df[column] = to_count(np.rint(values)) if column in count_columns else values
+
+    return df
+
+
+def compute_animal_ag_share(ers_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the share of animal agriculture in all commodity receipts, with and without feed crops
+
+    Args:
+        ers_data (pd.DataFrame): cleaned ERS data
+
+    Returns:
+        ers_data (pd.DataFrame): ERS data with Animal_ag_share_no_feed, Animal_ag_share_feed columns
+    """
+    ers_data = ers_data.copy()
+    ### COMPUTE ANIMAL AGRICULTURE SHARE WITH AND WITHOUT FEED (expressions of the metric registry):
+    # "Animals and Products / All Commodities", ("Animals and Products" + "Feed Crops") / All Commodities"
+    for metric in SHARE_COLUMNS:
+        ers_data[metric] = REGISTRY.evaluate(metric, ers_data)
 
     print("\nComputed Animal Agriculture Share (with and without feed)")
 
-    # Load NASS data - created manually
-    nass_data = pd.read_excel('data/nass_usda.xlsx')
-    # Drop columns with all null values (not needed)
-    nass_data = nass_data.dropna(axis=1, how='all')
+    return ers_data
+
+
+def compute_farmer_data(ers_data: pd.DataFrame, nass_data: pd.DataFrame, years: list = YEARS,
+                        on: list = ('State', 'Year'), fill: str = 'none') -> pd.DataFrame:
+    """
+    Joins the animal agriculture shares with the NASS farmer counts and estimates the number of
+    family farmers in animal agriculture, reduced to the census years
+
+    Args:
+        ers_data (pd.DataFrame): ERS (or county commodity) data with the animal agriculture shares
+        nass_data (pd.DataFrame): cleaned NASS data
+        years (list): years to keep, as strings (None keeps every year of the ERS data,
+            farmer counts are missing outside the NASS census years)
+        on (list): join keys, ['FIPS', 'Year'] for county data
+        fill (str): fill the farmer counts between census years, 'interpolate', 'ffill' or 'none'
+            (see fill_between_years)
 
-    # Join ERS data with NASS data
-    nass_data['Year'] = nass_data['Year'].astype(str) # Convert Year to string for joining
-    all_data = ers_data.merge(nass_data, on=['State', 'Year'], how="left")
+    Returns:
+        farmer_data (pd.DataFrame): farmer estimates with [State, Year] (or [FIPS, State, County, Year]) granularity
+    """
+    # Join ERS data with NASS data, on integer keys
+    all_data = left_join(ers_data, nass_data, on)
 
     print("\nJoined ERA data with NASS data")
 
-    ### COMPUTE NUMBER OF FAMILY FARMERS IN ANIMAL AG WITHOUT FEED
-    # ("Animals and Products / All Commodities") * Number of Family Farmers
-    # round to nearest integer
-    all_data['Farmers_in_animal_ag_no_feed'] =  np.rint(all_data['Animal_ag_share_no_feed'] * all_data["Number_of_Family_Farmers"])
-    ###  COMPUTE NUMBER OF FAMILY FARMERS IN ANIMAL AG WITHOUT FEED
-    # (("Animals and Products" + "Feed Crops") / All Commodities") * Number of Family Farmers
-    all_data['Farmers_in_animal_ag_feed'] =  np.rint(all_data['Animal_ag_share_feed'] * all_data["Number_of_Family_Farmers"])
+    # Farmer counts of the years between (and after) the census years
+    all_data = fill_between_years(all_data, ["Number_of_Family_Farmers"], fill, by=on[0],
+                                  count_columns=["Number_of_Family_Farmers"])
+
+    ### COMPUTE NUMBER OF FAMILY FARMERS IN ANIMAL AG WITH AND WITHOUT FEED (expressions of the metric registry)
+    # Animal agriculture share * Number of Family Farmers, rounded to nearest integer
+    for metric in ESTIMATE_COLUMNS:
+        all_data[metric] = REGISTRY.evaluate(metric, all_data)
 
     print("\nComputed Number of Family Farmers in Animal Agriculture (with and without feed)")
 
     # Reduce dataset to the relevant years and columns
-    farmer_data = all_data[all_data["Year"].isin(["2012", "2017"])][["State", "Year", "Animal_ag_share_no_feed", "Animal_ag_share_feed", 
-                                                "Number_of_Family_Farmers", "Farmers_in_animal_ag_no_feed", 
-                                                "Farmers_in_animal_ag_feed"]]
-
-    # Load Population and Voter data
-    population_voter_data = pd.read_excel('data/census_population_and_voting.xlsx')
-    # Clean State column for string matching
-    population_voter_data['State'] = population_voter_data['State'].str.title()
-    # Convert non State/Year columns to numeric
-    population_voter_data.iloc[:, 2:] = population_voter_data.iloc[:, 2:].apply(pd.to_numeric)
-    # Multiply population and voter data numbers to get true values
-    for column in population_voter_data.columns.values:
-        if column in ["Total_Population", "Total_Citizen_Population", "Total_Registered", "Total_Voted"]:
-            population_voter_data[column] = population_voter_data[column] * 1000
-    # Convert 2018 to 2017, since we are using these estimates
-    population_voter_data['Year'] = population_voter_data['Year'].astype(str) # Convert Year to string for joining
-    population_voter_data['Year'] = population_voter_data['Year'].str.replace('2018', '2017')
+    if years is not None:
+        all_data = all_data[all_data["Year"].isin([int(year) for year in years])]
+    id_columns = [column for column in ID_COLUMNS if column in all_data.columns]
+    farmer_data = all_data[id_columns + FARMER_COLUMNS]
 
-    print("\nLoaded and Processed Population and Voter Data")
+    return farmer_data.reset_index(drop=True)
 
-    # Create final dataset with [State, Year] Granularity
-    final_data = farmer_data.merge(population_voter_data, on=["State", 'Year'])
-    print("\nJoined Census data with Population and Voter data")
 
-    # Export dataset as excel file
-    final_data.to_excel('data/family_farmer_estimates_state_year_level.xlsx', index=False)
-    print("\nExported rancher dataset as excel file in the data/ directory\n")
+def join_population_voter_data(farmer_data: pd.DataFrame, population_voter_data: pd.DataFrame,
+                               fill: str = 'none') -> pd.DataFrame:
+    """
+    Creates the final dataset with [State, Year] granularity
+    - left join, so years without CPS data keep their farmer estimates
 
-    
-    ### Create New dataset with State Granularity ###
-    # Create different version of the dataset that has one line per state and the 2017 numbers in the first set of columns 
-    # followed by 2012 numbers
-    farmer_data['Year'] = farmer_data['Year'].astype(str) # Convert Year to string for joining
-    farmer_data_2012 = rename_columns_by_year(farmer_data, "2012")
-    farmer_data_2017 = rename_columns_by_year(farmer_data, "2017")
-    farmer_data_final = farmer_data_2017.merge(farmer_data_2012, on="State")
-    
-    # Create different version of the dataset that has one line per state and the 2017 numbers in the first set of columns 
-    # followed by 2012 numbers
-    population_voter_data_2012 = rename_columns_by_year(population_voter_data, "2012")
-    population_voter_data_2018 = rename_columns_by_year(population_voter_data, "2017")
-    population_voter_data_final = population_voter_data_2018.merge(population_voter_data_2012, on="State")
-
-    # Create final dataset, State Granularity
-    final_data = farmer_data_final.merge(population_voter_data_final, on="State")
+    Args:
+        farmer_data (pd.DataFrame): farmer estimates with [State, Year] granularity
+        population_voter_data (pd.DataFrame): cleaned population and voter data
+        fill (str): fill the population and voter data between CPS years, 'interpolate', 'ffill' or 'none'
+            (see fill_between_years)
+
+    Returns:
+        final_data (pd.DataFrame): farmer estimates joined with population and voter data
+    """
+    final_data = left_join(farmer_data, population_voter_data, on=["State", "Year"])
     print("\nJoined Census data with Population and Voter data")
+    population_voter_columns = [column for column in population_voter_data.columns if column not in ('State', 'Year')]
+    final_data = fill_between_years(final_data, population_voter_columns, fill,
+                                    count_columns=POPULATION_COUNT_COLUMNS)
+
+    return final_data
+
+
+def build_state_level_data(state_year_data: pd.DataFrame, years: list = YEARS) -> pd.DataFrame:
+    """
+    Creates the final dataset with State granularity: one line per state, the farmer estimates for
+    each year (most recent first) followed by the population and voter data for each year
+
+    Args:
+        state_year_data (pd.DataFrame): final dataset with [State, Year] granularity
+        years (list): years to include, in column order (None includes every year, most recent first)
+
+    Returns:
+        final_data (pd.DataFrame): farmer estimates joined with population and voter data
+    """
+    population_voter_columns = [column for column in state_year_data.columns
+                                if column not in ["State", "Year"] + FARMER_COLUMNS]
+    final_data = widen_by_year(state_year_data, years, [FARMER_COLUMNS, population_voter_columns])
+    print("\nCreated dataset with State granularity")
+
+    return final_data
+
+
+def output_path(path: str, fmt: str) -> str:
+    """
+    Path of an output dataset in another file format, e.g. data/estimates.xlsx -> data/estimates.feather
+    """
+    return os.path.splitext(path)[0] + '.' + fmt
+
+
+def read_output_manifest(manifest_path: str = OUTPUT_MANIFEST_PATH) -> dict:
+    """
+    Reads the manifest of the output files (see write_output_manifest)
+
+    Returns:
+        (dict): output dataset path -> {'path', 'formats', 'years', 'fill'} of its last run (empty without manifest)
+    """
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_output_manifest(outputs: dict, manifest_path: str = OUTPUT_MANIFEST_PATH):
+    """
+    Records the files written by a run, keeping the entries of the datasets it did not write
+    (e.g. the county dataset of an earlier run)
+
+    Args:
+        outputs (dict): output dataset path (e.g. STATE_YEAR_PATH) -> {'path': file to read, 'formats': formats
+            written, 'years': years of the run, 'fill': fill method of the run}
+        manifest_path (str): path of the manifest
+    """
+    manifest = {**read_output_manifest(manifest_path), **outputs}
+    # Readers never see a half-written manifest
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def find_output(path: str, manifest_path: str = OUTPUT_MANIFEST_PATH) -> str:
+    """
+    Finds the file of an output dataset written by the last run of the pipeline (see write_output_manifest)
+    - without a manifest entry (e.g. outputs written by hand), the most recently written file in any of
+      the OUTPUT_FORMATS is used
+
+    Args:
+        path (str): path of the output dataset, in any format (e.g. STATE_YEAR_PATH)
+        manifest_path (str): path of the manifest of the output files
+
+    Returns:
+        (str): path of the file, or path itself when no file was written
+    """
+    entry = read_output_manifest(manifest_path).get(path)
+    if entry is not None and os.path.exists(entry['path']):
+        return entry['path']
+    paths = [output_path(path, fmt) for fmt in OUTPUT_FORMATS if os.path.exists(output_path(path, fmt))]
+    return max(paths, key=os.path.getmtime) if paths else path
+
+
+def write_xlsx(df: pd.DataFrame, path: str, sheet_name: str = 'Sheet1'):
+    """
+    Writes a dataframe as an xlsx workbook in constant memory
+    - the workbook is opened in write-only mode, which streams the rows to the file instead of keeping
+      every cell in memory, and rows are converted XLSX_CHUNK_ROWS at a time
+    - the sheet layout is the one of DataFrame.to_excel(path, index=False): a header row, then one row
+      per dataframe row, missing values as empty cells
+
+    Args:
+        df (pd.DataFrame): dataset to be written
+        path (str): path to the xlsx file
+        sheet_name (str): name of the sheet
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append([str(column) for column in df.columns])
+    for start in range(0, len(df), XLSX_CHUNK_ROWS):
+        chunk = df.iloc[start:start + XLSX_CHUNK_ROWS]
+        # Python scalars, None for missing values (NaN is the only value not equal to itself)
+        columns = [[None if value != value else value for value in chunk[column].tolist()] for column in chunk.columns]
+        for row in zip(*columns):
+            sheet.append(row)
+    workbook.save(path)
+
+
+def export_dataset(df: pd.DataFrame, path: str):
+    """
+    Exports a dataset in the file format of its extension (see OUTPUT_FORMATS)
+    - xlsx and csv files write years as text, like in the original files; parquet and feather files
+      keep the typed columns (see schema.py)
+    - xlsx files are written in constant memory (see write_xlsx)
+    - the file is written under a hidden temporary name next to the output, then renamed over it, so
+      readers (e.g. the app loading the latest output) never see a partially written file
+
+    Args:
+        df (pd.DataFrame): dataset to be exported
+        path (str): path to the output file
+    """
+    fmt = os.path.splitext(path)[1].lstrip('.')
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {fmt}, expected one of {', '.join(OUTPUT_FORMATS)}")
+    if fmt in ('xlsx', 'csv') and 'Year' in df.columns:
+        df = df.assign(Year=df['Year'].astype(str))
+    # Hidden temporary file, keeping the extension the writers expect
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f'.{os.getpid()}-{name}')
+    try:
+        if fmt == 'xlsx':
+            write_xlsx(df, tmp_path)
+        elif fmt == 'csv':
+            df.to_csv(tmp_path, index=False)
+        elif fmt == 'parquet':
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"\nExported rancher dataset as {fmt} file {path}\n")
+
+
+def read_dataset(path: str) -> pd.DataFrame:
+    """
+    Reads an output dataset written by export_dataset, in any of the OUTPUT_FORMATS, with the typed
+    columns of the pipeline (categorical FIPS, State and County, small integer Year)
+
+    Args:
+        path (str): path to the output file
+
+    Returns:
+        (pd.DataFrame): dataset
+    """
+    fmt = os.path.splitext(path)[1].lstrip('.')
+    if fmt == 'xlsx':
+        df = pd.read_excel(path, dtype={'FIPS': str})
+    elif fmt == 'csv':
+        df = pd.read_csv(path, dtype={'FIPS': str})
+    elif fmt == 'parquet':
+        df = pd.read_parquet(path)
+    elif fmt == 'feather':
+        df = pd.read_feather(path)
+    else:
+        raise ValueError(f"Unknown output format {fmt}, expected one of {', '.join(OUTPUT_FORMATS)}")
+    for column in ['FIPS', 'State', 'County']:
+        if column in df.columns:
+            df[column] = to_category(df[column])
+    if 'Year' in df.columns:
+        df['Year'] = to_year(df['Year'])
+
+    return df
+
+
+def export_stages(input_name: str, path: str, formats: list, name: str = None) -> list:
+    """
+    Declares the stages exporting a dataset, one per file format
+
+    Args:
+        input_name (str): name of the stage computing the dataset
+        path (str): path of the output dataset (its extension is replaced by the format)
+        formats (list): file formats (see OUTPUT_FORMATS)
+        name (str): name of the dataset in the stage names (defaults to input_name)
+
+    Returns:
+        (list): export stages, named export_<name> for xlsx and export_<name>_<format> otherwise
+    """
+    name = name or input_name
+    return [Stage(f'export_{name}' if fmt == 'xlsx' else f'export_{name}_{fmt}', export_dataset,
+                  inputs=[input_name], outputs=[output_path(path, fmt)], code=[export_dataset, write_xlsx])
+            for fmt in formats]
+
+
+def pipeline_stages(workers: int = None, years: list = YEARS, granularity: str = 'state', fill: str = 'none',
+                    formats: list = ('xlsx',)) -> list:
+    """
+    Declares the stages of the pipeline, in dependency order
+
+    Args:
+        workers (int): number of worker processes used to stream the ERS sheets
+        years (list): years of the output datasets (None for every year of the ERS data)
+        granularity (str): 'state', 'county' or 'all'
+        fill (str): fill the NASS and CPS values between census years, 'interpolate', 'ffill' or 'none'
+        formats (list): file formats of the output datasets (see OUTPUT_FORMATS), none to only compute them
+
+    Returns:
+        (list): stages of the pipeline
+    """
+    stages = []
+    if granularity in ('state', 'all'):
+        stages += [
+            # Only the commodity rows and years used downstream are read from the ERS workbook
+            Stage('ers', stream_ers_data, sources=[ERS_PATH],
+                  code=[_to_number, _read_ers_directory, _stream_ers_sheets, stream_ers_data],
+                  params={'commodities': ERS_COMMODITIES, 'years': years}, kwargs={'workers': workers}),
+            Stage('animal_ag_share', compute_animal_ag_share, inputs=['ers'],
+                  code=[compute_animal_ag_share, metric_registry]),
+            Stage('nass', load_nass_data, sources=[NASS_PATH], code=[load_nass_data, to_category, to_year, to_count]),
+            Stage('farmers', compute_farmer_data, inputs=['animal_ag_share', 'nass'],
+                  code=[compute_farmer_data, left_join, join_keys, _key_codes, fill_between_years, metric_registry],
+                  params={'years': years, 'fill': fill}),
+            Stage('population_voter', load_population_voter_data, sources=[CPS_PATH],
+                  code=[load_population_voter_data, to_category, to_year, to_count]),
+            Stage('state_year', join_population_voter_data, inputs=['farmers', 'population_voter'],
+                  code=[join_population_voter_data, left_join, join_keys, _key_codes, fill_between_years],
+                  params={'fill': fill}),
+        ] + export_stages('state_year', STATE_YEAR_PATH, formats) + [
+            Stage('state', build_state_level_data, inputs=['state_year'],
+                  code=[build_state_level_data, widen_by_year], params={'years': years}),
+        ] + export_stages('state', STATE_PATH, formats)
+    if granularity in ('county', 'all'):
+        # Same share x farmer count estimate, CPS population and voter data only exist by state
+        stages += [
+            Stage('county_sales', load_county_commodity_data, sources=[COUNTY_SALES_PATH],
+                  code=[load_county_commodity_data, to_category, to_year]),
+            Stage('county_animal_ag_share', compute_animal_ag_share, inputs=['county_sales'],
+                  code=[compute_animal_ag_share, metric_registry]),
+            Stage('county_nass', load_county_nass_data, sources=[COUNTY_NASS_PATH],
+                  code=[load_county_nass_data, to_category, to_year, to_count]),
+            Stage('county_farmers', compute_farmer_data, inputs=['county_animal_ag_share', 'county_nass'],
+                  code=[compute_farmer_data, left_join, join_keys, _key_codes, fill_between_years, metric_registry],
+                  params={'years': years, 'on': ['FIPS', 'Year'], 'fill': fill}),
+        ] + export_stages('county_farmers', COUNTY_YEAR_PATH, formats, name='county_year')
+    return stages
+
+
+def build_dataset(years: list = YEARS, fill: str = 'none', granularity: str = 'state', formats: list = ('xlsx',),
+                  workers: int = None, cache: FrameCache = None, report: str = None,
+                  export_workers: int = None) -> dict:
+    """
+    Runs the pipeline in process, and returns the estimates as typed dataframes (see schema.py)
+    - output files are only written for the requested formats (none keeps the estimates in memory),
+      and stages with up to date results are loaded from the cache
+    - the files are recorded in the output manifest (see write_output_manifest): snapshot.py and app.py
+      read the file of the first format
+
+    Example:
+        datasets = build_dataset(formats=[])
+        datasets['state_year']  # one row per (State, Year)
+
+    Args:
+        years (list): years of the datasets, as strings (None for every year of the ERS data)
+        fill (str): fill the NASS and CPS values between census years, 'interpolate', 'ffill' or 'none'
+        granularity (str): 'state', 'county' or 'all'
+        formats (list): file formats of the output files (see OUTPUT_FORMATS)
+        workers (int): number of worker processes used to stream the ERS sheets
+        cache (FrameCache): cache of the stage results (defaults to the cache in CACHE_DIR)
+        report (str): path of a JSON report of the stage timings and peak memory (see Pipeline.write_report)
+        export_workers (int): number of processes writing the output files concurrently (defaults to one
+            per output file, up to the number of CPUs), 1 writes them in turn in this process
+
+    Returns:
+        (dict): 'state_year' and 'state' datasets (state granularity), 'county_year' dataset (county granularity)
+    """
+    stages = pipeline_stages(workers=workers, years=years, granularity=granularity, fill=fill, formats=formats)
+    exports = [stage.name for stage in stages if stage.name.startswith('export_')]
+    if export_workers is None:
+        export_workers = min(len(exports), os.cpu_count() or 1)
+    # Memory is only traced for the report
+    pipeline = Pipeline(stages, cache if cache is not None else FrameCache(), export_workers=export_workers,
+                        trace_memory=bool(report))
+    datasets = {name: stage for name, stage in DATASET_STAGES.items() if stage in pipeline.stages}
+    results = pipeline.run(exports + list(datasets.values()))
+    if report:
+        pipeline.write_report(report)
+    # Up to date files are not rewritten, so their modification times do not tell which run wrote them
+    if formats:
+        outputs = {stage.outputs[0] for stage in stages if stage.name.startswith('export_')}
+        write_output_manifest({path: {'path': output_path(path, formats[0]), 'formats': list(formats),
+                                      'years': years, 'fill': fill}
+                               for path in (STATE_YEAR_PATH, STATE_PATH, COUNTY_YEAR_PATH)
+                               if output_path(path, formats[0]) in outputs})
+
+    return {name: results[stage] for name, stage in datasets.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the number of family farmers in animal agriculture by state")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes used to stream the ERS sheets (default: one per "
+                             f"{ERS_SHEETS_PER_WORKER} sheets, up to the number of CPUs)")
+    parser.add_argument('--export-workers', type=int, default=None,
+                        help="number of processes writing the output files concurrently "
+                             "(default: one per output file, up to the number of CPUs)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="bypass the cache of stage results, run every stage")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="remove every cached stage result before running")
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help=f"directory of the stage cache (default: {CACHE_DIR})")
+    parser.add_argument('--cache-size', type=int, default=MAX_CACHE_BYTES // 1024 ** 2,
+                        help="size cap of the stage cache in MB, least recently used entries are evicted first")
+    parser.add_argument('--years', nargs='+', default=YEARS,
+                        help="years of the output datasets, in column order, or 'all' for every year of the ERS data "
+                             f"(default: {' '.join(YEARS)})")
+    parser.add_argument('--fill', choices=FILL_METHODS, default='none',
+                        help="fill the NASS farmer counts and CPS population and voter data between census years "
+                             "(linear interpolation or last census value), e.g. with --years all for the full "
+                             "panel (default: none)")
+    parser.add_argument('--granularity', choices=['state', 'county', 'all'], default='state',
+                        help="compute state level estimates, county level estimates (requires the county "
+                             "input workbooks), or both (default: state)")
+    parser.add_argument('--format', nargs='+', choices=OUTPUT_FORMATS, default=['xlsx'], dest='formats',
+                        help="file formats of the output datasets, e.g. --format feather xlsx; parquet and feather "
+                             "need pyarrow (default: xlsx)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="list the stale stages without running them")
+    parser.add_argument('--report', default=None,
+                        help="write the wall time, peak allocated memory and row count of each stage to this JSON file")
+    args = parser.parse_args()
+
+    # Stage results are cached, keyed by their code, source workbooks and upstream results
+    cache = FrameCache(args.cache_dir, max_bytes=args.cache_size * 1024 ** 2, enabled=not args.no_cache)
+    if args.clear_cache:
+        cache.clear()
+    years = None if args.years == ['all'] else args.years
 
-    # Export dataset as excel file
-    final_data.to_excel('data/family_farmer_estimates_state_level.xlsx', index=False)
-    print("\nExported rancher dataset as excel file in the data/ directory\n")
+    if args.dry_run:
+        pipeline = Pipeline(pipeline_stages(workers=args.workers, years=years, granularity=args.granularity,
+                                            fill=args.fill, formats=args.formats), cache)
+        stale = pipeline.stale()
+        print("Stale stages:" if stale else "All stages are up to date")
+        for name in stale:
+            print(f"- {name}")
+    else:
+        build_dataset(years=years, fill=args.fill, granularity=args.granularity, formats=args.formats,
+                      workers=args.workers, cache=cache, report=args.report, export_workers=args.export_workers)
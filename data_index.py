@@ -0,0 +1,335 @@
+########################################################
+
+# YEAR-PARTITIONED IN-MEMORY INDEX OF THE APP DATA
+# Built once at load time: per-year state names and codes, per (metric, year)
+# value arrays and their descending sort order, so that callbacks read maps
+# and tables straight from numpy arrays instead of filtering the data frame.
+# The index can be saved as a directory of .npy files and memory-mapped
+# read-only, so that app workers share one copy of the data.
+# Pages of the data tables (sorted, filtered) are read from the same orders.
+# Only the columns of the data are stored: metrics computed from them (see
+# metric_registry.py) are evaluated, and sorted, the first time they are read.
+# The saved index stores the computed metrics too, so loading it evaluates
+# nothing: only the metrics missing from an older saved index are evaluated.
+
+########################################################
+
+import json
+import os
+import shutil
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from metric_registry import REGISTRY, MetricRegistry
+
+
+class _LazyArrays(dict):
+    """
+    (metric, year) -> array, computed by a function of the key on first access and kept
+    """
+
+    def __init__(self, compute):
+        super().__init__()
+        self.compute = compute
+
+    def __missing__(self, key):
+        value = self[key] = self.compute(*key)
+        return value
+
+
+class _YearColumns:
+    """
+    Columns of one year of an index, read by the metric expressions (metrics are evaluated through the index,
+    so each is computed once)
+    """
+
+    def __init__(self, index: 'DataIndex', year: str, metric: str):
+        self.index = index
+        self.year = year
+        self.metric = metric
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index.columns or (name in self.index.metrics and name != self.metric)
+
+    def __getitem__(self, name: str):
+        return self.index.values[name, self.year]
+
+
+class DataIndex:
+    """
+    Per-year arrays of the (State, Year) (or (County, Year)) level app data
+
+    Attributes:
+        metrics (list): indexed metrics: the metrics that are columns of the data or can be computed from them
+        columns (list): columns of the data in the index, the other metrics are computed from them
+        years (list): years of the data, as strings, in increasing order
+        states (dict): year -> array of state (or county) names
+        codes (dict): year -> array of state codes (or county FIPS codes)
+        values (dict): (metric, year) -> array of metric values, aligned with states/codes (computed metrics
+            are evaluated on first access, or read from a saved index)
+        order (dict): (metric, year) -> row order sorting the metric in descending order, missing values last
+            (computed on first access)
+        valid (dict): (metric, year) -> number of non-missing values (their ranks come first in order)
+        name_order (dict): year -> row order sorting the state names alphabetically
+        code_order (dict): year -> row order sorting the state codes
+        attrs (dict): metadata saved with the index (e.g. snapshot version and source digest)
+        registry (MetricRegistry): declarations of the computed metrics
+    """
+
+    def __init__(self, data: pd.DataFrame, metrics: list, registry: MetricRegistry = REGISTRY):
+        self.registry = registry
+        self.metrics = registry.available(list(metrics), data.columns)
+        # Metrics that are columns of the data, and the columns the other metrics are computed from
+        self.columns = list(dict.fromkeys(column for metric in self.metrics
+                                          for column in registry.requirements(metric, data.columns)))
+        self.attrs = dict(data.attrs)
+        years = data['Year'].astype(str).to_numpy()
+        self.years = sorted(np.unique(years).tolist())
+        self.states = {}
+        self.codes = {}
+        self._init_arrays()
+        for year in self.years:
+            rows = np.flatnonzero(years == year)
+            self.states[year] = data['State'].to_numpy()[rows]
+            self.codes[year] = data['code'].to_numpy()[rows]
+            for column in self.columns:
+                self.values[column, year] = data[column].to_numpy()[rows]
+        self._build_orders()
+
+    def _init_arrays(self):
+        """
+        Creates the arrays computed on first access: values of the computed metrics, sort orders and
+        counts of non-missing values
+        """
+        # Weak reference: without a reference cycle, an index is freed as soon as it is no longer used
+        index = weakref.ref(self)
+        self.values = _LazyArrays(lambda metric, year: index()._evaluate(metric, year))
+        # Negating sorts in descending order, NaN stays last
+        self.order = _LazyArrays(lambda metric, year: np.argsort(-index().values[metric, year], kind='stable'))
+        self.valid = _LazyArrays(lambda metric, year: int(np.count_nonzero(~np.isnan(index().values[metric, year]))))
+
+    def _build_orders(self):
+        """
+        Derives the name and code orders of each year, used by page
+        """
+        self.name_order = {year: np.argsort(self.states[year], kind='stable') for year in self.years}
+        self.code_order = {year: np.argsort(self.codes[year], kind='stable') for year in self.years}
+
+    def _evaluate(self, metric: str, year: str) -> np.ndarray:
+        """
+        Computes the values of a metric for a year, from the stored columns (see metric_registry.py)
+        """
+        if metric not in self.metrics or year not in self.states:
+            raise KeyError((metric, year))
+        return np.asarray(self.registry.evaluate(metric, _YearColumns(self, year, metric)))
+
+    def sorted_rows(self, metric: str, year: str) -> tuple:
+        """
+        Rows of a year sorted on a metric, in descending order
+
+        Args:
+            metric (str): metric to sort on
+            year (str): year of the rows
+
+        Returns:
+            states (np.ndarray): state names
+            codes (np.ndarray): state codes
+            values (np.ndarray): metric values
+        """
+        order = self.order[metric, year]
+        return self.states[year][order], self.codes[year][order], self.values[metric, year][order]
+
+    def save(self, directory: str):
+        """
+        Saves the index as a directory of .npy files, one per stored column and computed metric (years
+        concatenated, in order), with their sort orders
+        - the computed metrics are evaluated and sorted here, once, instead of in each process loading the index
+        - the directory is replaced as a whole, workers that mapped the previous files keep reading them
+
+        Args:
+            directory (str): path of the index directory
+        """
+        tmp_directory = directory + '.tmp'
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        offsets = np.cumsum([0] + [len(self.states[year]) for year in self.years]).tolist()
+        np.save(os.path.join(tmp_directory, 'states.npy'), np.concatenate([self.states[year] for year in self.years]).astype(str))
+        np.save(os.path.join(tmp_directory, 'codes.npy'), np.concatenate([self.codes[year] for year in self.years]).astype(str))
+        stored = list(dict.fromkeys(self.columns + self.metrics))
+        for i, column in enumerate(stored):
+            np.save(os.path.join(tmp_directory, f'values_{i}.npy'),
+                    np.concatenate([self.values[column, year] for year in self.years]))
+            np.save(os.path.join(tmp_directory, f'order_{i}.npy'),
+                    np.concatenate([self.order[column, year] for year in self.years]).astype('int32'))
+        with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+            json.dump({'metrics': self.metrics, 'columns': self.columns, 'stored': stored, 'years': self.years,
+                       'offsets': offsets, 'attrs': self.attrs}, f)
+
+        old_directory = directory + '.old'
+        shutil.rmtree(old_directory, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, old_directory)
+        os.replace(tmp_directory, directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'DataIndex':
+        """
+        Loads an index saved with save
+        - with mmap, the files are memory-mapped read-only: every array of the index is a view on the
+          files, so processes loading the same index share its pages instead of copying the data
+        - computed metrics missing from the files (indexes saved before they were stored) are evaluated
+          on first access, like in a built index
+
+        Args:
+            directory (str): path of the index directory
+            mmap (bool): memory-map the files instead of reading them into memory
+
+        Returns:
+            index (DataIndex): index with read-only arrays
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        index.registry = REGISTRY
+        index.metrics = meta['metrics']
+        # Indexes saved before the metric registry stored every metric
+        index.columns = meta.get('columns', meta['metrics'])
+        stored = meta.get('stored', index.columns)
+        index.years = meta['years']
+        index.attrs = meta['attrs']
+        index.states, index.codes = {}, {}
+        index._init_arrays()
+
+        states = np.load(os.path.join(directory, 'states.npy'), mmap_mode=mmap_mode)
+        codes = np.load(os.path.join(directory, 'codes.npy'), mmap_mode=mmap_mode)
+        columns = [(np.load(os.path.join(directory, f'values_{i}.npy'), mmap_mode=mmap_mode),
+                    np.load(os.path.join(directory, f'order_{i}.npy'), mmap_mode=mmap_mode))
+                   for i in range(len(stored))]
+        for year, start, stop in zip(index.years, meta['offsets'], meta['offsets'][1:]):
+            index.states[year] = states[start:stop]
+            index.codes[year] = codes[start:stop]
+            for column, (values, order) in zip(stored, columns):
+                index.values[column, year] = values[start:stop]
+                index.order[column, year] = order[start:stop]
+        index._build_orders()
+
+        return index
+
+    def _count_above(self, metric: str, year: str, bound: float, strict: bool, decimals: int = None) -> int:
+        """
+        Number of values above a bound (strictly, or at least equal), by binary search on the rank order
+        - with decimals, the values are rounded before the comparison (rounding keeps the rank order)
+
+        Returns:
+            (int): count of the leading ranks of order[metric, year] with a value above the bound
+        """
+        values, order = self.values[metric, year], self.order[metric, year]
+        low, high = 0, self.valid[metric, year]
+        while low < high:
+            middle = (low + high) // 2
+            value = values[order[middle]] if decimals is None else np.round(values[order[middle]], decimals)
+            if value > bound or (not strict and value == bound):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def rank_range(self, metric: str, year: str, conditions: list, decimals: int = None) -> tuple:
+        """
+        Ranks of the rows matching conditions on the metric: a contiguous range of the descending order
+
+        Args:
+            metric (str): metric of the conditions
+            year (str): year of the rows
+            conditions (list): (operator, bound) pairs, operators among 'gt', 'ge', 'lt', 'le', 'eq'
+            decimals (int): compare the values rounded to this many decimals (e.g. as shown in a table)
+
+        Returns:
+            (tuple): first and last (excluded) ranks, in order[metric, year]
+        """
+        first, last = 0, self.valid[metric, year]
+        for operator, bound in conditions:
+            if operator in ('gt', 'le', 'eq'):
+                above = self._count_above(metric, year, bound, strict=True, decimals=decimals)
+            if operator in ('ge', 'lt', 'eq'):
+                at_least = self._count_above(metric, year, bound, strict=False, decimals=decimals)
+            if operator == 'gt':
+                last = min(last, above)
+            elif operator == 'ge':
+                last = min(last, at_least)
+            elif operator == 'lt':
+                first = max(first, at_least)
+            elif operator == 'le':
+                first = max(first, above)
+            else:
+                first, last = max(first, above), min(last, at_least)
+        return first, max(first, last)
+
+    def page(self, metric: str, year: str, start: int, stop: int, sort: str = 'value', descending: bool = True,
+             conditions: list = (), text_filters: list = (), decimals: int = None) -> tuple:
+        """
+        Rows of one page of a year, sorted and filtered from the precomputed orders
+        - sorting on the metric, and filtering on it, only reads the rows of the page and O(log n)
+          values for the bounds, whatever the number of rows
+        - sorting filtered rows on the names or codes, or filtering on them, reads the matching rows
+
+        Args:
+            metric (str): metric of the values (and of the conditions)
+            year (str): year of the rows
+            start (int): first position of the page
+            stop (int): last position of the page (excluded)
+            sort (str): 'value', 'name' (state names) or 'code'
+            descending (bool): sort in descending order (missing values stay last)
+            conditions (list): (operator, bound) conditions on the metric, operators of rank_range or 'ne'
+                (rows whose value differs from the bound, missing values included)
+            text_filters (list): ('name' or 'code', operator, text) filters, operators 'contains', 'eq' and 'ne'
+                on the state names (or codes), case insensitive
+            decimals (int): compare the values of the conditions rounded to this many decimals
+
+        Returns:
+            rows (np.ndarray): rows of the page, to index states, codes and values
+            total (int): number of rows matching the filters
+        """
+        order = self.order[metric, year]
+        valid = self.valid[metric, year]
+        if conditions or text_filters:
+            # Excluded values split the rank range: their rows are filtered like the text filters
+            excluded = [bound for operator, bound in conditions if operator == 'ne']
+            conditions = [(operator, bound) for operator, bound in conditions if operator != 'ne']
+            first, last = self.rank_range(metric, year, conditions, decimals) if conditions else (0, len(order))
+            if sort == 'value' and not text_filters and not excluded:
+                # Contiguous ranks: positions map to ranks directly
+                positions = np.arange(start, min(stop, last - first))
+                ranks = first + positions if descending else last - 1 - positions
+                return order[ranks], last - first
+            rows = np.asarray(order[first:last])
+            if excluded:
+                values = self.values[metric, year][rows]
+                rows = rows[~np.isin(values if decimals is None else np.round(values, decimals), excluded)]
+            for key, operator, text in text_filters:
+                keys = np.char.lower(np.asarray((self.states if key == 'name' else self.codes)[year][rows], dtype=str))
+                matches = np.char.find(keys, text.lower()) >= 0 if operator == 'contains' else keys == text.lower()
+                rows = rows[~matches if operator == 'ne' else matches]
+            if sort == 'value':
+                # rows are in descending rank order, missing values last
+                if not descending:
+                    missing = np.isnan(self.values[metric, year][rows])
+                    rows = np.concatenate([rows[~missing][::-1], rows[missing]])
+            else:
+                keys = self.states[year] if sort == 'name' else self.codes[year]
+                rows = rows[np.argsort(np.asarray(keys[rows]), kind='stable')]
+                rows = rows if not descending else rows[::-1]
+            return rows[start:stop], len(rows)
+
+        total = len(order)
+        positions = np.arange(start, min(stop, total))
+        if sort == 'value':
+            # Missing values stay last in both directions
+            ranks = positions if descending else np.where(positions < valid, valid - 1 - positions, positions)
+            return order[ranks], total
+        key_order = self.name_order[year] if sort == 'name' else self.code_order[year]
+        return (key_order[total - 1 - positions] if descending else key_order[positions]), total
@@ -0,0 +1,276 @@
+########################################################
+
+# DOWNLOADABLE EXPORTS OF THE ESTIMATES
+# Run by snapshot.py (or at app startup when missing): writes the
+# (State, Year) and State level tables as CSV, xlsx and, when a parquet
+# engine is installed, Parquet, in a directory per data version.
+# The download routes of app.py stream these files, filtered exports are
+# streamed in chunks (CSV) or written once per filter and data version.
+
+########################################################
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+from cache import file_digest, read_frame, write_frame
+from compute_animal_farmers import STATE_PATH, STATE_YEAR_PATH, find_output, read_dataset, write_xlsx
+
+
+EXPORT_DIR = 'data/exports'
+EXPORT_TABLES = {'state_year': STATE_YEAR_PATH, 'state': STATE_PATH}
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Rows per chunk of the streamed CSV exports
+CHUNK_ROWS = 1000
+# Number of filtered xlsx / Parquet exports kept per data version (least recently used are removed first)
+MAX_FILTERED_EXPORTS = 64
+# Number of data versions kept: app workers that did not reload their data yet still serve older versions
+KEEP_EXPORT_VERSIONS = 3
+
+
+def parquet_available() -> bool:
+    """
+    Checks whether a parquet engine (pyarrow or fastparquet) is installed
+    """
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+            return True
+        except ImportError:
+            pass
+    return False
+
+
+def data_version(sources: dict = EXPORT_TABLES) -> str:
+    """
+    Version of the exported data: hash of the contents of the pipeline outputs
+
+    Args:
+        sources (dict): table name -> path of the pipeline output (the latest file written in any of the
+            output formats is used, see find_output)
+
+    Returns:
+        (str): data version
+    """
+    digest = hashlib.sha256()
+    for table, path in sorted(sources.items()):
+        digest.update(f'{table}:{file_digest(find_output(path))}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def read_table(path: str) -> pd.DataFrame:
+    """
+    Reads a pipeline output for export, in any of its output formats, years as text like in the xlsx files
+    """
+    df = read_dataset(path)
+    if 'Year' in df.columns:
+        df['Year'] = df['Year'].astype(str)
+    return df
+
+
+def export_versions(directory: str = EXPORT_DIR) -> list:
+    """
+    Lists the published data versions of the exports, most recently published first
+
+    Args:
+        directory (str): root directory of the exports
+
+    Returns:
+        (list): version directory names (versions being written are left out)
+    """
+    if not os.path.isdir(directory):
+        return []
+    versions = [entry for entry in os.listdir(directory) if not entry.endswith('.tmp')]
+    return sorted(versions, key=lambda version: os.path.getmtime(os.path.join(directory, version)), reverse=True)
+
+
+def build_exports(directory: str = EXPORT_DIR, sources: dict = EXPORT_TABLES) -> str:
+    """
+    Writes the exports of the current data version, and removes the exports of the versions older than
+    the last KEEP_EXPORT_VERSIONS
+
+    Args:
+        directory (str): root directory of the exports
+        sources (dict): table name -> path of the pipeline output (in any of its output formats)
+
+    Returns:
+        (str): directory of the exports of the current data version
+    """
+    version = data_version(sources)
+    version_directory = os.path.join(directory, version)
+    # One temporary directory per build: app workers reloading the data may build the same version at once
+    os.makedirs(directory, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(prefix=f'{version}.', suffix='.tmp', dir=directory)
+    os.chmod(tmp_directory, 0o755)
+    for table, path in sources.items():
+        path = find_output(path)
+        df = read_table(path)
+        # Typed copy of the table, used to filter the exports
+        write_frame(df, os.path.join(tmp_directory, f'{table}.npz'))
+        df.to_csv(os.path.join(tmp_directory, f'{table}.csv'), index=False)
+        if path.endswith('.xlsx'):
+            shutil.copyfile(path, os.path.join(tmp_directory, f'{table}.xlsx'))
+        else:
+            write_xlsx(df, os.path.join(tmp_directory, f'{table}.xlsx'))
+        if parquet_available():
+            df.to_parquet(os.path.join(tmp_directory, f'{table}.parquet'), index=False)
+
+    # Publish the version at once, then remove old versions no worker should still serve
+    try:
+        os.replace(tmp_directory, version_directory)
+    except OSError:
+        # Another process published the version first
+        shutil.rmtree(tmp_directory)
+        os.utime(version_directory)
+    for entry in export_versions(directory)[KEEP_EXPORT_VERSIONS:]:
+        if entry != version:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    print(f"Wrote exports {version_directory}")
+
+    return version_directory
+
+
+class ExportStore:
+    """
+    Exports of one data version: the precomputed files, their typed tables for filtering, and a
+    cache of filtered xlsx / Parquet files
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.version = os.path.basename(directory)
+        self.tables = {table: read_frame(os.path.join(directory, f'{table}.npz')) for table in EXPORT_TABLES}
+
+    def formats(self) -> list:
+        return [fmt for fmt in EXPORT_MIMETYPES if fmt != 'parquet' or parquet_available()]
+
+    def metrics(self, table: str) -> list:
+        """
+        Metrics of a table: the columns of the (State, Year) table, the column prefixes of the State table
+        """
+        columns = [column for column in self.tables[table].columns if column not in ('State', 'Year')]
+        if table == 'state':
+            columns = list(dict.fromkeys(column.rsplit('_', 1)[0] for column in columns))
+        return columns
+
+    def select(self, table: str, metrics: list = None, years: list = None, states: list = None) -> pd.DataFrame:
+        """
+        Filters a table on metrics, years and states
+
+        Args:
+            table (str): 'state_year' or 'state'
+            metrics (list): metrics to keep (None keeps every metric)
+            years (list): years to keep, as strings (None keeps every year)
+            states (list): states to keep (None keeps every state)
+
+        Returns:
+            (pd.DataFrame): filtered table, rows and columns in the order of the full table
+
+        Raises:
+            ValueError: unknown metric or state
+        """
+        df = self.tables[table]
+        for name, values, known in [('metric', metrics, self.metrics(table)), ('state', states, df['State'].tolist())]:
+            unknown = sorted(set(values or []) - set(known))
+            if unknown:
+                raise ValueError(f"Unknown {name}: {', '.join(unknown)}")
+
+        rows = df['State'].isin(states) if states else pd.Series(True, index=df.index)
+        if table == 'state_year':
+            if years:
+                rows &= df['Year'].isin(years)
+            columns = ['State', 'Year'] + [column for column in df.columns[2:] if not metrics or column in metrics]
+        else:
+            # Columns are named metric_year
+            columns = ['State'] + [column for column in df.columns[1:]
+                                   if (not metrics or column.rsplit('_', 1)[0] in metrics)
+                                   and (not years or column.rsplit('_', 1)[1] in years)]
+        return df.loc[rows, columns]
+
+    def path(self, table: str, fmt: str) -> str:
+        return os.path.join(self.directory, f'{table}.{fmt}')
+
+    def iter_csv(self, df: pd.DataFrame):
+        """
+        Streams a table as CSV, CHUNK_ROWS rows at a time
+
+        Args:
+            df (pd.DataFrame): table to be streamed
+
+        Returns:
+            (generator): CSV text chunks, the header first
+        """
+        yield df.head(0).to_csv(index=False)
+        for start in range(0, len(df), CHUNK_ROWS):
+            yield df.iloc[start:start + CHUNK_ROWS].to_csv(index=False, header=False)
+
+    def filtered_path(self, table: str, fmt: str, df: pd.DataFrame, key: str) -> str:
+        """
+        Writes a filtered table once per data version and filter, then reuses the file
+
+        Args:
+            table (str): 'state_year' or 'state'
+            fmt (str): 'xlsx' or 'parquet'
+            df (pd.DataFrame): filtered table
+            key (str): canonical form of the filters
+
+        Returns:
+            (str): path of the filtered export
+        """
+        cache_directory = os.path.join(self.directory, 'filtered')
+        if not os.path.isdir(cache_directory):
+            # Not makedirs: the directory of a removed version must not be recreated
+            try:
+                os.mkdir(cache_directory)
+            except FileExistsError:
+                pass
+        name = f"{table}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.{fmt}"
+        path = os.path.join(cache_directory, name)
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        # Hidden temporary file, keeping the extension the writers expect
+        tmp_path = os.path.join(cache_directory, f'.{os.getpid()}-{name}')
+        if fmt == 'xlsx':
+            write_xlsx(df, tmp_path)
+        else:
+            df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+        # Least recently used filtered exports are removed first
+        files = sorted((os.stat(os.path.join(cache_directory, name)).st_mtime, os.path.join(cache_directory, name))
+                       for name in os.listdir(cache_directory) if not name.startswith('.'))
+        for _, old_path in files[:-MAX_FILTERED_EXPORTS]:
+            os.remove(old_path)
+        return path
+
+
+def load_exports(directory: str = EXPORT_DIR, sources: dict = EXPORT_TABLES) -> ExportStore:
+    """
+    Loads the exports of the current data version, writing them first when they are missing
+
+    Args:
+        directory (str): root directory of the exports
+        sources (dict): table name -> path of the pipeline output
+
+    Returns:
+        (ExportStore): exports, or None when the pipeline outputs are not available
+    """
+    if not all(os.path.exists(find_output(path)) for path in sources.values()):
+        # Deployments may ship the exports without the pipeline outputs: use the latest complete version
+        for version in export_versions(directory):
+            version_directory = os.path.join(directory, version)
+            if all(os.path.exists(os.path.join(version_directory, f'{table}.npz')) for table in EXPORT_TABLES):
+                return ExportStore(version_directory)
+        return None
+    version_directory = os.path.join(directory, data_version(sources))
+    if not os.path.isdir(version_directory):
+        version_directory = build_exports(directory, sources)
+    return ExportStore(version_directory)
@@ -0,0 +1,273 @@
+########################################################
+
+# DECLARATIVE REGISTRY OF THE METRICS
+# Every metric of the estimates and of the dashboard is declared once: its
+# expression (none for the values read from the sources), title, legend,
+# data source and calculation. Expressions are compiled once to python code
+# evaluating whole columns (numpy arrays or pandas series) at a time, and
+# their dependencies are read from the expression.
+# The pipeline computes the estimates from these expressions, dictionaries.py
+# builds the labels of the dashboard from them, and the app index (see
+# data_index.py) evaluates the derived metrics the first time they are
+# requested.
+
+########################################################
+
+import ast
+import re
+
+import numpy as np
+
+
+## Functions available in the expressions, applied to whole columns
+FUNCTIONS = {'rint': np.rint, 'where': np.where, 'isnan': np.isnan, 'abs': np.abs}
+## Syntax allowed in the expressions: arithmetic on columns, constants and calls of FUNCTIONS
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+                 ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+## Column names that are not identifiers are quoted with backticks, like in DataFrame.eval
+QUOTED_NAME = re.compile(r'`([^`]+)`')
+
+
+def compile_expression(expression: str) -> tuple:
+    """
+    Compiles the expression of a metric
+
+    Args:
+        expression (str): arithmetic expression on column and metric names, e.g. 'rint(share * farmers)'
+
+    Returns:
+        code (code): compiled expression, evaluated with the columns bound to identifiers
+        names (dict): identifier of the compiled code -> column or metric name, in order of appearance
+
+    Raises:
+        ValueError: syntax outside of ALLOWED_NODES, or a call of a function outside of FUNCTIONS
+    """
+    quoted = {}
+
+    def identifier(match):
+        return quoted.setdefault(match.group(1), f'_column_{len(quoted)}')
+
+    tree = ast.parse(QUOTED_NAME.sub(identifier, expression), mode='eval')
+    functions = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"Unsupported syntax in metric expression {expression!r}: {type(node).__name__}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise ValueError(f"Unsupported call in metric expression {expression!r}, "
+                                 f"expected one of {', '.join(FUNCTIONS)}")
+            functions.add(id(node.func))
+    columns = {identifier: name for name, identifier in quoted.items()}
+    nodes = sorted((node for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in functions),
+                   key=lambda node: node.col_offset)
+    names = {node.id: columns.get(node.id, node.id) for node in nodes}
+
+    return compile(tree, f'<metric {expression}>', 'eval'), names
+
+
+class Metric:
+    """
+    Declaration of a metric
+
+    Attributes:
+        name (str): column name of the metric
+        title (str): title of the metric on the dashboard
+        legend (str): legend of the figures of the metric
+        source (str): data sources of the metric
+        calculation (str): calculation of the metric, as shown on the dashboard
+        expression (str): expression computing the metric from other columns and metrics (None for the
+            values read from the sources)
+        dependencies (list): columns and metrics read by the expression
+    """
+
+    def __init__(self, name: str, title: str, legend: str, source: str, calculation: str, expression: str = None):
+        self.name = name
+        self.title = title
+        self.legend = legend
+        self.source = source
+        self.calculation = calculation
+        self.expression = expression
+        self.code, self._names = compile_expression(expression) if expression else (None, {})
+        self.dependencies = list(dict.fromkeys(self._names.values()))
+
+    def evaluate(self, columns):
+        """
+        Evaluates the expression on columns
+
+        Args:
+            columns (mapping): name -> column (numpy array or pandas series) of every dependency
+
+        Returns:
+            (np.ndarray or pd.Series): values of the metric
+        """
+        return eval(self.code, {'__builtins__': {}, **FUNCTIONS},
+                    {identifier: columns[name] for identifier, name in self._names.items()})
+
+
+class MetricRegistry:
+    """
+    Metrics by name, in declaration order
+    """
+
+    def __init__(self, metrics: list):
+        self.metrics = {metric.name: metric for metric in metrics}
+        for name in self.metrics:
+            self.requirements(name)
+
+    def __getitem__(self, name: str) -> Metric:
+        return self.metrics[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.metrics
+
+    def __iter__(self):
+        return iter(self.metrics)
+
+    def requirements(self, name: str, columns=(), _path: tuple = ()) -> list:
+        """
+        Columns a metric is computed from: the dependencies of its expression, recursively, down to the
+        given columns, the metrics without expression and the columns that are not metrics
+
+        Args:
+            name (str): metric or column name
+            columns (collection): names of the available columns, used instead of computing them
+
+        Returns:
+            (list): names of the columns needed, [name] itself for a column or a value read from the sources
+
+        Raises:
+            ValueError: the expressions depend on each other in a cycle
+        """
+        if name in _path:
+            raise ValueError(f"Metric expressions depend on each other: {' -> '.join(_path + (name,))}")
+        metric = self.metrics.get(name)
+        if name in columns or metric is None or metric.expression is None:
+            return [name]
+        return list(dict.fromkeys(column for dependency in metric.dependencies
+                                  for column in self.requirements(dependency, columns, _path + (name,))))
+
+    def available(self, names: list, columns) -> list:
+        """
+        Metrics that are columns or can be computed from columns
+
+        Args:
+            names (list): metric names
+            columns (collection): names of the available columns
+
+        Returns:
+            (list): names of the metrics available, in the order of names
+        """
+        return [name for name in names if all(column in columns for column in self.requirements(name, columns))]
+
+    def evaluate(self, name: str, columns):
+        """
+        Computes a metric from columns, computing the metrics it depends on that are not columns
+
+        Args:
+            name (str): metric name
+            columns (mapping): name -> column (e.g. a dataframe, or a dict of arrays); columns named after
+                a metric are used instead of its expression
+
+        Returns:
+            (np.ndarray or pd.Series): values of the metric
+
+        Raises:
+            KeyError: a column needed by the expressions is missing
+        """
+        if name in columns:
+            return columns[name]
+        return _Resolver(self, columns, name)[name]
+
+
+class _Resolver:
+    """
+    Columns read by the expressions: the given columns, then the metrics computed from them (each once)
+    """
+
+    def __init__(self, registry: MetricRegistry, columns, name: str):
+        self.registry = registry
+        self.columns = columns
+        self.name = name
+        self.computed = {}
+
+    def __getitem__(self, dependency: str):
+        if dependency in self.columns:
+            return self.columns[dependency]
+        if dependency not in self.computed:
+            metric = self.registry.metrics.get(dependency)
+            if metric is None or metric.expression is None:
+                raise KeyError(f"Column {dependency} is missing to compute metric {self.name}")
+            self.computed[dependency] = metric.evaluate(self)
+        return self.computed[dependency]
+
+
+REGISTRY = MetricRegistry([
+    Metric('Animal_ag_share_no_feed',
+           title='Animal Agriculture Share, Excluding Feed Commodities (AASXF)',
+           legend='Share (%)',
+           source='ERS',
+           calculation='''AASXF = (Animals and Products) / (All Commodities)''',
+           expression='`Animals and products` / `All commodities`'),
+    Metric('Animal_ag_share_feed',
+           title='Animal Agriclutre Share, Including Feed Commodities (AASF)',
+           legend='Share (%)',
+           source='ERS',
+           calculation='''AASF = (Animals and Products + Feed Crops) / (All Commodities)''',
+           expression='(`Animals and products` + `Feed crops`) / `All commodities`'),
+    Metric('Number_of_Family_Farmers',
+           title='Number of Individual and Family Farmers (IFF)',
+           legend='# of Farmers',
+           source='NASS',
+           calculation='''IFF = (NASS Field) "FARM OPERATIONS, ORGANIZATION, TAX PURPOSES, FAMILY & INDIVIDUAL - NUMBER OF OPERATIONS"'''),
+    # Farmer counts are rounded to the nearest integer
+    Metric('Farmers_in_animal_ag_no_feed',
+           title='Individual and Family Animal Farmers, Excluding Feed Commodities (IFAFXF)',
+           legend='# of Farmers',
+           source='ERS, NASS',
+           calculation='''IFAFXF = AASXF * IFF''',
+           expression='rint(Animal_ag_share_no_feed * Number_of_Family_Farmers)'),
+    Metric('Farmers_in_animal_ag_feed',
+           title='Individual and Family Animal Farmers, Including Feed Commodities (IFAFF)',
+           legend='# of Farmers',
+           source='ERS, NASS',
+           calculation='''IFAFF = AASF * IFF''',
+           expression='rint(Animal_ag_share_feed * Number_of_Family_Farmers)'),
+    Metric('Total_Population',
+           title='Total Population',
+           legend='# of People',
+           source='CPS',
+           calculation='Raw value from CPS'),
+    Metric('Total_Registered',
+           title='Total Registered Voters',
+           legend='# of Voters',
+           source='CPS',
+           calculation='Raw value from CPS'),
+    ###### NORMALIZATION METRICS #####
+    Metric('farmers_no_feed_per_person',
+           title='Share of Individual and Family Animal Farmers in State Population, Excluding Feed Commodities (IFAFXFSP)',
+           legend='# Farmers / Person',
+           source='ERS, NASS, CPS',
+           calculation='IFAFXFSP = (IFAFXF) / (Total Population)',
+           expression='Farmers_in_animal_ag_no_feed / Total_Population'),
+    Metric('farmers_feed_per_person',
+           title='Share of Individual and Family Animal Farmers in State Population, Including Feed Commodities (IFAFXFTRV)',
+           legend='# Farmers / Person',
+           source='ERS, NASS, CPS',
+           calculation='IFAFXFRV = (IFAFXF) / (Total Registered Voters)',
+           expression='Farmers_in_animal_ag_feed / Total_Population'),
+    Metric('farmers_no_feed_per_voter',
+           title='Share of Individual and Family Animal Farmers in Total Registered Voters, Excluding Feed Commodities (IFAFFSP)',
+           legend='# Farmers / Voter',
+           source='ERS, NASS, CPS',
+           calculation='IFAFFSP = (IFAFF) / (Total Population)',
+           expression='Farmers_in_animal_ag_no_feed / Total_Registered'),
+    Metric('farmers_feed_per_voter',
+           title='Share of Individual and Family Animal Farmers in Total Registered Voters, Including Feed Commodities (IFAFFTRV)',
+           legend='# Farmers / Voter',
+           source='ERS, NASS, CPS',
+           calculation='IFAFXFRV = (IFAFXF) / (Total Registered Voters)',
+           expression='Farmers_in_animal_ag_feed / Total_Registered'),
+])
+
+## Metrics shown on the dashboard, in the order of the metric dropdown
+DASHBOARD_METRICS = list(REGISTRY)
@@ -0,0 +1,113 @@
+########################################################
+
+# RUNTIME INSTRUMENTATION
+# Histograms of the Dash callback latencies and payload sizes, counters and
+# info gauges, rendered in the Prometheus text format by the /metrics route
+# of app.py.
+
+########################################################
+
+import threading
+
+
+# Upper bounds of the histogram buckets: seconds, and bytes (1 KB to 16 MB)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(8))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """
+    Cumulative histogram with one label (e.g. the callback), in the Prometheus text format
+    - observations are thread safe, every label value gets its own buckets, sum and count
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: tuple, label: str = 'callback'):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        """
+        Records an observation
+
+        Args:
+            label_value (str): value of the label (e.g. the outputs of a callback)
+            value (float): observed value (e.g. a latency in seconds)
+        """
+        with self._lock:
+            series = self._series.setdefault(label_value, {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self) -> str:
+        """
+        Renders the histogram in the Prometheus text exposition format
+
+        Returns:
+            (str): HELP and TYPE lines, then the bucket, sum and count samples of every label value
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {label_value: dict(values, buckets=list(values['buckets']))
+                      for label_value, values in self._series.items()}
+        for label_value, values in series.items():
+            label = f'{self.label}="{_escape(label_value)}"'
+            for bound, count in zip(self.buckets, values['buckets']):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {values["count"]}')
+            lines.append(f'{self.name}_sum{{{label}}} {values["sum"]:.9g}')
+            lines.append(f'{self.name}_count{{{label}}} {values["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _render_samples(name: str, documentation: str, kind: str, values, label: str = None) -> str:
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    if label is None:
+        lines.append(f'{name} {values}')
+    else:
+        lines += [f'{name}{{{label}="{_escape(label_value)}"}} {value}' for label_value, value in values.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def render_counter(name: str, documentation: str, values, label: str = None) -> str:
+    """
+    Renders a counter in the Prometheus text exposition format
+
+    Args:
+        name (str): metric name, ending in _total
+        documentation (str): HELP text
+        values (dict or int): label value -> counter value, or the counter value without label
+        label (str): label name (None for a counter without label)
+
+    Returns:
+        (str): HELP and TYPE lines, then one sample per label value
+    """
+    return _render_samples(name, documentation, 'counter', values, label)
+
+
+def render_info(name: str, documentation: str, label: str, label_value: str) -> str:
+    """
+    Renders an info gauge in the Prometheus text exposition format: one sample of value 1 whose label
+    holds the information (e.g. the current data version), so the series changes with the information
+    without adding one series per value to the other metrics
+
+    Args:
+        name (str): metric name, ending in _info
+        documentation (str): HELP text
+        label (str): label name
+        label_value (str): information
+
+    Returns:
+        (str): HELP and TYPE lines, then the sample
+    """
+    return _render_samples(name, documentation, 'gauge', {label_value: 1}, label)
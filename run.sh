@@ -18,4 +18,8 @@ printf "\n=== Running compute_animal_farmers.py script ===\n"
 python3 compute_animal_farmers.py
 printf "\n=== Finished running compute_animal_farmers.py script ===\n\n"
 
+printf "\n=== Running snapshot.py script ===\n"
+python3 snapshot.py
+printf "\n=== Finished running snapshot.py script ===\n\n"
+
 echo ================ Finished estimating the number of family farmers by state ... ================
\ No newline at end of file
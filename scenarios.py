@@ -0,0 +1,166 @@
+########################################################
+
+# SENSITIVITY OF THE ESTIMATES TO THE MODEL ASSUMPTIONS
+# The estimates count one person per family farm, and use the animal
+# agriculture share of revenue as the share of farmers. This engine
+# re-evaluates the farmer estimates for thousands of assumption sets at once,
+# broadcasting (scenario, year, state) arrays built from the app index, and
+# summarizes them as quantile bands.
+
+########################################################
+
+import numpy as np
+import pandas as pd
+
+from data_index import DataIndex
+
+
+## Assumptions of the published estimates, used for the parameters a scenario set leaves out:
+## - persons_per_farm: people counted per family farm (multiplies the number of family farmers)
+## - feed_weight: share of the feed crops revenue counted as animal agriculture in the "feed" estimates
+##   (0 gives the "no feed" shares, 1 the published "feed" shares)
+## - registered_factor: multiplier of the registered voters (e.g. registration rate adjustments)
+## - population_factor: multiplier of the population
+BASELINE = {'persons_per_farm': 1.0, 'feed_weight': 1.0, 'registered_factor': 1.0, 'population_factor': 1.0}
+
+## Metrics re-evaluated for each scenario
+SCENARIO_METRICS = ['Farmers_in_animal_ag_no_feed', 'Farmers_in_animal_ag_feed',
+                    'farmers_no_feed_per_person', 'farmers_feed_per_person',
+                    'farmers_no_feed_per_voter', 'farmers_feed_per_voter']
+
+## Index metrics the scenarios are computed from
+INPUT_METRICS = ['Animal_ag_share_no_feed', 'Animal_ag_share_feed', 'Number_of_Family_Farmers',
+                 'Total_Population', 'Total_Registered']
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def sample_scenarios(n: int, ranges: dict, seed: int = 0) -> dict:
+    """
+    Draws assumption sets, each parameter uniformly in its range
+
+    Args:
+        n (int): number of scenarios
+        ranges (dict): parameter -> (low, high) range, or a single value; parameters left out keep
+            their BASELINE value
+        seed (int): seed of the random generator
+
+    Returns:
+        (dict): parameter -> array of n values, for every parameter of BASELINE
+
+    Raises:
+        ValueError: unknown parameter
+    """
+    unknown = sorted(set(ranges) - set(BASELINE))
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters: {', '.join(unknown)}")
+    rng = np.random.default_rng(seed)
+    scenarios = {}
+    for parameter, baseline in BASELINE.items():
+        bounds = np.atleast_1d(np.asarray(ranges.get(parameter, baseline), dtype='float64'))
+        scenarios[parameter] = rng.uniform(bounds[0], bounds[-1], n)
+    return scenarios
+
+
+class ScenarioEngine:
+    """
+    Inputs of the farmer estimates as (year, state) arrays, re-evaluated for sets of assumptions
+
+    Attributes:
+        years (list): years of the data, as strings, in increasing order
+        states (np.ndarray): state names, in order of first appearance in the index
+        present (np.ndarray): (year, state) mask of the states in the index each year
+        inputs (dict): metric of INPUT_METRICS -> (year, state) array, NaN where a state has no data that year
+    """
+
+    def __init__(self, index: DataIndex):
+        self.years = list(index.years)
+        self.states = pd.unique(np.concatenate([np.asarray(index.states[year]) for year in self.years]))
+        positions = pd.Index(self.states)
+        self.present = np.zeros((len(self.years), len(self.states)), dtype=bool)
+        self.inputs = {metric: np.full((len(self.years), len(self.states)), np.nan) for metric in INPUT_METRICS}
+        for i, year in enumerate(self.years):
+            columns = positions.get_indexer(np.asarray(index.states[year]))
+            self.present[i, columns] = True
+            for metric in INPUT_METRICS:
+                self.inputs[metric][i, columns] = index.values[metric, year]
+
+    def evaluate(self, scenarios: dict, years: list = None, metrics: list = SCENARIO_METRICS) -> dict:
+        """
+        Evaluates metrics for every scenario, year and state
+
+        Args:
+            scenarios (dict): parameter -> array of values, one per scenario (see sample_scenarios);
+                missing parameters keep their BASELINE value
+            years (list): years to evaluate, as strings (None evaluates every year)
+            metrics (list): metrics of SCENARIO_METRICS to evaluate
+
+        Returns:
+            (dict): metric -> (scenario, year, state) array
+        """
+        rows = [self.years.index(year) for year in years] if years is not None else slice(None)
+        inputs = {metric: values[rows] for metric, values in self.inputs.items()}
+        n = max([np.size(values) for values in scenarios.values()], default=1)
+        # (scenario, 1, 1) parameters broadcast against the (year, state) inputs
+        parameters = {parameter: np.broadcast_to(np.asarray(scenarios.get(parameter, baseline), dtype='float64'),
+                                                 (n,)).reshape(n, 1, 1)
+                      for parameter, baseline in BASELINE.items()}
+
+        farms = parameters['persons_per_farm'] * inputs['Number_of_Family_Farmers']
+        results = {}
+        for variant in ('no_feed', 'feed'):
+            names = [f'Farmers_in_animal_ag_{variant}', f'farmers_{variant}_per_person', f'farmers_{variant}_per_voter']
+            if not set(names) & set(metrics):
+                continue
+            if variant == 'no_feed':
+                share = inputs['Animal_ag_share_no_feed']
+            else:
+                # Written as a weighted sum, so a weight of 1 gives the published feed shares exactly
+                share = (parameters['feed_weight'] * inputs['Animal_ag_share_feed']
+                         + (1 - parameters['feed_weight']) * inputs['Animal_ag_share_no_feed'])
+            # Farmer counts are rounded to the nearest integer, like the published estimates
+            results[names[0]] = np.rint(share * farms)
+            if names[1] in metrics:
+                results[names[1]] = results[names[0]] / (parameters['population_factor'] * inputs['Total_Population'])
+            if names[2] in metrics:
+                results[names[2]] = results[names[0]] / (parameters['registered_factor'] * inputs['Total_Registered'])
+        return {metric: results[metric] for metric in metrics}
+
+    def quantile_bands(self, scenarios: dict, years: list = None, quantiles: tuple = QUANTILES,
+                       metrics: list = SCENARIO_METRICS) -> dict:
+        """
+        Summarizes the distribution of the metrics over the scenarios
+
+        Args:
+            scenarios (dict): parameter -> array of values, one per scenario
+            years (list): years to evaluate, as strings (None evaluates every year)
+            quantiles (tuple): quantiles of the bands, between 0 and 1
+            metrics (list): metrics to summarize
+
+        Returns:
+            (dict): metric -> (quantile, year, state) array, NaN where a state has no data
+        """
+        results = self.evaluate(scenarios, years, metrics)
+        with np.errstate(invalid='ignore'):
+            return {metric: np.quantile(results[metric], quantiles, axis=0) for metric in metrics}
+
+    def bands_table(self, scenarios: dict, metric: str, year: str, quantiles: tuple = QUANTILES) -> pd.DataFrame:
+        """
+        Quantile bands of a metric for one year, with the value of the published estimates
+
+        Args:
+            scenarios (dict): parameter -> array of values, one per scenario
+            metric (str): metric of SCENARIO_METRICS
+            year (str): year to evaluate
+            quantiles (tuple): quantiles of the bands, between 0 and 1
+
+        Returns:
+            (pd.DataFrame): one row per state with data that year: State, baseline, then one column per
+                quantile (e.g. q05, q50, q95)
+        """
+        bands = self.quantile_bands(scenarios, [year], quantiles, [metric])[metric][:, 0, :]
+        baseline = self.evaluate({}, [year], [metric])[metric][0, 0, :]
+        table = pd.DataFrame({'State': self.states, 'baseline': baseline})
+        for quantile, values in zip(quantiles, bands):
+            table[f'q{round(quantile * 100):02d}'] = values
+        return table[self.present[self.years.index(year)]].reset_index(drop=True)
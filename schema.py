@@ -0,0 +1,129 @@
+########################################################
+
+# TYPED SCHEMA OF THE PIPELINE TABLES
+# State (and FIPS) are categoricals, Year a small integer and counts compact
+# integers, so the tables stay small as the panel grows to county x year.
+# Joins on [State, Year] / [FIPS, Year] go through integer keys built from
+# the category codes and years, looked up in an index of the right table.
+
+########################################################
+
+import numpy as np
+import pandas as pd
+
+
+YEAR_DTYPE = 'int16'
+# Farmer counts and population / voter totals (true values, at most a few hundred million)
+COUNT_DTYPE = 'int32'
+# Ratios and percentages stay float64: float32 would change the exported values
+# (e.g. 65.1 becomes 65.09999847)
+METRIC_DTYPE = 'float64'
+
+
+def to_year(values: pd.Series) -> pd.Series:
+    """
+    Converts years (e.g. 2017, "2017" or the forecast "2021F") to small integers
+
+    Args:
+        values (pd.Series): years, as numbers or strings
+
+    Returns:
+        (pd.Series): years as YEAR_DTYPE
+    """
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype(YEAR_DTYPE)
+    return values.astype(str).str.replace('F', '', regex=False).astype(YEAR_DTYPE)
+
+
+def to_category(values: pd.Series) -> pd.Series:
+    """
+    Converts labels (states, counties, FIPS codes) to a categorical, categories in order of appearance
+
+    Args:
+        values (pd.Series): labels
+
+    Returns:
+        (pd.Series): categorical labels
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    return pd.Series(pd.Categorical(values, categories=pd.unique(values.dropna())), index=values.index,
+                     name=values.name)
+
+
+def to_count(values: pd.Series) -> pd.Series:
+    """
+    Converts counts to COUNT_DTYPE, keeping float64 when some counts are missing
+
+    Args:
+        values (pd.Series): counts
+
+    Returns:
+        (pd.Series): compact counts
+    """
+    values = pd.to_numeric(values)
+    if values.isna().any() or (values % 1 != 0).any():
+        return values.astype('float64')
+    return values.astype(COUNT_DTYPE)
+
+
+def _key_codes(left: pd.Series, right: pd.Series) -> tuple:
+    """
+    Integer codes of a join column in both tables, -1 for missing values
+    - categoricals are recoded to the union of their categories, other columns are factorized together
+    """
+    if isinstance(left.dtype, pd.CategoricalDtype) or isinstance(right.dtype, pd.CategoricalDtype):
+        left, right = left.astype('category'), right.astype('category')
+        categories = left.cat.categories.union(right.cat.categories, sort=False)
+        return (left.cat.set_categories(categories).cat.codes.to_numpy(),
+                right.cat.set_categories(categories).cat.codes.to_numpy())
+    codes, _ = pd.factorize(pd.concat([left, right], ignore_index=True))
+    return codes[:len(left)], codes[len(left):]
+
+
+def join_keys(left: pd.DataFrame, right: pd.DataFrame, on: list) -> tuple:
+    """
+    Builds one int64 key per row of each table from the join columns
+
+    Args:
+        left (pd.DataFrame): left table
+        right (pd.DataFrame): right table
+        on (list): join columns, present in both tables
+
+    Returns:
+        left_keys (np.ndarray): keys of the left rows, -1 where a join column is missing
+        right_keys (np.ndarray): keys of the right rows, -1 where a join column is missing
+    """
+    codes = [_key_codes(left[column], right[column]) for column in on]
+    dims = [max(int(left_codes.max(initial=-1)), int(right_codes.max(initial=-1))) + 1 for left_codes, right_codes in codes]
+    keys = []
+    for side in (0, 1):
+        side_codes = [column_codes[side] for column_codes in codes]
+        missing = np.any([column_codes < 0 for column_codes in side_codes], axis=0)
+        side_keys = np.ravel_multi_index([np.maximum(column_codes, 0) for column_codes in side_codes], dims)
+        keys.append(np.where(missing, -1, side_keys))
+    return keys[0], keys[1]
+
+
+def left_join(left: pd.DataFrame, right: pd.DataFrame, on: list) -> pd.DataFrame:
+    """
+    Left join on integer keys: every left row, in order, with the matching right columns
+    - same result as left.merge(right, on=on, how='left') for a right table with unique keys,
+      without hashing the (categorical or string) join columns
+
+    Args:
+        left (pd.DataFrame): left table
+        right (pd.DataFrame): right table, one row per key
+        on (list): join columns, present in both tables
+
+    Returns:
+        (pd.DataFrame): left columns followed by the right columns other than the join columns
+    """
+    on = list(on)
+    left_keys, right_keys = join_keys(left, right, on)
+    right_indexed = right.drop(columns=on).set_index(pd.Index(right_keys))[right_keys >= 0]
+    if not right_indexed.index.is_unique:
+        raise ValueError(f"Right table of the join has duplicate {on} keys")
+    # Keys absent from the right table (and missing keys, -1) get missing values
+    matched = right_indexed.reindex(left_keys)
+    return pd.concat([left.reset_index(drop=True), matched.reset_index(drop=True)], axis=1)
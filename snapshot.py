@@ -0,0 +1,285 @@
+########################################################
+
+# READY-TO-SERVE DATA SNAPSHOT FOR THE DASH APP
+# Run `python3 snapshot.py` after compute_animal_farmers.py to write the
+# snapshot: (State, Year) estimates and state codes, stored as an .npz file
+# that app.py loads in milliseconds, without network access. The metrics
+# computed from the estimates (see metric_registry.py) are not stored, the
+# app index evaluates them when they are first viewed.
+# With county level estimates, also writes the county snapshot and a
+# simplified copy of the county geometry.
+# The app index (see data_index.py) is also saved as a directory of .npy
+# files, memory-mapped read-only by every app worker, and the downloadable
+# exports of the estimates are written (see exports.py).
+
+########################################################
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import file_digest, read_frame, write_frame
+from compute_animal_farmers import COUNTY_YEAR_PATH, FARMER_COLUMNS, STATE_YEAR_PATH, find_output, read_dataset
+from data_index import DataIndex
+from exports import build_exports
+from metric_registry import DASHBOARD_METRICS, REGISTRY
+
+
+STATE_CODES_PATH = 'data/state_codes.csv'
+SNAPSHOT_PATH = 'data/app_snapshot.npz'
+COUNTY_SNAPSHOT_PATH = 'data/app_snapshot_county.npz'
+COUNTY_GEOJSON_PATH = 'data/counties_simplified.json'
+# Memory-mappable copies of the app index
+SHARED_INDEX_PATH = 'data/app_index'
+COUNTY_SHARED_INDEX_PATH = 'data/app_index_county'
+# Bump when the layout of the snapshot changes, so that older snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+
+def prepare_app_data(source=STATE_YEAR_PATH, state_codes_path: str = STATE_CODES_PATH) -> pd.DataFrame:
+    """
+    Prepares the data displayed by the app from the pipeline output
+
+    Args:
+        source (str or pd.DataFrame): path to the (State, Year) level estimates written by compute_animal_farmers.py
+            (in any of its output formats), or the estimates returned by build_dataset
+        state_codes_path (str): path to the table of state codes
+
+    Returns:
+        data (pd.DataFrame): one row per (State, Year), with state codes and the columns of every dashboard metric
+    """
+    ## Read in cleaned, (State, Year) - level data
+    data = read_dataset(source) if isinstance(source, str) else source.copy()
+    data['State'] = data['State'].astype(str)
+    data = data[data['State'] != "United States"] # only analyze every state
+    data['Year'] = data['Year'].astype(str)
+    # Join state codes
+    state_codes = pd.read_csv(state_codes_path)
+    data = data.merge(state_codes, on='State')
+
+    # Normalization metrics are computed by the app index from their registry expressions
+    available = REGISTRY.available(DASHBOARD_METRICS, data.columns)
+    missing = [metric for metric in DASHBOARD_METRICS if metric not in available]
+    if missing:
+        raise ValueError(f"Metrics missing from the app data: {missing}")
+
+    return data.reset_index(drop=True)
+
+
+def prepare_county_data(source=COUNTY_YEAR_PATH) -> pd.DataFrame:
+    """
+    Prepares the county level data displayed by the app from the pipeline output
+    - 'code' holds the 5 digit FIPS code (the id of the county geometry),
+      'State' the "County, State" label
+
+    Args:
+        source (str or pd.DataFrame): path to the (FIPS, State, County, Year) level estimates written by
+            compute_animal_farmers.py (in any of its output formats), or the estimates returned by build_dataset
+
+    Returns:
+        data (pd.DataFrame): one row per (County, Year), with the farmer estimate metrics
+    """
+    data = read_dataset(source) if isinstance(source, str) else source.copy()
+    data['Year'] = data['Year'].astype(str)
+    data['code'] = data['FIPS'].astype(str).str.zfill(5)
+    data['State'] = data['County'].astype(str) + ', ' + data['State'].astype(str)
+
+    return data[['State', 'code', 'Year'] + FARMER_COLUMNS].reset_index(drop=True)
+
+
+def simplify_geojson(geojson: dict, precision: int = 3) -> dict:
+    """
+    Simplifies a feature collection of (multi)polygons for display on a national map
+    - coordinates are rounded to `precision` decimals (~100 m for 3), and repeated points dropped;
+      shared borders round to the same points, so neighboring polygons still meet
+    - feature properties are dropped, only the feature id is kept
+
+    Args:
+        geojson (dict): feature collection with feature ids (e.g. FIPS codes)
+        precision (int): number of decimals kept in the coordinates
+
+    Returns:
+        (dict): simplified feature collection
+    """
+    def simplify_ring(ring):
+        ring = np.round(np.asarray(ring, dtype='float64'), precision)
+        keep = np.r_[True, np.any(np.diff(ring, axis=0) != 0, axis=1)]
+        # A ring needs at least 4 points (first == last)
+        return (ring[keep] if keep.sum() >= 4 else ring).tolist()
+
+    features = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            coordinates = [simplify_ring(ring) for ring in geometry['coordinates']]
+        else:
+            coordinates = [[simplify_ring(ring) for ring in polygon] for polygon in geometry['coordinates']]
+        features.append({'type': 'Feature', 'id': feature['id'],
+                         'geometry': {'type': geometry['type'], 'coordinates': coordinates}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def build_county_geometry(source: str, path: str = COUNTY_GEOJSON_PATH, precision: int = 3) -> dict:
+    """
+    Writes the simplified county geometry used by the county map
+
+    Args:
+        source (str): path to a county GeoJSON file, with FIPS codes as feature ids
+            (e.g. plotly's geojson-counties-fips.json, downloaded once)
+        path (str): path of the simplified geometry
+        precision (int): number of decimals kept in the coordinates
+
+    Returns:
+        geojson (dict): simplified geometry
+    """
+    with open(source) as f:
+        geojson = simplify_geojson(json.load(f), precision)
+    with open(path, 'w') as f:
+        json.dump(geojson, f, separators=(',', ':'))
+    print(f"Wrote simplified county geometry {path} ({os.path.getsize(path) // 1024} KB)")
+
+    return geojson
+
+
+def build_snapshot(source: str = STATE_YEAR_PATH, path: str = SNAPSHOT_PATH, prepare=prepare_app_data) -> pd.DataFrame:
+    """
+    Writes the snapshot of the app data
+
+    Args:
+        source (str): path to the (State, Year) level estimates (the latest file written in any of the
+            output formats is used, see find_output)
+        path (str): path of the snapshot
+        prepare (callable): function preparing the app data from the source (prepare_county_data for counties)
+
+    Returns:
+        data (pd.DataFrame): app data stored in the snapshot
+    """
+    source = find_output(source)
+    data = prepare(source)
+    data.attrs = {'version': SNAPSHOT_VERSION, 'source_digest': file_digest(source)}
+    # Write to a temporary file first, app workers never see a half-written snapshot
+    tmp_path = path + '.tmp.npz'
+    write_frame(data, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"Wrote app snapshot {path} ({len(data)} rows)")
+
+    return data
+
+
+def load_snapshot(source: str = STATE_YEAR_PATH, path: str = SNAPSHOT_PATH, prepare=prepare_app_data) -> pd.DataFrame:
+    """
+    Loads the app data from the snapshot, falling back to preparing it from the pipeline output
+    when the snapshot is missing or was built from a different version of the source
+
+    Args:
+        source (str): path to the (State, Year) level estimates (the latest file written in any of the
+            output formats is used, see find_output)
+        path (str): path of the snapshot
+        prepare (callable): function preparing the app data from the source (prepare_county_data for counties)
+
+    Returns:
+        data (pd.DataFrame): one row per (State, Year), with state codes and the columns of every dashboard metric
+    """
+    source = find_output(source)
+    if os.path.exists(path):
+        data = read_frame(path)
+        # Deployments may ship the snapshot without the pipeline output
+        if data.attrs.get('version') == SNAPSHOT_VERSION and (
+                not os.path.exists(source) or data.attrs.get('source_digest') == file_digest(source)):
+            return data
+        print(f"App snapshot {path} is out of date, run `python3 snapshot.py` to rebuild it")
+    data = prepare(source)
+    data.attrs = {'version': SNAPSHOT_VERSION, 'source_digest': file_digest(source)}
+    return data
+
+
+def build_shared_index(data: pd.DataFrame, path: str = SHARED_INDEX_PATH) -> DataIndex:
+    """
+    Writes the memory-mappable app index of a snapshot
+
+    Args:
+        data (pd.DataFrame): app data, as returned by build_snapshot (with its version and source digest)
+        path (str): path of the index directory
+
+    Returns:
+        index (DataIndex): index of every dashboard metric available in the data
+    """
+    index = DataIndex(data, DASHBOARD_METRICS)
+    index.save(path)
+    print(f"Wrote shared app index {path} ({len(data)} rows)")
+
+    return index
+
+
+def load_index(source: str = STATE_YEAR_PATH, path: str = SNAPSHOT_PATH, index_path: str = SHARED_INDEX_PATH,
+               prepare=prepare_app_data, shared: bool = True) -> DataIndex:
+    """
+    Loads the app index: memory-maps the shared index when it is up to date, otherwise builds the index
+    from the snapshot (see load_snapshot)
+
+    Args:
+        source (str): path to the pipeline output (the latest file written in any of the output formats is used)
+        path (str): path of the snapshot
+        index_path (str): path of the shared index directory
+        prepare (callable): function preparing the app data from the source (prepare_county_data for counties)
+        shared (bool): use the shared index (False always builds a private index)
+
+    Returns:
+        index (DataIndex): index of every dashboard metric available in the data
+    """
+    source = find_output(source)
+    if shared and os.path.exists(os.path.join(index_path, 'meta.json')):
+        index = DataIndex.load(index_path)
+        if index.attrs.get('version') == SNAPSHOT_VERSION and (
+                not os.path.exists(source) or index.attrs.get('source_digest') == file_digest(source)):
+            return index
+        print(f"Shared app index {index_path} is out of date, run `python3 snapshot.py` to rebuild it")
+    data = load_snapshot(source, path, prepare)
+    return DataIndex(data, DASHBOARD_METRICS)
+
+
+def load_county_snapshot(source: str = COUNTY_YEAR_PATH, path: str = COUNTY_SNAPSHOT_PATH,
+                         geojson_path: str = COUNTY_GEOJSON_PATH, index_path: str = COUNTY_SHARED_INDEX_PATH,
+                         shared: bool = True) -> tuple:
+    """
+    Loads the county level app index and the simplified county geometry
+
+    Args:
+        source (str): path to the county level estimates
+        path (str): path of the county snapshot
+        geojson_path (str): path of the simplified county geometry
+        index_path (str): path of the shared county index directory
+        shared (bool): use the shared index (False always builds a private index)
+
+    Returns:
+        index (DataIndex): index of the county metrics, or None when county data is not available
+        geojson (dict): simplified county geometry, or None when county data is not available
+    """
+    available = os.path.exists(path) or os.path.exists(find_output(source)) or os.path.exists(index_path)
+    if not os.path.exists(geojson_path) or not available:
+        return None, None
+    index = load_index(source, path, index_path, prepare=prepare_county_data, shared=shared)
+    with open(geojson_path) as f:
+        geojson = json.load(f)
+
+    return index, geojson
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the data snapshots of the dashboard")
+    parser.add_argument('--county-geojson', default=None,
+                        help="county GeoJSON file (FIPS feature ids) to simplify for the county map")
+    parser.add_argument('--precision', type=int, default=3,
+                        help="number of decimals kept in the simplified county coordinates (default: 3)")
+    args = parser.parse_args()
+
+    build_shared_index(build_snapshot())
+    build_exports()
+    if os.path.exists(find_output(COUNTY_YEAR_PATH)):
+        build_shared_index(build_snapshot(COUNTY_YEAR_PATH, COUNTY_SNAPSHOT_PATH, prepare=prepare_county_data),
+                           COUNTY_SHARED_INDEX_PATH)
+    if args.county_geojson:
+        build_county_geometry(args.county_geojson, precision=args.precision)
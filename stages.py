@@ -0,0 +1,259 @@
+########################################################
+
+# INCREMENTAL STAGE GRAPH FOR THE FARMER ESTIMATE PIPELINE
+# Each stage declares the source files, upstream stages and output files it
+# depends on. Results are memoized in a FrameCache under a key built from the
+# stage's code, the contents of its source files and the keys of its inputs,
+# so only stages whose key changed are run again.
+# Every run records the wall time, row count and (when traced) peak memory
+# allocated by each stage.
+# Export stages (the stages writing files) can run concurrently in worker
+# processes while the main process computes the next stages.
+
+########################################################
+
+import hashlib
+import inspect
+import json
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from cache import FrameCache, file_digest
+
+
+class Stage:
+    """
+    Named step of the pipeline
+
+    The stage function is called as func(*sources, *input results, *outputs, **params, **kwargs):
+    - sources (list): paths to the files read by the stage
+    - inputs (list): names of the upstream stages whose results are passed in
+    - outputs (list): paths to the files written by the stage (export stages)
+    - code (list): functions (or modules) whose source code is part of the stage key (defaults to func)
+    - params (dict): extra arguments that change the result (part of the stage key, JSON serializable)
+    - kwargs (dict): extra arguments that do not change the result (e.g. number of workers)
+    """
+
+    def __init__(self, name: str, func, sources: list = (), inputs: list = (), outputs: list = (),
+                 code: list = None, params: dict = None, kwargs: dict = None):
+        self.name = name
+        self.func = func
+        self.sources = list(sources)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code) if code is not None else [func]
+        self.params = params or {}
+        self.kwargs = kwargs or {}
+
+    def code_digest(self) -> str:
+        digest = hashlib.sha256()
+        for func in self.code:
+            digest.update(inspect.getsource(func).encode())
+        return digest.hexdigest()
+
+
+def _timed(trace_memory: bool, func, *args, **kwargs) -> tuple:
+    """
+    Worker task: runs a stage function and times it in the worker
+    - with trace_memory, the memory allocated by the function is traced with tracemalloc, from the start
+      of the function only, so each stage reports its own peak (allocations of the processes the function
+      starts are not counted)
+
+    Returns:
+        value: result of the function
+        seconds (float): wall time of the function
+        peak (int): largest number of bytes allocated by the function at once, None when not traced
+    """
+    # Tracing is started and stopped around each stage (tracemalloc.reset_peak needs Python 3.9)
+    tracing = trace_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if tracing else None
+    finally:
+        if tracing:
+            tracemalloc.stop()
+    return value, seconds, peak
+
+
+class Pipeline:
+    """
+    Stage graph with memoized results
+    - stages must be listed in dependency order
+    - with export_workers > 1, stale export stages are handed to a pool of worker processes as soon as
+      their inputs are computed, and are waited for at the end of the run; no stage may depend on an
+      export stage
+    - with trace_memory, the report records the peak memory allocated by each stage (tracing slows down
+      the stages that allocate many Python objects, so it is off by default)
+    """
+
+    def __init__(self, stages: list, cache: FrameCache, export_workers: int = 1, trace_memory: bool = False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache = cache
+        self.export_workers = export_workers
+        self.trace_memory = trace_memory
+        self._keys = {}
+        self.report = []
+
+    def key(self, name: str) -> str:
+        """
+        Computes the memoization key of a stage, without running anything
+
+        Args:
+            name (str): name of the stage
+
+        Returns:
+            (str): cache key of the stage result
+        """
+        if name not in self._keys:
+            stage = self.stages[name]
+            digest = hashlib.sha256(stage.code_digest().encode())
+            digest.update(json.dumps(stage.params, sort_keys=True).encode())
+            for source in stage.sources:
+                digest.update(file_digest(source).encode())
+            for input_name in stage.inputs:
+                digest.update(self.key(input_name).encode())
+            for output in stage.outputs:
+                digest.update(output.encode())
+            self._keys[name] = f'{name}-{digest.hexdigest()[:16]}'
+        return self._keys[name]
+
+    def is_stale(self, name: str) -> bool:
+        """
+        Checks whether a stage has to run: no memoized result, or an output file that is missing or
+        was overwritten since the stage wrote it (e.g. by a run with other years)
+
+        Args:
+            name (str): name of the stage
+
+        Returns:
+            (bool): True if the stage is stale
+        """
+        stage = self.stages[name]
+        if not self.cache.enabled or not os.path.exists(self.cache.path(self.key(name))):
+            return True
+        if not all(os.path.exists(output) for output in stage.outputs):
+            return True
+        if stage.outputs:
+            record = self.cache.get(self.key(name))
+            if record is None or 'digest' not in record.columns:
+                return True
+            return record['digest'].tolist() != [file_digest(output) for output in stage.outputs]
+        return False
+
+    def stale(self) -> list:
+        """
+        Lists the stages that would run, in execution order
+
+        Returns:
+            (list): names of the stale stages
+        """
+        return [name for name in self.stages if self.is_stale(name)]
+
+    def run(self, targets: list = None) -> dict:
+        """
+        Runs the stale stages needed for the targets, loading fresh results from the cache
+
+        Args:
+            targets (list): names of the stages to bring up to date (defaults to the final stages,
+                i.e. stages no other stage depends on)
+
+        Returns:
+            results (dict): stage name -> result of every stage that was run or loaded
+        """
+        results = {}
+        pending = {}
+        self.report = []
+        executor = ProcessPoolExecutor(max_workers=self.export_workers) if self.export_workers > 1 else None
+
+        def result(name):
+            if name in results:
+                return results[name]
+            stage = self.stages[name]
+            key = self.key(name)
+            if not self.is_stale(name):
+                # Results of export stages are the files they wrote, never needed downstream
+                if stage.outputs:
+                    value, seconds, peak = None, 0.0, None
+                else:
+                    value, seconds, peak = _timed(self.trace_memory, self.cache.get, key)
+                if stage.outputs or value is not None:
+                    print(f"Stage {name} is up to date ({key})")
+                    self._record(name, 'cached', seconds, peak, value)
+                    results[name] = value
+                    return value
+            inputs = [result(input_name) for input_name in stage.inputs]
+            args = [*stage.sources, *inputs, *stage.outputs]
+            if executor is not None and stage.outputs:
+                pending[name] = (executor.submit(_timed, self.trace_memory, stage.func, *args, **stage.params,
+                                                 **stage.kwargs), inputs)
+                results[name] = None
+                return None
+            value, seconds, peak = _timed(self.trace_memory, stage.func, *args, **stage.params, **stage.kwargs)
+            finish(name, value, seconds, peak, inputs)
+            return value
+
+        def finish(name, value, seconds, peak, inputs):
+            stage = self.stages[name]
+            # Export stages report the rows they wrote
+            self._record(name, 'run', seconds, peak, value if value is not None else inputs[0])
+            # Export stages memoize a record of the files they wrote, with the digests of their contents
+            self.cache.put(self.key(name), value if value is not None else pd.DataFrame({
+                'output': stage.outputs, 'digest': [file_digest(output) for output in stage.outputs]}))
+            results[name] = value
+
+        if targets is None:
+            needed = {input_name for stage in self.stages.values() for input_name in stage.inputs}
+            targets = [name for name in self.stages if name not in needed]
+        try:
+            for name in targets:
+                result(name)
+            # Export stages finishing in the workers, recorded in submission order
+            for name, (future, inputs) in pending.items():
+                finish(name, *future.result(), inputs)
+        finally:
+            if executor is not None:
+                # Stages not started yet are dropped when a stage failed (shutdown's cancel_futures needs Python 3.9)
+                for future, _ in pending.values():
+                    future.cancel()
+                executor.shutdown(wait=True)
+        return results
+
+    def _record(self, name: str, status: str, seconds: float, peak: int, value):
+        """
+        Adds a stage to the report of the current run
+
+        Args:
+            name (str): name of the stage
+            status (str): 'run', or 'cached' when the result was loaded from the cache
+            seconds (float): wall time of the stage (or of the cache load)
+            peak (int): peak bytes allocated by the stage (or by the cache load), None when not traced
+            value: result of the stage (rows of the written dataset for export stages)
+        """
+        self.report.append({
+            'stage': name,
+            'status': status,
+            'seconds': round(seconds, 6),
+            'rows': len(value) if isinstance(value, pd.DataFrame) else None,
+            'columns': len(value.columns) if isinstance(value, pd.DataFrame) else None,
+            'peak_memory_mb': round(peak / 1024 ** 2, 1) if peak is not None else None,
+        })
+
+    def write_report(self, path: str):
+        """
+        Writes the report of the last run as JSON: one entry per stage, in execution order
+
+        Args:
+            path (str): path of the JSON report
+        """
+        with open(path, 'w') as f:
+            json.dump({'total_seconds': round(sum(entry['seconds'] for entry in self.report), 6),
+                       'stages': self.report}, f, indent=2)
+        print(f"Wrote stage report {path}")
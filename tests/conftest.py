@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+## The modules of the repository are imported from its root directory, like in benchmarks/
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """
+    The dashboard module, loaded from the data of the repository (read relative to its root directory),
+    without the file watch
+    """
+    os.environ.setdefault('RELOAD_INTERVAL', '0')
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    import app
+    yield app
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.server.test_client()
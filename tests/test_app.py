@@ -0,0 +1,103 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from exports import parquet_available
+
+
+def test_metrics(app_module, client):
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    lines = response.get_data(as_text=True).splitlines()
+    assert '# TYPE dash_callback_latency_seconds histogram' in lines
+    assert '# TYPE dash_figure_cache_hits_total counter' in lines
+    # One series whatever the number of data versions
+    assert f'dash_data_reloads_total {app_module.reloader.reloads}' in lines
+    assert f'dash_data_version_info{{data_version="{app_module.reloader.current.version}"}} 1' in lines
+
+
+def dash_callback(client, output, inputs):
+    """
+    Requests a server callback like the browser does, inputs being {component id: (property, value)}
+    """
+    body = {'output': output, 'outputs': {'id': output.split('.')[0], 'property': output.split('.')[1]},
+            'inputs': [{'id': component, 'property': prop, 'value': value} for component, (prop, value) in inputs.items()],
+            'changedPropIds': [f'{component}.{prop}' for component, (prop, _) in inputs.items()], 'state': []}
+    response = client.post('/_dash-update-component', json=body)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()['response'][output.split('.')[0]][output.split('.')[1]]
+
+
+def test_scenario_section(app_module, client):
+    data = app_module.reloader.current
+    year = data.years[-1]
+    sliders = {f'scenario_{parameter}': ('value', [1, 3] if parameter == 'persons_per_farm' else [1, 1])
+               for parameter in app_module.SCENARIO_SLIDERS}
+    figure = dash_callback(client, 'scenario_figure.figure', {'map_dropdown': ('value', 'Farmers_in_animal_ag_feed'),
+                                                              'year_slider': ('value', int(year)), **sliders})
+    traces = {trace.get('name'): trace for trace in figure['data']}
+    baseline = data.index.values['Farmers_in_animal_ag_feed', year]
+    assert sorted(traces['Published estimate']['y'], reverse=True) == sorted(baseline[~np.isnan(baseline)], reverse=True)
+    # At least one person per farm: the median is above the published estimate
+    assert all(median >= published for median, published in zip(traces['Median of the scenarios']['y'],
+                                                                  traces['Published estimate']['y']))
+    # Metrics the assumptions do not change get no bands
+    figure = dash_callback(client, 'scenario_figure.figure', {'map_dropdown': ('value', 'Total_Population'),
+                                                              'year_slider': ('value', int(year)), **sliders})
+    assert figure['data'] == []
+
+
+def test_download(app_module, client):
+    response = client.get('/download/state_year.csv')
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=state_year.csv'
+    full = pd.read_csv(io.BytesIO(response.data))
+    assert client.get('/download/state_year.csv', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    filtered = client.get('/download/state_year.csv?state=Iowa&year=2012,2017&metric=Number_of_Family_Farmers')
+    assert filtered.status_code == 200 and filtered.headers['ETag'] != response.headers['ETag']
+    df = pd.read_csv(io.BytesIO(filtered.data))
+    assert df.columns.tolist() == ['State', 'Year', 'Number_of_Family_Farmers']
+    assert df['State'].unique().tolist() == ['Iowa'] and set(df['Year']) <= {2012, 2017}
+    expected = full[(full['State'] == 'Iowa') & full['Year'].isin([2012, 2017])]['Number_of_Family_Farmers']
+    assert df['Number_of_Family_Farmers'].tolist() == expected.tolist()
+
+    xlsx = client.get('/download/state.xlsx?state=Iowa')
+    assert xlsx.status_code == 200 and pd.read_excel(io.BytesIO(xlsx.data))['State'].tolist() == ['Iowa']
+    assert client.get('/download/state_year.csv?metric=Cattle').status_code == 400
+    assert client.get('/download/county.csv').status_code == 404
+    assert client.get('/download/state_year.txt').status_code == 404
+
+
+def test_parquet_download_needs_a_parquet_engine(client):
+    if parquet_available():
+        assert client.get('/download/state_year.parquet').status_code == 200
+    else:
+        assert client.get('/download/state_year.parquet').status_code == 406
+
+
+def test_figures_are_revalidated_with_their_etag(app_module, client):
+    data = app_module.reloader.current
+    year = data.years[-1]
+    response = client.get(f'/figures/map/Total_Population/{year}.json')
+    assert response.status_code == 200 and response.mimetype == 'application/json'
+    assert response.get_json() == app_module.map_figure(data, 'Total_Population', year)
+    assert response.headers['ETag'].startswith('W/')
+    assert f'max-age={app_module.FIGURE_MAX_AGE}' in response.headers['Cache-Control']
+
+    # A revalidation of an unchanged figure is answered without building or serializing it
+    table = client.get(f'/figures/table/Total_Population/{year}.json')
+    assert table.headers['ETag'] != response.headers['ETag']
+    misses = data.caches['figure_json'].cache_info().misses
+    for etag in [response.headers['ETag'], response.headers['ETag'].replace('W/', '')]:
+        revalidated = client.get(f'/figures/map/Total_Population/{year}.json', headers={'If-None-Match': etag})
+        assert revalidated.status_code == 304 and revalidated.data == b''
+    unbuilt = app_module.figure_etag(data, 'map', 'Total_Registered', year)
+    assert client.get(f'/figures/map/Total_Registered/{year}.json',
+                      headers={'If-None-Match': f'W/"{unbuilt}"'}).status_code == 304
+    assert data.caches['figure_json'].cache_info().misses == misses
+
+    for path in ['/figures/bar/Total_Population/2017.json', f'/figures/map/Unknown/{year}.json',
+                 '/figures/map/Total_Population/1900.json']:
+        assert client.get(path).status_code == 404
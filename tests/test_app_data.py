@@ -0,0 +1,86 @@
+import time
+import weakref
+
+import pytest
+
+import app_data
+from app_data import AppData, DataReloader, cached
+
+
+class Files:
+    """
+    Fake data files: their signature, and the versions loaded from them
+    """
+
+    def __init__(self):
+        self.signature = ('v1',)
+        self.fail = False
+
+    def load(self):
+        if self.fail:
+            raise OSError('half written snapshot')
+        data = AppData.__new__(AppData)
+        data.signature, data.version, data.caches = self.signature, self.signature[0], {}
+        return data
+
+
+@pytest.fixture
+def files(monkeypatch):
+    files = Files()
+    monkeypatch.setattr(app_data, 'data_signature', lambda: files.signature)
+    return files
+
+
+def test_reload_swaps_the_version_when_the_files_change(files):
+    reloader = DataReloader(files.load(), files.load, interval=0)
+    first = reloader.current
+    assert not reloader.reload()
+    files.signature = ('v2',)
+    assert reloader.reload()
+    assert reloader.current.version == 'v2' and reloader.reloads == 1
+    # Requests that read the previous version keep it
+    assert first.version == 'v1'
+    assert reloader.reload(force=True) and reloader.reloads == 2
+
+
+def test_failed_reload_keeps_the_current_version(files):
+    reloader = DataReloader(files.load(), files.load, interval=0)
+    files.signature, files.fail = ('v2',), True
+    assert not reloader.reload()
+    assert reloader.current.version == 'v1' and reloader.reloads == 0
+    # Not retried until the files change again
+    files.fail = False
+    assert not reloader.reload()
+    files.signature = ('v3',)
+    assert reloader.reload() and reloader.current.version == 'v3'
+
+
+def test_request_reload_wakes_the_watch_thread(files):
+    reloader = DataReloader(files.load(), files.load, interval=0)
+    reloader.watch()
+    reloader.request_reload()
+    deadline = time.monotonic() + 5
+    while reloader.reloads == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reloader.reloads == 1
+
+
+def test_cached_values_belong_to_their_version(files):
+    calls = []
+
+    @cached()
+    def figure(data, value):
+        calls.append((data.version, value))
+        return f'{data.version}/{value}'
+
+    first = files.load()
+    assert figure(first, 'a') == figure(first, 'a') == 'v1/a'
+    files.signature = ('v2',)
+    second = files.load()
+    assert figure(second, 'a') == 'v2/a'
+    assert calls == [('v1', 'a'), ('v2', 'a')]
+    assert first.caches['figure'].cache_info().hits == 1
+    # The cache does not keep its version alive: the version is freed without the garbage collector
+    version = weakref.ref(first)
+    del first
+    assert version() is None
@@ -0,0 +1,62 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from cache import FrameCache, read_frame, write_frame
+
+
+def frame(n=100):
+    df = pd.DataFrame({
+        'State': [f'State {i % 7}' for i in range(n)],
+        'Year': np.arange(n, dtype='int16'),
+        'value': np.linspace(0, 1, n, dtype='float32'),
+        'flag': np.arange(n) % 2 == 0,
+        'commodity': pd.Categorical([['Cattle', 'Hogs', 'Corn'][i % 3] for i in range(n)]),
+    })
+    df.columns.name = 'variable'
+    df.attrs = {'version': 2, 'source_digest': 'abc'}
+    return df
+
+
+def test_round_trip(tmp_path):
+    df = frame()
+    write_frame(df, str(tmp_path / 'frame.npz'))
+    loaded = read_frame(str(tmp_path / 'frame.npz'))
+    pdt.assert_frame_equal(loaded, df)
+    assert loaded.columns.name == 'variable'
+    assert loaded.attrs == df.attrs
+    assert list(loaded['commodity'].cat.categories) == ['Cattle', 'Corn', 'Hogs']
+
+
+def test_get_and_put(tmp_path):
+    cache = FrameCache(str(tmp_path / 'cache'))
+    assert cache.get('missing') is None
+    cache.put('a', frame())
+    pdt.assert_frame_equal(cache.get('a'), frame())
+    # A truncated entry is a miss
+    with open(cache.path('a'), 'wb') as f:
+        f.write(b'PK')
+    assert cache.get('a') is None
+    disabled = FrameCache(str(tmp_path / 'cache'), enabled=False)
+    disabled.put('b', frame())
+    assert disabled.get('b') is None and not os.path.exists(cache.path('b'))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = FrameCache(str(tmp_path / 'cache'))
+    cache.put('a', frame())
+    size = os.path.getsize(cache.path('a'))
+    cache.max_bytes = int(2.5 * size)
+    cache.put('b', frame())
+    now = time.time()
+    os.utime(cache.path('a'), (now - 100, now - 100))
+    os.utime(cache.path('b'), (now - 50, now - 50))
+    # Reading a makes b the least recently used entry
+    assert cache.get('a') is not None
+    cache.put('c', frame())
+    assert [os.path.basename(path) for path, _ in cache.entries()] == ['a.npz', 'c.npz']
+    cache.clear()
+    assert cache.entries() == []
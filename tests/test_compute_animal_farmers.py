@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import compute_animal_farmers as caf
+
+
+@pytest.fixture(scope='module')
+def panel():
+    return caf.build_ers_panel()
+
+
+def test_panel_is_typed(panel):
+    assert isinstance(panel['State'].dtype, pd.CategoricalDtype)
+    assert panel['Year'].dtype == caf.YEAR_DTYPE
+    commodities = panel.columns[2:]
+    assert (panel[commodities].dtypes == caf.METRIC_DTYPE).all()
+    assert set(caf.ERS_COMMODITIES) <= set(commodities)
+    assert not panel.duplicated(['State', 'Year']).any()
+
+
+def test_panel_matches_the_per_sheet_cleaning(panel):
+    for state in ['United States', 'Iowa', 'Wyoming']:
+        expected = caf.clean_ers_data(state).fillna(0)
+        rows = panel[panel['State'] == state].reset_index(drop=True)
+        assert rows['Year'].astype(str).tolist() == expected['Year'].astype(str).tolist()
+        for commodity in caf.ERS_COMMODITIES:
+            np.testing.assert_allclose(rows[commodity], pd.to_numeric(expected[commodity]))
+
+
+def test_ers_workers():
+    assert caf.ers_workers(51) == 1
+    assert caf.ers_workers(51, 4) == 4
+    assert caf.ers_workers(3, 8) == 3
+    assert 1 <= caf.ers_workers(100 * 64) <= 64
+
+
+def test_read_ers_sheets_in_workers(panel):
+    sheets = caf.read_ers_sheets(workers=1)
+    assert list(sheets) == panel['State'].cat.categories.tolist()
+    parallel = caf.read_ers_sheets(workers=3)
+    assert list(parallel) == list(sheets)
+    for state in sheets:
+        pd.testing.assert_frame_equal(parallel[state], sheets[state])
+
+
+@pytest.fixture(scope='module')
+def streamed():
+    return caf.stream_ers_data(workers=1)
+
+
+def test_stream_ers_data_matches_the_per_sheet_cleaning(streamed):
+    assert list(streamed.columns[2:]) == caf.ERS_COMMODITIES
+    assert streamed['Year'].dtype == caf.YEAR_DTYPE
+    for state in ['United States', 'Iowa', 'Wyoming']:
+        expected = caf.clean_ers_data(state).fillna(0)
+        rows = streamed[streamed['State'] == state].reset_index(drop=True)
+        assert rows['Year'].astype(str).tolist() == expected['Year'].astype(str).tolist()
+        for commodity in caf.ERS_COMMODITIES:
+            np.testing.assert_allclose(rows[commodity], pd.to_numeric(expected[commodity]))
+
+
+def test_stream_ers_data_in_workers(streamed):
+    pd.testing.assert_frame_equal(caf.stream_ers_data(workers=3), streamed)
+
+
+def test_stream_ers_data_years(streamed):
+    years = ['2012', '2017']
+    selected = caf.stream_ers_data(years=years, workers=1)
+    expected = streamed[np.isin(streamed['Year'], [int(year) for year in years])].reset_index(drop=True)
+    pd.testing.assert_frame_equal(selected, expected)
+
+
+@pytest.fixture
+def dataset():
+    return pd.DataFrame({'State': pd.Categorical(['Iowa', 'Ohio', 'Utah']),
+                         'Year': np.array([2012, 2017, 2017], dtype=caf.YEAR_DTYPE),
+                         'Farmers': [1.5, np.nan, 3.0], 'Name': ['a', None, 'c']})
+
+
+def test_write_xlsx_matches_to_excel(dataset, tmp_path):
+    caf.write_xlsx(dataset, str(tmp_path / 'streamed.xlsx'))
+    dataset.to_excel(str(tmp_path / 'pandas.xlsx'), index=False)
+    pd.testing.assert_frame_equal(pd.read_excel(tmp_path / 'streamed.xlsx'), pd.read_excel(tmp_path / 'pandas.xlsx'))
+
+
+def test_export_dataset_round_trip(dataset, tmp_path):
+    for fmt in ['xlsx', 'csv']:
+        path = str(tmp_path / f'estimates.{fmt}')
+        caf.export_dataset(dataset, path)
+        exported = caf.read_dataset(path)
+        assert exported['Year'].dtype == caf.YEAR_DTYPE
+        np.testing.assert_array_equal(exported['Farmers'], dataset['Farmers'])
+    with pytest.raises(ValueError):
+        caf.export_dataset(dataset, str(tmp_path / 'estimates.txt'))
+
+
+def test_failed_export_keeps_the_previous_file(dataset, tmp_path, monkeypatch):
+    path = str(tmp_path / 'estimates.xlsx')
+    caf.export_dataset(dataset, path)
+    previous = open(path, 'rb').read()
+
+    def failing_write_xlsx(df, tmp_path, sheet_name='Sheet1'):
+        with open(tmp_path, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(caf, 'write_xlsx', failing_write_xlsx)
+    with pytest.raises(OSError):
+        caf.export_dataset(dataset.iloc[:1], path)
+    assert open(path, 'rb').read() == previous
+    assert os.listdir(tmp_path) == ['estimates.xlsx']
+
+
+def test_output_manifest(tmp_path):
+    manifest = str(tmp_path / 'outputs.json')
+    state_year, county = str(tmp_path / 'state_year.xlsx'), str(tmp_path / 'county.xlsx')
+    assert caf.find_output(state_year, manifest) == state_year
+    # Without a manifest entry, the latest output in any format
+    for fmt, mtime in [('xlsx', 100), ('csv', 200)]:
+        open(caf.output_path(state_year, fmt), 'w').close()
+        os.utime(caf.output_path(state_year, fmt), (mtime, mtime))
+    assert caf.find_output(state_year, manifest) == caf.output_path(state_year, 'csv')
+    caf.write_output_manifest({county: {'path': county, 'formats': ['xlsx']}}, manifest)
+    caf.write_output_manifest({state_year: {'path': state_year, 'formats': ['xlsx']}}, manifest)
+    assert set(caf.read_output_manifest(manifest)) == {state_year, county}
+    assert caf.find_output(state_year, manifest) == state_year
+    assert not os.path.exists(manifest + '.tmp')
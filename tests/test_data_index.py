@@ -0,0 +1,176 @@
+import itertools
+import json
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_index import DataIndex
+from metric_registry import Metric, MetricRegistry
+
+REGISTRY = MetricRegistry([Metric('x', 'x', 'x', 'test', ''), Metric('double', 'double', 'double', 'test', '', 'x * 2')])
+OPERATORS = {'gt': np.greater, 'ge': np.greater_equal, 'lt': np.less, 'le': np.less_equal, 'eq': np.equal}
+
+
+@pytest.fixture(scope='module')
+def index():
+    rng = np.random.default_rng(0)
+    n = 40
+    # Ties and missing values, in both years
+    x = rng.integers(0, 10, 2 * n).astype(float)
+    x[rng.random(2 * n) < 0.2] = np.nan
+    data = pd.DataFrame({'State': [f'State {i:02d}' for i in rng.permutation(n)] * 2,
+                         'code': [f'S{i:02d}' for i in range(n)] * 2,
+                         'Year': [2012] * n + [2017] * n, 'x': x})
+    return DataIndex(data, ['x', 'double'], REGISTRY)
+
+
+def reference(index, metric, year, sort, descending, conditions=(), text_filters=(), decimals=None):
+    """
+    Rows matching the filters, sorted like page: missing values last in both directions
+    """
+    values, states, codes = index.values[metric, year], index.states[year], index.codes[year]
+    compared = values if decimals is None else np.round(values, decimals)
+    rows = np.arange(len(values))
+    for operator, bound in conditions:
+        rows = rows[compared[rows] != bound] if operator == 'ne' else rows[OPERATORS[operator](compared[rows], bound)]
+    for key, operator, text in text_filters:
+        keys = [str(value).lower() for value in (states if key == 'name' else codes)[rows]]
+        matches = np.array([text in key if operator == 'contains' else key == text for key in keys], dtype=bool)
+        rows = rows[~matches if operator == 'ne' else matches]
+    if sort != 'value':
+        # Names and codes are unique
+        rows = rows[np.argsort((states if sort == 'name' else codes)[rows])]
+        return list(rows[::-1] if descending else rows)
+    valid = [row for row in rows if not np.isnan(values[row])]
+    missing = [row for row in rows if np.isnan(values[row])]
+    return sorted(valid, key=lambda row: values[row], reverse=descending) + missing
+
+
+def check_page(index, metric, year, sort, descending, conditions=(), text_filters=(), decimals=None):
+    expected = reference(index, metric, year, sort, descending, conditions, text_filters, decimals)
+    pages = []
+    for start in range(0, len(index.states[year]), 7):
+        rows, total = index.page(metric, year, start, start + 7, sort, descending, conditions, text_filters, decimals)
+        assert total == len(expected)
+        pages.extend(rows.tolist())
+    values = index.values[metric, year]
+    if sort == 'value':
+        # Ties may come in any order: compare the values, then the rows
+        np.testing.assert_array_equal(values[pages], values[expected])
+        assert sorted(pages) == sorted(expected)
+    else:
+        assert pages == list(expected)
+
+
+@pytest.mark.parametrize('metric,year,sort,descending', list(itertools.product(
+    ['x', 'double'], ['2012', '2017'], ['value', 'name', 'code'], [True, False])))
+def test_page_sorts(index, metric, year, sort, descending):
+    check_page(index, metric, year, sort, descending)
+
+
+@pytest.mark.parametrize('conditions', [
+    [('gt', 4.0)], [('ge', 4.0)], [('lt', 4.0)], [('le', 4.0)], [('eq', 4.0)], [('eq', 4.5)], [('ne', 4.0)],
+    [('ge', 2.0), ('lt', 7.0)], [('gt', 8.0), ('lt', 2.0)], [('le', 6.0), ('ne', 3.0), ('ne', 5.0)],
+])
+@pytest.mark.parametrize('sort,descending', [('value', True), ('value', False), ('name', False)])
+def test_page_filters_on_the_metric(index, conditions, sort, descending):
+    check_page(index, 'x', '2017', sort, descending, conditions)
+
+
+@pytest.mark.parametrize('text_filters', [
+    [('name', 'contains', '1')], [('name', 'eq', 'state 07')], [('name', 'ne', 'state 07')], [('code', 'eq', 's03')],
+])
+def test_page_filters_on_the_names(index, text_filters):
+    check_page(index, 'x', '2012', 'value', True, [('ge', 3.0)], text_filters)
+    check_page(index, 'x', '2012', 'code', True, (), text_filters)
+
+
+@pytest.mark.parametrize('operator', list(OPERATORS))
+@pytest.mark.parametrize('bound', [-1.0, 0.0, 3.0, 3.5, 9.0, 10.0])
+def test_rank_range(index, operator, bound):
+    first, last = index.rank_range('double', '2012', [(operator, bound)])
+    values = index.values['double', '2012'][index.order['double', '2012']]
+    ranks = np.flatnonzero(OPERATORS[operator](values, bound))
+    # The matching ranks are exactly the contiguous range [first, last)
+    assert ranks.tolist() == list(range(first, last))
+
+
+def test_saved_index_stores_the_computed_metrics(index, tmp_path):
+    index.save(str(tmp_path / 'index'))
+    loaded = DataIndex.load(str(tmp_path / 'index'))
+    for year in index.years:
+        # Read from the files, not evaluated
+        assert dict.__contains__(loaded.values, ('double', year)) and dict.__contains__(loaded.order, ('double', year))
+        np.testing.assert_array_equal(loaded.values['double', year], index.values['double', year])
+        np.testing.assert_array_equal(loaded.order['double', year], index.order['double', year])
+
+
+def test_index_saved_without_the_computed_metrics(index, tmp_path):
+    index.save(str(tmp_path / 'index'))
+    with open(tmp_path / 'index' / 'meta.json') as f:
+        meta = json.load(f)
+    del meta['stored']
+    with open(tmp_path / 'index' / 'meta.json', 'w') as f:
+        json.dump(meta, f)
+    loaded = DataIndex.load(str(tmp_path / 'index'))
+    loaded.registry = REGISTRY
+    assert not dict.__contains__(loaded.values, ('double', '2017'))
+    np.testing.assert_array_equal(loaded.values['double', '2017'], index.values['double', '2017'])
+
+
+@pytest.fixture(scope='module')
+def ratios():
+    rng = np.random.default_rng(1)
+    n = 60
+    x = rng.random(n)
+    # Values equal once rounded to 4 decimals, and one on a rounding half
+    x[rng.random(n) < 0.1] = np.nan
+    x[:3] = [0.748712, 0.748698, 0.74865]
+    data = pd.DataFrame({'State': [f'State {i:02d}' for i in range(n)], 'code': [f'S{i:02d}' for i in range(n)],
+                         'Year': [2017] * n, 'x': x})
+    return DataIndex(data, ['x'], REGISTRY)
+
+
+def test_conditions_compare_the_displayed_values(ratios):
+    rows, total = ratios.page('x', '2017', 0, 10, conditions=[('eq', 0.7487)], decimals=4)
+    assert total == 2 and sorted(rows.tolist()) == [0, 1]
+    # Without rounding, the shown value matches nothing
+    assert ratios.page('x', '2017', 0, 10, conditions=[('eq', 0.7487)])[1] == 0
+
+
+@pytest.mark.parametrize('operator', ['gt', 'ge', 'lt', 'le', 'eq', 'ne'])
+@pytest.mark.parametrize('bound', [0.7487, 0.7486, 0.5, 0.12345])
+@pytest.mark.parametrize('sort,descending', [('value', True), ('value', False), ('code', True)])
+def test_rounded_conditions(ratios, operator, bound, sort, descending):
+    check_page(ratios, 'x', '2017', sort, descending, [(operator, bound)], decimals=4)
+
+
+CLIENTSIDE_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'clientside.js')
+RUN_UPDATE_TABLE = """
+global.window = {};
+require(process.argv[1]);
+const cases = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const update_table = window.dash_clientside.animal_farmers.update_table;
+console.log(JSON.stringify(cases.queries.map(query => update_table('x', 2017, 0, 100, [], query, cases.store))));
+"""
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_clientside_filters_match_the_server(ratios):
+    values = ratios.values['x', '2017']
+    store = {'rows': {'2017': {'State': ratios.states['2017'].tolist(), 'code': ratios.codes['2017'].tolist(),
+                               'x': np.where(np.isnan(values), None, values).tolist()}},
+             'titles': {'x': 'x'}, 'decimals': 4}
+    conditions = [(operator, bound) for operator in ['gt', 'ge', 'lt', 'le', 'eq', 'ne'] for bound in [0.7487, 0.7486, 0.5]]
+    symbols = {'gt': '>', 'ge': '>=', 'lt': '<', 'le': '<=', 'eq': '=', 'ne': '!='}
+    queries = [f'{{value}} {symbols[operator]} {bound}' for operator, bound in conditions]
+    output = subprocess.run(['node', '-e', RUN_UPDATE_TABLE, CLIENTSIDE_JS], input=json.dumps({'store': store, 'queries': queries}),
+                            capture_output=True, text=True, check=True).stdout
+    for condition, (data, _, _, message) in zip(conditions, json.loads(output)):
+        rows, _ = ratios.page('x', '2017', 0, 100, conditions=[condition], decimals=4)
+        assert message == ''
+        assert sorted(row['code'] for row in data) == sorted(ratios.codes['2017'][rows].tolist()), condition
@@ -0,0 +1,76 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import exports
+from compute_animal_farmers import export_dataset
+
+
+def estimates(scale=1):
+    state_year = pd.DataFrame({'State': ['Iowa', 'Iowa', 'Ohio', 'Ohio', 'Utah', 'Utah'],
+                               'Year': [2012, 2017] * 3,
+                               'Farmers': [float(scale * i) for i in range(6)],
+                               'Voters': [10.0, 20.0, 30.0, 40.0, 50.0, 60.0]})
+    state = pd.DataFrame({'State': ['Iowa', 'Ohio', 'Utah'], 'Farmers_2017': [1.0, 3.0, 5.0],
+                          'Farmers_2012': [0.0, 2.0, 4.0], 'Voters_2017': [20.0, 40.0, 60.0]})
+    return state_year, state
+
+
+@pytest.fixture
+def sources(tmp_path):
+    sources = {'state_year': str(tmp_path / 'state_year.csv'), 'state': str(tmp_path / 'state.csv')}
+    for table, df in zip(sources, estimates()):
+        export_dataset(df, sources[table])
+    return sources
+
+
+@pytest.fixture
+def store(sources, tmp_path):
+    return exports.load_exports(str(tmp_path / 'exports'), sources)
+
+
+def test_select(store):
+    df = store.select('state_year', ['Farmers'], ['2017'], ['Iowa', 'Utah'])
+    assert df.columns.tolist() == ['State', 'Year', 'Farmers']
+    assert df.values.tolist() == [['Iowa', '2017', 1.0], ['Utah', '2017', 5.0]]
+    assert store.metrics('state') == ['Farmers', 'Voters']
+    assert store.select('state', ['Farmers'], ['2012']).columns.tolist() == ['State', 'Farmers_2012']
+    assert store.select('state', years=['2017']).columns.tolist() == ['State', 'Farmers_2017', 'Voters_2017']
+    for unknown in [{'metrics': ['Cattle']}, {'states': ['Atlantis']}]:
+        with pytest.raises(ValueError):
+            store.select('state_year', **unknown)
+
+
+def test_iter_csv(store, monkeypatch):
+    monkeypatch.setattr(exports, 'CHUNK_ROWS', 4)
+    df = store.select('state_year')
+    chunks = list(store.iter_csv(df))
+    assert len(chunks) == 3
+    pd.testing.assert_frame_equal(pd.read_csv(io.StringIO(''.join(chunks)), dtype={'Year': str}), df.astype({'State': str}))
+
+
+def test_filtered_exports_are_written_once_and_evicted(store, monkeypatch):
+    monkeypatch.setattr(exports, 'MAX_FILTERED_EXPORTS', 2)
+    paths = [store.filtered_path('state_year', 'xlsx', store.select('state_year', states=[state]), state)
+             for state in ['Iowa', 'Ohio']]
+    assert store.filtered_path('state_year', 'xlsx', None, 'Iowa') == paths[0]
+    assert pd.read_excel(paths[1])['State'].unique().tolist() == ['Ohio']
+    store.filtered_path('state_year', 'xlsx', store.select('state_year', states=['Utah']), 'Utah')
+    assert len(os.listdir(os.path.dirname(paths[0]))) == 2
+
+
+def test_new_versions_replace_the_oldest(sources, tmp_path, monkeypatch):
+    monkeypatch.setattr(exports, 'KEEP_EXPORT_VERSIONS', 2)
+    directory = str(tmp_path / 'exports')
+    versions = []
+    for scale in range(1, 4):
+        export_dataset(estimates(scale)[0], sources['state_year'])
+        versions.append(os.path.basename(exports.build_exports(directory, sources)))
+        # Versions are ordered by modification time
+        os.utime(os.path.join(directory, versions[-1]), (scale, scale))
+    assert len(set(versions)) == 3
+    assert exports.export_versions(directory) == versions[:0:-1]
+    store = exports.load_exports(directory, sources)
+    assert store.version == versions[-1] and store.tables['state_year']['Farmers'].tolist()[1] == 3.0
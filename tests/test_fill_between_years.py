@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from compute_animal_farmers import fill_between_years
+
+
+def panel():
+    # Iowa has values in 2012 and 2016, Ohio only in 2014; rows are not sorted
+    return pd.DataFrame({
+        'State': ['Ohio', 'Iowa', 'Iowa', 'Iowa', 'Iowa', 'Iowa', 'Ohio', 'Ohio', 'Iowa'],
+        'Year': [2014, 2016, 2011, 2012, 2013, 2017, 2012, 2017, 2014],
+        'count': [7.0, 50.0, np.nan, 10.0, np.nan, np.nan, np.nan, np.nan, np.nan],
+    })
+
+
+def values(df, state):
+    rows = df[df['State'] == state].sort_values('Year')
+    return dict(zip(rows['Year'], rows['count']))
+
+
+def test_interpolate():
+    filled = fill_between_years(panel(), ['count'], 'interpolate')
+    iowa = values(filled, 'Iowa')
+    # Missing before the first value, linear between values, carried forward after the last one
+    assert np.isnan(iowa[2011])
+    assert [iowa[year] for year in (2012, 2013, 2014, 2016, 2017)] == [10.0, 20.0, 30.0, 50.0, 50.0]
+    ohio = values(filled, 'Ohio')
+    assert np.isnan(ohio[2012]) and ohio[2014] == 7.0 and ohio[2017] == 7.0
+
+
+def test_ffill():
+    iowa = values(fill_between_years(panel(), ['count'], 'ffill'), 'Iowa')
+    assert [iowa[year] for year in (2012, 2013, 2014, 2016, 2017)] == [10.0, 10.0, 10.0, 50.0, 50.0]
+
+
+def test_count_columns_are_rounded():
+    df = panel()
+    df.loc[df['Year'] == 2016, 'count'] = 17.0
+    filled = fill_between_years(df, ['count'], 'interpolate', count_columns=['count'])
+    # 10 -> 17 over four years: 11.75 is rounded to 12
+    assert values(filled, 'Iowa')[2013] == 12.0
+    counts = filled['count'].dropna()
+    assert (counts == np.rint(counts)).all()
+
+
+def test_none_returns_the_input():
+    df = panel()
+    assert fill_between_years(df, ['count'], 'none') is df
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from metric_registry import Metric, MetricRegistry, compile_expression
+
+
+def metric(name, expression=None):
+    return Metric(name, name, name, 'test', '', expression)
+
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os').system('true')",
+    'share.real',
+    'share[0]',
+    'share if share else farmers',
+    'lambda: share',
+    'share > farmers',
+    'rint(share, out=farmers)',
+    'round(share)',
+])
+def test_rejects_syntax_outside_the_whitelist(expression):
+    with pytest.raises(ValueError):
+        compile_expression(expression)
+
+
+def test_compiles_arithmetic_and_whitelisted_functions():
+    _, names = compile_expression('rint(share * `Number of farmers`) / abs(-farmers) ** 2')
+    assert list(names.values()) == ['share', 'Number of farmers', 'farmers']
+
+
+def test_registry_evaluates_metrics_of_metrics():
+    registry = MetricRegistry([metric('farmers'), metric('share'), metric('animal', 'rint(share * farmers)'),
+                               metric('per_farm', 'animal / farmers')])
+    assert registry.requirements('per_farm') == ['share', 'farmers']
+    columns = {'farmers': np.array([10.0, 4.0]), 'share': np.array([0.26, 0.5])}
+    np.testing.assert_array_equal(registry.evaluate('per_farm', columns), [0.3, 0.5])
+    assert registry.available(['animal', 'per_farm'], ['farmers']) == []
+
+
+def test_registry_rejects_cycles():
+    with pytest.raises(ValueError):
+        MetricRegistry([metric('a', 'b + 1'), metric('b', 'a * 2')])
@@ -0,0 +1,27 @@
+from metrics import Histogram, render_counter, render_info
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency_seconds', 'Latency', (0.1, 1))
+    for value in (0.05, 0.5, 2):
+        histogram.observe('a', value)
+    histogram.observe('b"', 0.05)
+    lines = histogram.render().splitlines()
+    assert lines[:2] == ['# HELP latency_seconds Latency', '# TYPE latency_seconds histogram']
+    assert 'latency_seconds_bucket{callback="a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{callback="a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{callback="a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{callback="a"} 2.55' in lines
+    assert 'latency_seconds_count{callback="a"} 3' in lines
+    assert 'latency_seconds_count{callback="b\\""} 1' in lines
+
+
+def test_counters():
+    assert render_counter('hits_total', 'Hits', {'map': 3}, label='cache').splitlines()[2] == 'hits_total{cache="map"} 3'
+    assert render_counter('reloads_total', 'Reloads', 2).splitlines() == [
+        '# HELP reloads_total Reloads', '# TYPE reloads_total counter', 'reloads_total 2']
+
+
+def test_info():
+    assert render_info('version_info', 'Version', 'version', 'abc').splitlines() == [
+        '# HELP version_info Version', '# TYPE version_info gauge', 'version_info{version="abc"} 1']
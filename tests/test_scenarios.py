@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scenarios import BASELINE, SCENARIO_METRICS, ScenarioEngine, sample_scenarios
+
+
+@pytest.fixture(scope='module')
+def index(app_module):
+    return app_module.reloader.current.index
+
+
+def test_baseline_reproduces_the_published_estimates(index):
+    engine = ScenarioEngine(index)
+    results = engine.evaluate(sample_scenarios(3, BASELINE))
+    for i, year in enumerate(engine.years):
+        rows = pd.Index(engine.states).get_indexer(index.states[year])
+        for metric in SCENARIO_METRICS:
+            for scenario in results[metric]:
+                np.testing.assert_allclose(scenario[i, rows], index.values[metric, year], rtol=1e-12, err_msg=metric)
+
+
+def test_bands_are_ordered_and_widen_with_the_ranges(index):
+    engine = ScenarioEngine(index)
+    year = engine.years[-1]
+    narrow = engine.bands_table(sample_scenarios(500, {'persons_per_farm': (1, 1.5)}), 'Farmers_in_animal_ag_feed', year)
+    wide = engine.bands_table(sample_scenarios(500, {'persons_per_farm': (1, 3)}), 'Farmers_in_animal_ag_feed', year)
+    assert (narrow['q05'] <= narrow['q50']).all() and (narrow['q50'] <= narrow['q95']).all()
+    assert ((wide['q95'] - wide['q05']) >= (narrow['q95'] - narrow['q05'])).all()
+    # Counting at least one person per farm never lowers the estimates
+    assert (narrow['q05'] >= narrow['baseline']).all()
+
+
+def test_sample_scenarios():
+    scenarios = sample_scenarios(100, {'feed_weight': (0, 1), 'persons_per_farm': 2}, seed=1)
+    assert set(scenarios) == set(BASELINE)
+    assert ((scenarios['feed_weight'] >= 0) & (scenarios['feed_weight'] <= 1)).all()
+    assert (scenarios['persons_per_farm'] == 2).all() and (scenarios['population_factor'] == 1).all()
+    np.testing.assert_array_equal(sample_scenarios(100, {'feed_weight': (0, 1)}, seed=1)['feed_weight'],
+                                  scenarios['feed_weight'])
+    with pytest.raises(ValueError):
+        sample_scenarios(10, {'unknown': (0, 1)})
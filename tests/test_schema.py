@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from schema import left_join
+
+
+def test_left_join_matches_merge():
+    left = pd.DataFrame({'State': pd.Categorical(['Iowa', 'Ohio', 'Utah', None, 'Iowa']),
+                         'Year': [2017, 2012, 2017, 2017, 2012], 'a': [1, 2, 3, 4, 5]})
+    # Categories in another order, and a key absent from the left table
+    right = pd.DataFrame({'State': pd.Categorical(['Ohio', 'Iowa', 'Iowa', 'Maine']),
+                          'Year': [2012, 2017, 2012, 2017], 'b': [10.0, 20.0, 30.0, 40.0]})
+    joined = left_join(left, right, ['State', 'Year'])
+    expected = left.merge(right, on=['State', 'Year'], how='left')
+    assert joined['a'].tolist() == left['a'].tolist()
+    pd.testing.assert_series_equal(joined['b'], expected['b'])
+    assert list(joined.columns) == ['State', 'Year', 'a', 'b']
+
+
+def test_left_join_string_keys():
+    left = pd.DataFrame({'FIPS': ['19001', '19003', '99999'], 'x': [1, 2, 3]})
+    right = pd.DataFrame({'FIPS': ['19003', '19001'], 'y': ['b', 'a']})
+    joined = left_join(left, right, ['FIPS'])
+    assert joined['y'].iloc[:2].tolist() == ['a', 'b']
+    assert joined['y'].isna().iloc[2]
+
+
+def test_left_join_rejects_duplicate_right_keys():
+    left = pd.DataFrame({'State': ['Iowa'], 'Year': [2017]})
+    right = pd.DataFrame({'State': ['Iowa', 'Iowa'], 'Year': [2017, 2017], 'b': [1, 2]})
+    with pytest.raises(ValueError):
+        left_join(left, right, ['State', 'Year'])
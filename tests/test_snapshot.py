@@ -0,0 +1,46 @@
+import functools
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from compute_animal_farmers import export_dataset, read_dataset
+from snapshot import build_shared_index, build_snapshot, load_index, prepare_app_data
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+METRIC = 'Number_of_Family_Farmers'
+
+
+@pytest.fixture
+def paths(tmp_path):
+    source = str(tmp_path / 'estimates.xlsx')
+    shutil.copyfile(os.path.join(DATA, 'family_farmer_estimates_state_year_level.xlsx'), source)
+    prepare = functools.partial(prepare_app_data, state_codes_path=os.path.join(DATA, 'state_codes.csv'))
+    return {'source': source, 'path': str(tmp_path / 'snapshot.npz'), 'index_path': str(tmp_path / 'index'),
+            'prepare': prepare}
+
+
+def test_up_to_date_index_is_memory_mapped(paths):
+    data = build_snapshot(paths['source'], paths['path'], paths['prepare'])
+    built = build_shared_index(data, paths['index_path'])
+    index = load_index(**paths)
+    year = index.years[-1]
+    assert isinstance(index.values[METRIC, year], np.memmap) and not index.values[METRIC, year].flags.writeable
+    np.testing.assert_array_equal(index.values[METRIC, year], built.values[METRIC, year])
+    np.testing.assert_array_equal(index.order[METRIC, year], built.order[METRIC, year])
+    # Without the shared index, a private copy
+    assert not isinstance(load_index(**paths, shared=False).values[METRIC, year], np.memmap)
+
+
+def test_stale_index_is_rebuilt_from_the_source(paths, capsys):
+    build_shared_index(build_snapshot(paths['source'], paths['path'], paths['prepare']), paths['index_path'])
+    estimates = read_dataset(paths['source'])
+    estimates[METRIC] = estimates[METRIC] * 2
+    export_dataset(estimates, paths['source'])
+    index = load_index(**paths)
+    assert 'out of date' in capsys.readouterr().out
+    year = index.years[-1]
+    assert not isinstance(index.values[METRIC, year], np.memmap)
+    expected = estimates[(estimates['Year'].astype(str) == year) & (estimates['State'] != 'United States')]
+    assert np.nansum(index.values[METRIC, year]) == pytest.approx(np.nansum(expected[METRIC]))
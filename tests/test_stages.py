@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cache import FrameCache
+from stages import Pipeline, Stage
+
+
+def load(path):
+    return pd.read_csv(path)
+
+
+def scale(df, factor=1):
+    return df * factor
+
+
+def allocate(df, megabytes):
+    return df.assign(b=np.ones(megabytes * 1024 ** 2 // 8).sum())
+
+
+def export(df, output):
+    df.to_csv(output, index=False)
+
+
+@pytest.fixture
+def files(tmp_path):
+    source = tmp_path / 'source.csv'
+    source.write_text('a\n1\n2\n')
+    return str(source), str(tmp_path / 'output.csv'), FrameCache(str(tmp_path / 'cache'))
+
+
+def pipeline(files, factor=2, enabled=True):
+    source, output, cache = files
+    cache.enabled = enabled
+    return Pipeline([Stage('load', load, sources=[source]),
+                     Stage('scale', scale, inputs=['load'], params={'factor': factor}),
+                     Stage('export', export, inputs=['scale'], outputs=[output])], cache)
+
+
+def test_run_then_up_to_date(files):
+    assert pipeline(files).stale() == ['load', 'scale', 'export']
+    results = pipeline(files).run()
+    assert pd.read_csv(files[1])['a'].tolist() == [2, 4]
+    assert results['export'] is None
+    up_to_date = pipeline(files)
+    assert up_to_date.stale() == []
+    up_to_date.run(['scale'])
+    assert [entry['status'] for entry in up_to_date.report] == ['cached']
+
+
+def test_changed_source_makes_downstream_stale(files):
+    pipeline(files).run()
+    with open(files[0], 'w') as f:
+        f.write('a\n5\n')
+    assert pipeline(files).stale() == ['load', 'scale', 'export']
+    pipeline(files).run()
+    assert pd.read_csv(files[1])['a'].tolist() == [10]
+
+
+def test_changed_params_only_rerun_the_stage_and_its_dependents(files):
+    pipeline(files).run()
+    assert pipeline(files, factor=3).stale() == ['scale', 'export']
+
+
+def test_missing_or_overwritten_output_makes_the_export_stale(files):
+    pipeline(files).run()
+    with open(files[1], 'w') as f:
+        f.write('a\n0\n')
+    assert pipeline(files).stale() == ['export']
+    os.remove(files[1])
+    assert pipeline(files).stale() == ['export']
+    pipeline(files).run()
+    assert pd.read_csv(files[1])['a'].tolist() == [2, 4]
+
+
+def test_disabled_cache_runs_every_stage(files):
+    pipeline(files).run()
+    assert pipeline(files, enabled=False).stale() == ['load', 'scale', 'export']
+
+
+def test_report(files, tmp_path):
+    source, output, cache = files
+    traced = Pipeline([Stage('load', load, sources=[source]),
+                       Stage('scale', scale, inputs=['load'], params={'factor': 2}),
+                       Stage('allocate', allocate, inputs=['scale'], params={'megabytes': 8}),
+                       Stage('export', export, inputs=['scale'], outputs=[output])], cache, trace_memory=True)
+    traced.run()
+    traced.write_report(str(tmp_path / 'report.json'))
+    with open(tmp_path / 'report.json') as f:
+        report = json.load(f)
+    stages = {entry['stage']: entry for entry in report['stages']}
+    assert set(stages) == {'load', 'scale', 'export', 'allocate'}
+    assert all(entry['status'] == 'run' and entry['seconds'] >= 0 and entry['peak_memory_mb'] is not None
+               for entry in stages.values())
+    assert stages['allocate']['peak_memory_mb'] >= 8
+    assert (stages['load']['rows'], stages['load']['columns']) == (2, 1)
+    assert report['total_seconds'] == pytest.approx(sum(entry['seconds'] for entry in report['stages']), abs=1e-5)
+    # Without tracing, no memory is reported
+    untraced = pipeline(files, enabled=False)
+    untraced.run()
+    assert all(entry['peak_memory_mb'] is None for entry in untraced.report)